@@ -17,6 +17,7 @@ load the data
 -------------
 """
 
+import os
 import pickle
 import re
 import requests
@@ -125,40 +126,39 @@ response = requests.get(
     "osmfish_codeluppi_2018_nat-methods_somatosensory-cortex/"
     "osmFISH_SScortex_mouse_all_cells.loom"
 )
+region_columns = {
+    MATRIX_REQUIRED_REGIONS.X_REGION: "X",
+    MATRIX_REQUIRED_REGIONS.Y_REGION: "Y",
+    MATRIX_OPTIONAL_REGIONS.GROUP_ID: "ClusterID",
+    MATRIX_OPTIONAL_REGIONS.TYPE_ANNOTATION: "ClusterName",
+    MATRIX_OPTIONAL_REGIONS.PHYS_ANNOTATION: "Region",
+    MATRIX_OPTIONAL_REGIONS.AREA_PIXELS: "size_pix",
+    MATRIX_OPTIONAL_REGIONS.AREA_UM2: "size_um2",
+    "valid": "Valid",
+    "tsne_1": "_tSNE_1",
+    "tsne_2": "_tSNE_2",
+}
+feature_rows = {
+    MATRIX_OPTIONAL_FEATURES.CHANNEL: "Fluorophore",
+    MATRIX_OPTIONAL_FEATURES.ROUND: "Hybridization",
+}
+
 with tempfile.TemporaryDirectory() as tmpdirname:
     with open(os.path.join(tmpdirname, "temp.loom"), 'wb') as f:
         f.write(response.content)
-    conn = loompy.connect(os.path.join(tmpdirname, "temp.loom"), mode="r")
-
-    row_attrs = dict(conn.row_attrs)
-    col_attrs = dict(conn.col_attrs)
-
-    data = da.from_array(conn[:, :].T, chunks=MATRIX_CHUNK_SIZE)
-
-# region id should be int dtype
-col_attrs["CellID"] = col_attrs["CellID"].astype(int)
-
-dims = (MATRIX_AXES.REGIONS.value, MATRIX_AXES.FEATURES.value)
-
-coords = {
-    MATRIX_REQUIRED_REGIONS.REGION_ID: (MATRIX_AXES.REGIONS, col_attrs["CellID"]),
-    MATRIX_REQUIRED_REGIONS.X_REGION: (MATRIX_AXES.REGIONS, col_attrs["X"]),
-    MATRIX_REQUIRED_REGIONS.Y_REGION: (MATRIX_AXES.REGIONS, col_attrs["Y"]),
-    MATRIX_OPTIONAL_REGIONS.GROUP_ID: (MATRIX_AXES.REGIONS, col_attrs["ClusterID"]),
-    MATRIX_OPTIONAL_REGIONS.TYPE_ANNOTATION: (MATRIX_AXES.REGIONS, col_attrs["ClusterName"]),
-    MATRIX_OPTIONAL_REGIONS.PHYS_ANNOTATION: (MATRIX_AXES.REGIONS, col_attrs["Region"]),
-    MATRIX_OPTIONAL_REGIONS.AREA_PIXELS: (MATRIX_AXES.REGIONS, col_attrs["size_pix"]),
-    MATRIX_OPTIONAL_REGIONS.AREA_UM2: (MATRIX_AXES.REGIONS, col_attrs["size_um2"]),
-    "valid": (MATRIX_AXES.REGIONS, col_attrs["Valid"]),
-    "tsne_1": (MATRIX_AXES.REGIONS, col_attrs["_tSNE_1"]),
-    "tsne_2": (MATRIX_AXES.REGIONS, col_attrs["_tSNE_2"]),
-    MATRIX_OPTIONAL_FEATURES.CHANNEL: (MATRIX_AXES.FEATURES, row_attrs["Fluorophore"]),
-    MATRIX_REQUIRED_FEATURES.GENE_NAME: (MATRIX_AXES.FEATURES, row_attrs["Gene"]),
-    MATRIX_OPTIONAL_FEATURES.ROUND.value: (MATRIX_AXES.FEATURES, row_attrs["Hybridization"]),
-}
 
-matrix = starspace.Matrix.from_expression_data(
-    data=data, coords=coords, dims=dims, name="matrix", attrs=attributes
-)
-matrix.save_zarr(url=url)
+    # the matrix is read lazily, so it's saved before the file is deleted
+    matrix = starspace.Matrix.from_loom(
+        os.path.join(tmpdirname, "temp.loom"), attrs=attributes, regions=region_columns,
+        features=feature_rows,
+    )
+
+    # region id should be int dtype
+    matrix = matrix.assign_coords({
+        MATRIX_REQUIRED_REGIONS.REGION_ID.value: (
+            MATRIX_AXES.REGIONS.value,
+            matrix[MATRIX_REQUIRED_REGIONS.REGION_ID.value].values.astype(int),
+        )
+    })
+    matrix.save_zarr(url=url)
 
@@ -0,0 +1,145 @@
+from typing import Optional, Sequence
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+WEIGHT_TRANSFORMS = ("row", "binary", None)
+
+# default size of the dense regions x features block each task holds, in bytes
+_BLOCK_BYTES = 2 ** 27
+
+
+def spatial_weights(graph: sp.spmatrix, transform: Optional[str] = "row") -> sp.csr_matrix:
+    """spatial weights from a neighbor graph
+
+    transform="binary" gives every neighbor a weight of 1, "row" does the same and then scales
+    each row to sum to 1, and None uses the entries of graph as they are.
+    """
+    if transform not in WEIGHT_TRANSFORMS:
+        raise ValueError(f"transform must be one of {WEIGHT_TRANSFORMS}, not {transform}")
+    weights = sp.csr_matrix(graph, dtype=float, copy=True)
+    if transform is None:
+        return weights
+    weights.data[:] = 1
+    if transform == "row":
+        row_sums = np.asarray(weights.sum(axis=1)).ravel()
+        row_sums[row_sums == 0] = 1
+        weights = sp.csr_matrix(sp.diags(1 / row_sums) @ weights)
+    return weights
+
+
+def _statistics(
+    z: np.ndarray, sum_of_squares: np.ndarray, weights: sp.csr_matrix, degrees: np.ndarray
+):
+    """Moran's I and Geary's C of each column of the centered values z"""
+    n = z.shape[0]
+    s0 = weights.sum()
+    cross = np.einsum("ij,ij->j", z, weights @ z)
+    squared_differences = degrees @ (z ** 2) - 2 * cross
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moran = n / s0 * cross / sum_of_squares
+        geary = (n - 1) / (2 * s0) * squared_differences / sum_of_squares
+    return moran, geary
+
+
+def _pseudo_p_values(observed: np.ndarray, permuted: np.ndarray) -> np.ndarray:
+    """one-sided permutation p-values, towards whichever tail the observed value is in"""
+    n_permutations = permuted.shape[0]
+    larger = (permuted >= observed).sum(axis=0)
+    larger = np.where(larger > n_permutations / 2, n_permutations - larger, larger)
+    # features without variance have no statistic to test
+    return np.where(np.isnan(observed), np.nan, (larger + 1) / (n_permutations + 1))
+
+
+def _block_autocorrelation(
+    block,
+    weights: sp.csr_matrix,
+    degrees: np.ndarray,
+    n_permutations: int,
+    permutation_batch: int,
+    seed: int,
+) -> np.ndarray:
+    values = block.toarray() if sp.issparse(block) else np.asarray(block)
+    z = values.astype(float) - values.mean(axis=0)
+    sum_of_squares = np.sum(z ** 2, axis=0)
+    moran, geary = _statistics(z, sum_of_squares, weights, degrees)
+    if not n_permutations:
+        return np.stack([moran, geary])
+
+    # every block draws the same permutations, so all features are tested against the same ones
+    rng = np.random.default_rng(seed)
+    n_regions, n_features = z.shape
+    permuted_moran, permuted_geary = [], []
+    for start in range(0, n_permutations, permutation_batch):
+        batch = min(permutation_batch, n_permutations - start)
+        # the permutations of a batch are laid side by side and multiplied by the weights at once
+        shuffled = np.concatenate([z[rng.permutation(n_regions)] for _ in range(batch)], axis=1)
+        batch_moran, batch_geary = _statistics(
+            shuffled, np.tile(sum_of_squares, batch), weights, degrees
+        )
+        permuted_moran.append(batch_moran.reshape(batch, n_features))
+        permuted_geary.append(batch_geary.reshape(batch, n_features))
+    return np.stack([
+        moran,
+        geary,
+        _pseudo_p_values(moran, np.concatenate(permuted_moran)),
+        _pseudo_p_values(geary, np.concatenate(permuted_geary)),
+    ])
+
+
+def spatial_autocorrelation(
+    data: da.Array,
+    weights: sp.spmatrix,
+    features: Optional[Sequence[str]] = None,
+    n_permutations: int = 0,
+    permutation_batch: int = 16,
+    features_per_block: Optional[int] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Moran's I and Geary's C of every feature of a regions x features array
+
+    weights is a regions x regions sparse matrix, see spatial_weights. Features are processed
+    in blocks of features_per_block columns, by default as many as fit in 128 MiB for all
+    regions together with a batch of permuted copies, and blocks are computed in parallel.
+    Each statistic of a block is a single sparse weights x dense block product.
+
+    With n_permutations, permutation p-values are added, shuffling regions the same way for
+    every feature. Permutations are evaluated permutation_batch at a time as one product.
+    Returns one row per feature, indexed by features if given.
+    """
+    n_regions, n_features = data.shape
+    if weights.shape != (n_regions, n_regions):
+        raise ValueError("weights must have one row and one column per region")
+    weights = sp.csr_matrix(weights, dtype=float)
+    # sum_ij w_ij (z_i - z_j)^2 = sum_i (row sum_i + column sum_i) z_i^2 - 2 z'Wz
+    degrees = np.asarray(weights.sum(axis=0)).ravel() + np.asarray(weights.sum(axis=1)).ravel()
+
+    if not isinstance(data, da.Array):
+        data = da.from_array(data, asarray=not sp.issparse(data))
+    if features_per_block is None:
+        # a block is held alongside a batch of permuted copies of it
+        copies = 1 + min(permutation_batch, n_permutations)
+        features_per_block = max(1, _BLOCK_BYTES // (8 * max(n_regions, 1) * copies))
+    blocks = data.rechunk({0: -1, 1: features_per_block}).to_delayed().ravel()
+
+    # the weights are shared by every task rather than copied into each of them
+    weights, degrees = dask.delayed(weights), dask.delayed(degrees)
+    results = dask.compute(*(
+        dask.delayed(_block_autocorrelation)(
+            block, weights, degrees, n_permutations, permutation_batch, seed
+        )
+        for block in blocks
+    ))
+    statistics = np.concatenate(results, axis=1) if results else np.empty((4, 0))
+
+    columns = ["moran_i", "geary_c"]
+    if n_permutations:
+        columns += ["moran_i_p_value", "geary_c_p_value"]
+    return pd.DataFrame(
+        statistics[:len(columns)].T,
+        index=pd.Index(features, name="gene_name") if features is not None else None,
+        columns=columns,
+    )
@@ -0,0 +1,138 @@
+from typing import List, Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+BIN_SHAPES = ("square", "hex")
+
+# spots per chunk when binning columns that are already in memory
+_CHUNK_SPOTS = 1_000_000
+
+_KEYS = ["column", "row", "gene"]
+
+
+def bin_codes(
+    x: np.ndarray, y: np.ndarray, bin_size: float, shape: str = "square"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """integer (column, row) codes of the bins that points fall in
+
+    Square bins have sides of bin_size. Hex bins are pointy-topped, bin_size apart along
+    x, and indexed by their axial coordinates. Bins are aligned to the origin, so bins of
+    datasets in the same coordinate system line up.
+    """
+    if shape not in BIN_SHAPES:
+        raise ValueError(f"shape must be one of {BIN_SHAPES}, not {shape}")
+    if bin_size <= 0:
+        raise ValueError("bin_size must be positive")
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    if shape == "square":
+        return (
+            np.floor(x / bin_size).astype(np.int64),
+            np.floor(y / bin_size).astype(np.int64),
+        )
+
+    # round fractional axial coordinates to the nearest hex through cube coordinates
+    q = (x - y / np.sqrt(3)) / bin_size
+    r = 2 * y / (np.sqrt(3) * bin_size)
+    s = -q - r
+    rounded_q, rounded_r, rounded_s = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rounded_q - q), np.abs(rounded_r - r), np.abs(rounded_s - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rounded_q = np.where(fix_q, -rounded_r - rounded_s, rounded_q)
+    rounded_r = np.where(fix_r, -rounded_q - rounded_s, rounded_r)
+    return rounded_q.astype(np.int64), rounded_r.astype(np.int64)
+
+
+def bin_centers(
+    column: np.ndarray, row: np.ndarray, bin_size: float, shape: str = "square"
+) -> Tuple[np.ndarray, np.ndarray]:
+    """x and y coordinates of the centers of bins, the inverse of bin_codes"""
+    if shape not in BIN_SHAPES:
+        raise ValueError(f"shape must be one of {BIN_SHAPES}, not {shape}")
+    if shape == "square":
+        return (np.asarray(column) + 0.5) * bin_size, (np.asarray(row) + 0.5) * bin_size
+    return (
+        bin_size * (np.asarray(column) + np.asarray(row) / 2),
+        bin_size * np.sqrt(3) / 2 * np.asarray(row),
+    )
+
+
+def _count_chunk(
+    x: np.ndarray, y: np.ndarray, genes: np.ndarray, bin_size: float, shape: str
+) -> pd.DataFrame:
+    """spots per (bin, gene) of one chunk of spots, skipping spots with missing values"""
+    # string columns are stored as fixed-width unicode, so missing gene names are "nan"
+    keep = (
+        np.isfinite(np.asarray(x, dtype=float)) & np.isfinite(np.asarray(y, dtype=float))
+        & ~pd.isnull(genes) & (genes != "nan")
+    )
+    column, row = bin_codes(x[keep], y[keep], bin_size, shape)
+    counts = pd.DataFrame({"column": column, "row": row, "gene": genes[keep]})
+    return counts.groupby(_KEYS, sort=False).size().rename("count").reset_index()
+
+
+def _combine_counts(*partials: pd.DataFrame) -> pd.DataFrame:
+    """merge partial (bin, gene) counts by summing the counts of shared keys"""
+    counts = pd.concat(partials, ignore_index=True)
+    return counts.groupby(_KEYS, sort=False)["count"].sum().reset_index()
+
+
+def _as_chunks(values, chunks) -> List:
+    """delayed blocks of a column, split like chunks"""
+    if not isinstance(values, da.Array):
+        values = da.from_array(np.asarray(values), chunks=chunks, asarray=True)
+    return list(values.rechunk(chunks).to_delayed())
+
+
+def bin_counts(
+    x, y, genes, bin_size: float, shape: str = "square", split_every: int = 8
+) -> Tuple[sp.csr_matrix, pd.DataFrame, np.ndarray]:
+    """count spots per bin and gene, streaming over chunks of the spot columns
+
+    x, y and genes are numpy or (lazy) dask arrays. Each chunk of spots is reduced to partial
+    (bin, gene) counts, which are merged split_every at a time in a tree, so only a few
+    chunks of spots and the partial counts are held in memory, and chunks are binned in
+    parallel.
+
+    Returns a bin x gene CSR count matrix, a DataFrame with the column, row, x and y center
+    of each bin, and the sorted gene names. Bins are sorted by row, then column, and only
+    bins holding spots are included.
+    """
+    if shape not in BIN_SHAPES:
+        raise ValueError(f"shape must be one of {BIN_SHAPES}, not {shape}")
+    if bin_size <= 0:
+        raise ValueError("bin_size must be positive")
+    split_every = max(split_every, 2)
+    chunks = x.chunks[0] if isinstance(x, da.Array) else _CHUNK_SPOTS
+    blocks = zip(*(_as_chunks(values, chunks) for values in (x, y, genes)))
+    partials = [
+        dask.delayed(_count_chunk)(x_block, y_block, gene_block, bin_size, shape)
+        for x_block, y_block, gene_block in blocks
+    ]
+    while len(partials) > 1:
+        partials = [
+            dask.delayed(_combine_counts)(*partials[i:i + split_every])
+            for i in range(0, len(partials), split_every)
+        ]
+    counts = partials[0].compute() if partials else _count_chunk(
+        np.empty(0), np.empty(0), np.empty(0, dtype="U"), bin_size, shape
+    )
+
+    bins = counts[["row", "column"]].drop_duplicates().sort_values(["row", "column"])
+    positions = pd.MultiIndex.from_frame(bins).get_indexer(
+        pd.MultiIndex.from_frame(counts[["row", "column"]])
+    )
+    gene_codes, gene_names = pd.factorize(counts["gene"].values, sort=True)
+    matrix = sp.csr_matrix(
+        (counts["count"].values.astype(np.int64), (positions, gene_codes)),
+        shape=(bins.shape[0], gene_names.shape[0]),
+    )
+
+    bins = bins.reset_index(drop=True)[["column", "row"]]
+    bins["x"], bins["y"] = bin_centers(bins["column"], bins["row"], bin_size, shape)
+    return matrix, bins, np.asarray(gene_names, dtype="U")
@@ -0,0 +1,82 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .constants import MATRIX_BITMAP_BYTES, MATRIX_BITMAP_FORMAT
+
+
+class BitmapIndex:
+    """one bitmap per category of a low-cardinality coordinate, packed eight entries to a byte
+
+    Filtering on several coordinates intersects their bitmaps with a bitwise and, and only the
+    final bitmap is unpacked into positions, which come out sorted. Bitmaps of rare categories
+    are mostly zeros and compress to almost nothing when saved.
+    """
+
+    def __init__(self, categories: np.ndarray, bitmaps: np.ndarray, size: int):
+        self.categories = categories
+        self.bitmaps = bitmaps
+        self.size = int(size)
+        self._codes = {category: code for code, category in enumerate(categories.tolist())}
+
+    @classmethod
+    def build(cls, values: np.ndarray) -> "BitmapIndex":
+        """index the categories of a 1d array; missing values are in no category"""
+        codes, categories = pd.factorize(np.asarray(values), sort=True)
+        categories = np.asarray(categories)
+        if categories.dtype == object:
+            categories = categories.astype("U")
+        bitmaps = np.stack(
+            [np.packbits(codes == code) for code in range(len(categories))]
+        ) if len(categories) else np.zeros((0, (len(codes) + 7) // 8), dtype=np.uint8)
+        return cls(categories, bitmaps, size=len(codes))
+
+    def mask(self, labels) -> np.ndarray:
+        """packed bitmap of the entries whose category is any of labels"""
+        mask = np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        for label in np.atleast_1d(np.asarray(labels)).tolist():
+            code = self._codes.get(label)
+            if code is not None:
+                mask |= self.bitmaps[code]
+        return mask
+
+    def unpack(self, mask: np.ndarray) -> np.ndarray:
+        """sorted positions of the entries set in a packed bitmap"""
+        return np.flatnonzero(np.unpackbits(mask, count=self.size))
+
+    def positions(self, labels) -> np.ndarray:
+        """sorted positions of the entries whose category is any of labels"""
+        return self.unpack(self.mask(labels))
+
+    def to_dataset(self, coordinate: str) -> xr.Dataset:
+        """lay the index out as variables that can be saved in the store of the indexed data"""
+        name = f"{coordinate}_{MATRIX_BITMAP_FORMAT}"
+        categories = f"{name}_categories"
+        dataset = xr.Dataset(
+            data_vars={name: ((categories, MATRIX_BITMAP_BYTES), self.bitmaps)},
+            coords={categories: self.categories},
+        )
+        dataset[name].attrs = {
+            "format": MATRIX_BITMAP_FORMAT, "coordinate": coordinate, "size": self.size
+        }
+        return dataset
+
+    @classmethod
+    def from_dataset(cls, dataset: xr.Dataset, name: str) -> "BitmapIndex":
+        variable = dataset[name]
+        categories, _ = variable.dims
+        return cls(
+            categories=np.asarray(dataset[categories]),
+            bitmaps=np.asarray(variable),
+            size=variable.attrs["size"],
+        )
+
+
+def bitmap_variables(dataset: xr.Dataset) -> List[str]:
+    """names of the bitmap index variables in a dataset"""
+    return [
+        name for name, variable in dataset.data_vars.items()
+        if variable.attrs.get("format") == MATRIX_BITMAP_FORMAT
+    ]
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # windows; eviction is then only safe within one process
+    fcntl = None
+
+# default size limit of the chunk cache, 10 GiB
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+# seconds for which a key the remote store doesn't have is trusted to still be missing
+DEFAULT_MISSING_TTL = 3600.0
+# fraction of the size limit that eviction brings the cache down to
+_LOW_WATER_MARK = 0.9
+
+# environment variables that turn on the chunk cache for every remote load
+CACHE_DIRECTORY_ENVIRONMENT_VARIABLE = "STARSPACE_CACHE_DIR"
+CACHE_MAX_BYTES_ENVIRONMENT_VARIABLE = "STARSPACE_CACHE_MAX_BYTES"
+CACHE_OFFLINE_ENVIRONMENT_VARIABLE = "STARSPACE_CACHE_OFFLINE"
+
+_DIGEST_SIZE = hashlib.sha256().digest_size
+_ENTRY_SUFFIX = ".chunk"
+_MISSING_SUFFIX = ".missing"
+
+
+class CacheMissError(RuntimeError):
+    """raised in offline mode when a key has never been cached
+
+    This is deliberately not a KeyError, which zarr would read as a chunk that was never written
+    and silently replace with the fill value.
+    """
+
+
+class _DirectoryUsage:
+    """bytes held by a cache directory, shared by every ChunkCache of the process using it"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+
+
+_usages: Dict[Path, _DirectoryUsage] = {}
+_usages_lock = threading.Lock()
+
+
+def _entries(directory: Path) -> Iterator[os.DirEntry]:
+    for subdirectory in os.scandir(directory):
+        if subdirectory.is_dir():
+            yield from (entry for entry in os.scandir(subdirectory) if entry.is_file())
+
+
+def _directory_usage(directory: Path) -> _DirectoryUsage:
+    """the pooled size accounting of a cache directory, scanning it on first use only
+
+    The directory is walked once per process rather than once per cache opened on it;
+    eviction rescans it and corrects the size for entries written by other processes.
+    """
+    key = directory.resolve()
+    with _usages_lock:
+        usage = _usages.get(key)
+        if usage is None:
+            usage = _usages[key] = _DirectoryUsage(
+                sum(entry.stat().st_size for entry in _entries(key))
+            )
+        return usage
+
+
+class ChunkCache(MutableMapping):
+    """persistent on-disk read-through cache in front of a remote key-value store
+
+    Values read from the remote store are written to one file per key under directory, prefixed
+    with their sha256 digest, which is checked on every read; corrupt entries are discarded and
+    fetched again. Keys the remote store does not have are remembered too, so that zarr can tell
+    missing chunks from uncached ones offline. Files are written to a temporary name and renamed
+    into place, so processes sharing a directory never see partial entries, and eviction holds
+    an exclusive lock on the directory. When the cache grows past max_bytes, the least recently
+    read entries are evicted until it is below 90% of max_bytes, so that a full cache isn't
+    rescanned on every write. Missing keys are fetched again once their marker is older than
+    missing_ttl seconds, in case another writer has added them since. The size of a directory
+    is tracked once per process, so opening another cache on it does not walk it again. In
+    offline mode the remote store is never contacted.
+
+    Writes and deletes go to the remote store and drop the cached entry.
+    """
+
+    def __init__(
+        self,
+        store: MutableMapping,
+        directory: Union[str, Path],
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False,
+        namespace: Optional[str] = None,
+        missing_ttl: float = DEFAULT_MISSING_TTL,
+    ):
+        self.store = store
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.missing_ttl = missing_ttl
+        if namespace is None:
+            namespace = str(getattr(store, "root", id(store)))
+        self.namespace = namespace
+        self._usage = _directory_usage(self.directory)
+
+    def _path(self, key: str, suffix: str = _ENTRY_SUFFIX) -> Path:
+        name = hashlib.sha256(f"{self.namespace}/{key}".encode()).hexdigest()
+        # spread entries over subdirectories to keep directory listings short
+        return self.directory / name[:2] / f"{name}{suffix}"
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self.directory / ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, path: Path, payload: bytes) -> None:
+        path.parent.mkdir(exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(payload)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        with self._usage.lock:
+            self._usage.size += len(payload)
+            over_limit = self._usage.size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _discard(self, path: Path) -> None:
+        """delete an entry, if it exists, and take its size off the size of the directory"""
+        try:
+            size = path.stat().st_size
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self._usage.lock:
+            self._usage.size = max(self._usage.size - size, 0)
+
+    def evict(self) -> None:
+        """delete least recently read entries until the cache is below its low-water mark"""
+        low_water = int(self.max_bytes * _LOW_WATER_MARK)
+        with self._exclusive():
+            entries = []
+            for entry in _entries(self.directory):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(e[1] for e in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= low_water:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+        with self._usage.lock:
+            self._usage.size = size
+
+    def _read_cached(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+
+        digest, value = payload[:_DIGEST_SIZE], payload[_DIGEST_SIZE:]
+        if hashlib.sha256(value).digest() != digest:
+            self._discard(path)
+            return None
+
+        # the modification time orders entries for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def __getitem__(self, key: str) -> bytes:
+        value = self._read_cached(key)
+        if value is not None:
+            return value
+
+        missing = self._path(key, _MISSING_SUFFIX)
+        try:
+            age = time.time() - missing.stat().st_mtime
+        except FileNotFoundError:
+            pass
+        else:
+            # offline, a marker of any age is the best record of the remote store there is
+            if self.offline or age < self.missing_ttl:
+                raise KeyError(key)
+            self._discard(missing)
+        if self.offline:
+            raise CacheMissError(f"{key} of {self.namespace} is not cached")
+
+        try:
+            value = bytes(self.store[key])
+        except KeyError:
+            self._write(missing, b"")
+            raise
+        self._write(self._path(key), hashlib.sha256(value).digest() + value)
+        return value
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def _invalidate(self, key: str) -> None:
+        for path in (self._path(key), self._path(key, _MISSING_SUFFIX)):
+            self._discard(path)
+
+    def __setitem__(self, key: str, value) -> None:
+        if self.offline:
+            raise CacheMissError("cannot write to a remote store in offline mode")
+        self.store[key] = value
+        self._invalidate(key)
+
+    def __delitem__(self, key: str) -> None:
+        if self.offline:
+            raise CacheMissError("cannot delete from a remote store in offline mode")
+        del self.store[key]
+        self._invalidate(key)
+
+    def __iter__(self):
+        if self.offline:
+            raise CacheMissError("cannot list a remote store in offline mode")
+        return iter(self.store)
+
+    def __len__(self) -> int:
+        if self.offline:
+            raise CacheMissError("cannot list a remote store in offline mode")
+        return len(self.store)
+
+
+_settings = {}
+
+
+def configure_cache(
+    directory: Union[str, Path, None] = None,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    offline: bool = False,
+) -> None:
+    """cache remote chunks under directory for every load from then on; None turns it off
+
+    offline=True serves loads from the cache alone, for rerunning jobs without network access.
+    Without a call to configure_cache, the cache is configured from the STARSPACE_CACHE_DIR,
+    STARSPACE_CACHE_MAX_BYTES and STARSPACE_CACHE_OFFLINE environment variables.
+    """
+    _settings.clear()
+    _settings.update(directory=directory, max_bytes=max_bytes, offline=offline)
+
+
+def cached_store(store: MutableMapping) -> MutableMapping:
+    """wrap a remote store with the configured chunk cache, if one is configured"""
+    if _settings:
+        directory, max_bytes, offline = (
+            _settings["directory"], _settings["max_bytes"], _settings["offline"]
+        )
+    else:
+        directory = os.environ.get(CACHE_DIRECTORY_ENVIRONMENT_VARIABLE)
+        max_bytes = int(os.environ.get(CACHE_MAX_BYTES_ENVIRONMENT_VARIABLE, DEFAULT_MAX_BYTES))
+        offline = os.environ.get(CACHE_OFFLINE_ENVIRONMENT_VARIABLE, "") not in ("", "0")
+
+    if directory is None:
+        return store
+    return ChunkCache(store, directory, max_bytes=max_bytes, offline=offline)
@@ -0,0 +1,203 @@
+import json
+import warnings
+from collections import defaultdict
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .constants import MATRIX_REQUIRED_FEATURES, MATRIX_REQUIRED_REGIONS, SPOTS_REQUIRED_VARIABLES
+from .storage import get_filesystem
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# variables whose range is recorded as the spatial extent of a dataset, by axis
+_EXTENT_VARIABLES = {
+    "x": (SPOTS_REQUIRED_VARIABLES.X_SPOT.value, MATRIX_REQUIRED_REGIONS.X_REGION.value),
+    "y": (SPOTS_REQUIRED_VARIABLES.Y_SPOT.value, MATRIX_REQUIRED_REGIONS.Y_REGION.value),
+}
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (tuple, set)):
+        return list(value)
+    raise TypeError(f"{type(value)} is not json serializable")
+
+
+def _as_dask(values) -> da.Array:
+    """a variable's values as a dask array, in-memory values as a single chunk"""
+    if isinstance(values, da.Array):
+        return values
+    return da.from_array(np.asarray(values), chunks=-1)
+
+
+def manifest_statistics(dataset: xr.Dataset) -> Tuple[Any, Dict[str, Tuple[Any, Any]]]:
+    """the unique genes of a dataset and the range of its coordinates, as lazy reductions
+
+    The reductions run chunk by chunk, so lazily loaded columns are streamed rather than loaded
+    whole, and can be computed together with a write of the dataset, which then reads each
+    chunk once for both.
+    """
+    gene_name = MATRIX_REQUIRED_FEATURES.GENE_NAME.value
+    unique_genes = []
+    if gene_name in dataset.variables:
+        unique_genes = da.unique(_as_dask(dataset[gene_name].data).ravel())
+
+    ranges = {}
+    for axis, candidates in _EXTENT_VARIABLES.items():
+        for name in candidates:
+            if name in dataset.variables:
+                values = _as_dask(dataset[name].data).astype(float)
+                if values.size:
+                    ranges[axis] = (da.nanmin(values), da.nanmax(values))
+                break
+    return unique_genes, ranges
+
+
+def compute_statistics(statistics: Tuple, *others) -> Tuple:
+    """compute manifest_statistics in a single pass with other dask collections
+
+    others are e.g. the delayed write of the dataset. Returns the computed statistics followed
+    by the computed others.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # columns that are all missing
+        return dask.compute(statistics, *others)
+
+
+def build_manifest(
+    dataset: xr.Dataset,
+    url: str,
+    kind: str,
+    source: Union[xr.Dataset, xr.DataArray, None] = None,
+    statistics: Optional[Tuple[Iterable, Dict[str, Tuple[float, float]]]] = None,
+) -> Dict[str, Any]:
+    """summarize a dataset saved at url: attributes, shape, gene list and spatial extent
+
+    Attributes and shape are taken from source, the Matrix, Spots or Regions the dataset was
+    made from, when it is given. statistics are the computed manifest_statistics of dataset,
+    which are computed here if they aren't given.
+    """
+    if source is None:
+        source = dataset
+    if statistics is None:
+        statistics, = compute_statistics(manifest_statistics(dataset))
+    unique_genes, ranges = statistics
+
+    genes = sorted(str(g) for g in unique_genes)
+    extent = {
+        axis: [float(low), float(high)] for axis, (low, high) in ranges.items()
+        if not np.isnan(low)
+    }
+
+    return {
+        "url": url,
+        "kind": kind,
+        "attributes": {getattr(k, "value", k): v for k, v in source.attrs.items()},
+        "shape": {str(getattr(k, "value", k)): int(v) for k, v in source.sizes.items()},
+        "genes": genes,
+        "extent": extent,
+    }
+
+
+def write_manifest(manifest: Dict[str, Any], profile_name: Optional[str] = None) -> None:
+    """write a manifest next to the store it describes, as {store url}.manifest.json"""
+    filesystem, path = get_filesystem(manifest["url"].rstrip("/") + MANIFEST_SUFFIX, profile_name)
+    with filesystem.open(path, "w") as f:
+        json.dump(manifest, f, default=_to_json)
+
+
+def _normalize(value: Any) -> Any:
+    """attribute values as they are indexed: lowercase strings, hashable sequences"""
+    if isinstance(value, str):
+        return value.lower()
+    if isinstance(value, list):
+        return tuple(_normalize(v) for v in value)
+    return value
+
+
+class Catalog:
+    """in-memory index over dataset manifests
+
+    Manifests are indexed by kind, by the value of each attribute and by gene, so queries only
+    intersect precomputed sets of datasets. String matching is case-insensitive, and an
+    attribute holding a list, such as authors, matches any of its elements.
+    """
+
+    def __init__(self, manifests: Iterable[Dict[str, Any]]):
+        self.manifests: List[Dict[str, Any]] = list(manifests)
+        self._by_kind: Dict[str, Set[int]] = defaultdict(set)
+        self._by_attribute: Dict[str, Dict[Any, Set[int]]] = defaultdict(lambda: defaultdict(set))
+        self._by_gene: Dict[str, Set[int]] = defaultdict(set)
+
+        for i, manifest in enumerate(self.manifests):
+            self._by_kind[manifest["kind"]].add(i)
+            for attribute, value in manifest["attributes"].items():
+                value = _normalize(value)
+                values = value if isinstance(value, tuple) else (value,)
+                for v in values:
+                    self._by_attribute[attribute][v].add(i)
+            for gene in manifest["genes"]:
+                self._by_gene[gene.lower()].add(i)
+
+    def __len__(self) -> int:
+        return len(self.manifests)
+
+    @classmethod
+    def load(cls, url: str, profile_name: Optional[str] = None) -> "Catalog":
+        """load every manifest in a local directory or s3:// prefix, or a saved catalog
+
+        Manifests are found with a single listing of the directory, not of its subdirectories,
+        and fetched concurrently.
+        """
+        filesystem, path = get_filesystem(url, profile_name)
+        if path.endswith(".json") and not path.endswith(MANIFEST_SUFFIX):
+            with filesystem.open(path, "r") as f:
+                return cls(json.load(f))
+
+        paths = filesystem.glob(f"{path.rstrip('/')}/*{MANIFEST_SUFFIX}")
+        contents = filesystem.cat(paths) if paths else {}
+        return cls(json.loads(contents[p]) for p in sorted(contents))
+
+    def save(self, url: str, profile_name: Optional[str] = None) -> None:
+        """save all manifests to a single json file, which loads with one read"""
+        filesystem, path = get_filesystem(url, profile_name)
+        with filesystem.open(path, "w") as f:
+            json.dump(self.manifests, f, default=_to_json)
+
+    def query(
+        self, kind: Optional[str] = None, gene: Optional[str] = None, **attributes
+    ) -> List[Dict[str, Any]]:
+        """manifests matching every given condition
+
+        kind is matrix, spots or regions, gene must be among a dataset's genes, and any other
+        keyword matches an attribute, e.g. catalog.query(assay="MERFISH", organism="mouse",
+        gene="Gad2").
+        """
+        matches = set(range(len(self.manifests)))
+        if kind is not None:
+            matches &= self._by_kind.get(kind, set())
+        if gene is not None:
+            matches &= self._by_gene.get(gene.lower(), set())
+        for attribute, value in attributes.items():
+            attribute = getattr(attribute, "value", attribute)
+            index = self._by_attribute.get(attribute, {})
+            matches &= index.get(_normalize(getattr(value, "value", value)), set())
+        return [self.manifests[i] for i in sorted(matches)]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """one row per dataset, with its url, kind, attributes and number of genes"""
+        return pd.DataFrame([
+            dict(url=m["url"], kind=m["kind"], n_genes=len(m["genes"]), **m["attributes"])
+            for m in self.manifests
+        ])
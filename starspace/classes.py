@@ -1,62 +1,213 @@
+import hashlib
+import operator
 from collections import OrderedDict
 from enum import Enum
 from itertools import chain
 from pathlib import Path
-from typing import Dict, Sequence, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, \
+    Union
 
 import anndata
+import dask
 import dask.array as da
+import h5py
 import loompy
 import numpy as np
+import numpy_groupies as npg
 import pandas as pd
-import s3fs
+import scipy.sparse as sp
 import xarray as xr
 
 from .constants import MATRIX_NAME, MATRIX_REQUIRED_REGIONS, MATRIX_REQUIRED_FEATURES, \
     MATRIX_AXES, SPOTS_AXES, REQUIRED_ATTRIBUTES, SPOTS_REQUIRED_VARIABLES, REGIONS_AXES, \
-    REGIONS_NAME, SPOTS_NAME, SCANPY_CONSTANTS
+    REGIONS_NAME, SPOTS_NAME, SCANPY_CONSTANTS, MATRIX_CHUNK_SIZE, MATRIX_SPARSE_VARIABLES, \
+    MATRIX_SPARSE_AXES, MATRIX_SPARSE_FORMAT, SPOTS_OPTIONAL_VARIABLES, SPATIAL_INDEX_NAME, \
+    MATRIX_OPTIONAL_REGIONS, REGIONS_PYRAMID_LEVEL, REGIONS_RLE_VARIABLES, MATRIX_BITMAP_FORMAT, \
+    NEIGHBOR_GRAPH_NAME, LEGACY_MATRIX_REGIONS, LEGACY_SPOTS_VARIABLES
+from . import runlength
+from .autocorrelation import spatial_autocorrelation, spatial_weights
+from .binning import bin_counts
+from .bitmap import BitmapIndex, bitmap_variables
+from .cache import cached_store
+from .colocalization import colocalization
+from .catalog import build_manifest, compute_statistics, manifest_statistics, write_manifest
+from .encoding import CodecPolicy, get_policy
+from .graph import graph_from_dataset, graph_key, graph_to_dataset
+from .graph import neighbor_graph as build_neighbor_graph
+from .export import write_h5ad_x, write_loom
+from .measure import BACKGROUND, region_centroids, region_properties, sample_labels
+from .pyramid import build_pyramid
+from .spatial import GridIndex
+from .storage import get_filesystem, s3_store
 
 
 # todo figure out how to overwrite existing groups
 # todo figure out how to write to s3fs with groups
-def _save_zarr(dataset: xr.Dataset, url: str, profile_name: str, suffix: str) -> None:
-
+def _save_zarr(
+    dataset: xr.Dataset,
+    url: str,
+    profile_name: str,
+    suffix: str,
+    codecs: Union[str, CodecPolicy, None] = None,
+    manifest: bool = True,
+    source: Union[xr.Dataset, xr.DataArray, None] = None,
+) -> None:
+    """write dataset to {url}.{suffix}.zarr and, if manifest, a catalog manifest next to it
+
+    source is the object the dataset was made from; the manifest records its attributes and
+    shape rather than those of the stored layout.
+    """
     if isinstance(url, Path):
         url = str(url)
 
     url = url.rstrip("/")
+    if url.startswith("s3://"):
+        url = url.replace(" ", '-')
+    # the manifest summarizes the dataset as given, before codecs are applied
+    manifest_url = f"{url}.{suffix}.zarr"
+    statistics = manifest_statistics(dataset) if manifest else None
+    source = dataset if source is None else source
+
+    encoding = None
+    policy = get_policy(codecs)
+    if policy is not None:
+        dataset, encoding = policy.apply(dataset)
 
     if url.startswith("s3://"):
 
-        url = url.replace(" ", '-')
         url = url.replace("s3://", "")
 
         if url.count("/") > 1:
             raise ValueError("I haven't figured out how to write groups yet, this will fail.")
-        s3 = s3fs.S3FileSystem(profile_name=profile_name)
-        root = f"{url}.{suffix}.zarr"
-        store = s3fs.S3Map(root=root, s3=s3, check=False)
-
-        dataset.to_zarr(store=store)
+        store = s3_store(f"{url}.{suffix}.zarr", profile_name=profile_name)
 
     else:  # assume local
-        dataset.to_zarr(f"{url}.{suffix}.zarr")
+        store = f"{url}.{suffix}.zarr"
+
+    # consolidating metadata lets the store be opened by reading a single key
+    write = dataset.to_zarr(store=store, encoding=encoding, consolidated=True, compute=False)
+    if not manifest:
+        write.compute()
+        return
 
+    # the statistics are reduced in the same pass that writes the data, reading each chunk once
+    statistics, _ = compute_statistics(statistics, write)
+    summary = build_manifest(
+        dataset, manifest_url, kind=suffix, source=source, statistics=statistics
+    )
+    write_manifest(summary, profile_name=profile_name)
 
-def _load_zarr(url: str) -> xr.Dataset:
+
+def _open_zarr(store, chunks) -> xr.Dataset:
+    try:
+        return xr.open_zarr(store=store, chunks=chunks, consolidated=True)
+    except KeyError:
+        # stores written before metadata was consolidated
+        return xr.open_zarr(store=store, chunks=chunks, consolidated=False)
+
+
+def _load_zarr(url: str, eager: bool = False, profile_name: Optional[str] = None) -> xr.Dataset:
+    """open a zarr store lazily, with dask chunks aligned to the stored zarr chunks
+
+    If eager is True, all variables are read into memory as numpy arrays instead. S3 stores are
+    read through the filesystem pooled for profile_name, and through the local chunk cache if
+    one is configured.
+    """
 
     if isinstance(url, Path):
         url = str(url)
 
     if url.startswith("s3://"):
-        url = url.replace("s3://", "")
-        s3 = s3fs.S3FileSystem()
-        store = s3fs.S3Map(root=url, s3=s3, check=False)
-        dataset = xr.open_zarr(store=store)
+        store = cached_store(s3_store(url, profile_name=profile_name))
     else:
-        dataset = xr.open_zarr(url, chunks=None)  # turn off zarr
-
-    return dataset
+        store = url
+
+    if eager:
+        return _open_zarr(store, chunks=None).load()
+
+    return _open_zarr(store, chunks="auto")
+
+
+def _rename_legacy(dataset: xr.Dataset, names: Mapping[str, str]) -> xr.Dataset:
+    """rename the variables of a store saved under legacy names to their current names
+
+    Variables are renamed all at once, so names that the legacy enums swapped are swapped back.
+    """
+    return dataset.rename({old: new for old, new in names.items() if old in dataset.variables})
+
+
+def _wrap_data_array(cls, data_array: xr.DataArray) -> xr.DataArray:
+    """re-type a DataArray without computing it, which cls(data_array) would do"""
+    return cls(
+        data_array.variable, coords=data_array.coords, name=data_array.name,
+        attrs=data_array.attrs
+    )
+
+
+_FILTER_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, values: column.isin(list(values)),
+    "not in": lambda column, values: ~column.isin(list(values)),
+}
+
+
+def _filter_mask(dataset: xr.Dataset, filters: Iterable[Tuple[str, str, Any]]) -> np.ndarray:
+    """evaluate (column, op, value) predicates chunk by chunk and AND them together"""
+    mask = None
+    for column, op, value in filters:
+        if isinstance(column, Enum):
+            column = column.value
+        if op not in _FILTER_OPERATORS:
+            raise ValueError(f"unsupported filter operator {op}, must be one of "
+                             f"{list(_FILTER_OPERATORS)}")
+        predicate = _FILTER_OPERATORS[op](dataset[column], value)
+        mask = predicate if mask is None else mask & predicate
+    return np.asarray(mask)
+
+
+def _fingerprint(*arrays) -> str:
+    """digest of the values of arrays, to check that an index derived from them is current
+
+    Dask arrays are identified by their name, a token of their graph, so they aren't computed.
+    """
+    digest = hashlib.sha1()
+    for values in arrays:
+        if isinstance(values, da.Array):
+            digest.update(values.name.encode())
+            continue
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = values.astype("U")
+        digest.update(f"{values.dtype.str}{values.shape}".encode())
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def _derived_cache(obj) -> dict:
+    """indexes derived from the values of obj, in the _derived slot its class reserves
+
+    Entries are (fingerprint, index) pairs. Objects made from obj by xarray operations start
+    with an empty cache.
+    """
+    try:
+        return obj._derived
+    except AttributeError:
+        obj._derived = {}
+        return obj._derived
+
+
+def _cached(obj, key: str, fingerprint: str, build: Callable[[], Any]) -> Any:
+    """the index cached on obj under key, rebuilt if the values it was built from changed"""
+    cache = _derived_cache(obj)
+    entry = cache.get(key)
+    if entry is None or entry[0] != fingerprint:
+        entry = cache[key] = (fingerprint, build())
+    return entry[1]
 
 
 def _correct_coords(coords: dict) -> Dict[str, Tuple[str, Sequence]]:
@@ -72,6 +223,40 @@ def _correct_coords(coords: dict) -> Dict[str, Tuple[str, Sequence]]:
     return corrected_coords
 
 
+def _sparse_to_dask(matrix) -> da.Array:
+    """wrap a scipy.sparse matrix as a dask array of CSR row blocks spanning all features"""
+    matrix = sp.csr_matrix(matrix)
+    return da.from_array(matrix, chunks=(MATRIX_CHUNK_SIZE[0], matrix.shape[1]), asarray=False)
+
+
+def _as_dask(data) -> da.Array:
+    """matrix data as a dask array, splitting in-memory arrays into row blocks"""
+    if isinstance(data, da.Array):
+        return data
+    return da.from_array(data, chunks=(MATRIX_CHUNK_SIZE[0], -1), asarray=not sp.issparse(data))
+
+
+def _csr_arrays_to_dask(data, indices, indptr: np.ndarray, shape: Tuple[int, int]) -> da.Array:
+    """assemble a dask array of CSR row blocks from (possibly lazy) CSR component arrays
+
+    Each block only reads the slice of data and indices that holds its rows.
+    """
+    if shape[0] == 0:
+        return _sparse_to_dask(sp.csr_matrix(shape, dtype=data.dtype))
+
+    meta = sp.csr_matrix((0, 0), dtype=data.dtype)
+    blocks = []
+    for start in range(0, shape[0], MATRIX_CHUNK_SIZE[0]):
+        stop = min(start + MATRIX_CHUNK_SIZE[0], shape[0])
+        lo, hi = indptr[start], indptr[stop]
+        block_shape = (stop - start, shape[1])
+        block = dask.delayed(sp.csr_matrix)(
+            (data[lo:hi], indices[lo:hi], indptr[start:stop + 1] - lo), shape=block_shape
+        )
+        blocks.append(da.from_delayed(block, shape=block_shape, dtype=data.dtype, meta=meta))
+    return da.concatenate(blocks, axis=0)
+
+
 def _correct_col_dtypes(data: pd.DataFrame) -> pd.DataFrame:
     """converts any object dtype columns to fixed-width unicode strings"""
     for col in data:
@@ -81,9 +266,193 @@ def _correct_col_dtypes(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-class Matrix(xr.DataArray):
+# loom attributes that conventionally hold the required matrix coordinates
+_LOOM_COORDINATES = {
+    MATRIX_REQUIRED_REGIONS.REGION_ID.value: "CellID",
+    MATRIX_REQUIRED_FEATURES.GENE_NAME.value: "Gene",
+}
+
+# global attributes loompy adds to every file
+_LOOM_FILE_ATTRIBUTES = ("CreationDate", "LOOM_SPEC_VERSION", "last_modified")
+
+
+def _map_coords(
+    columns: Mapping[str, Any],
+    dim: str,
+    mapping: Optional[Mapping[str, str]],
+    defaults: Mapping[str, str] = _LOOM_COORDINATES,
+) -> Dict[str, Tuple[str, np.ndarray]]:
+    """coords along dim from metadata columns, renamed by mapping {coordinate: column}
+
+    Columns named in defaults are used for coordinates that are neither mapped nor present.
+    Columns that are not mapped keep their names.
+    """
+    mapping = {getattr(k, "value", k): v for k, v in (mapping or {}).items()}
+    for coordinate, column in defaults.items():
+        if coordinate not in mapping and coordinate not in columns and column in columns:
+            mapping[coordinate] = column
+    renamed = {column: coordinate for coordinate, column in mapping.items()}
+    for coordinate, column in mapping.items():
+        if column not in columns:
+            raise ValueError(f"no column {column} to use as coordinate {coordinate}")
+    return {renamed.get(name, name): (dim, np.asarray(values)) for name, values in columns.items()}
+
+
+class _H5Dataset:
+    """array-like view of a dataset of an hdf5 file, which opens the file for each read
+
+    No handle is held between reads, so the file is never left open by a lazy array.
+    """
+
+    def __init__(self, filename: Union[str, Path], name: str):
+        self.filename, self.name = str(filename), name
+        with h5py.File(self.filename, "r") as h5file:
+            self.shape, self.dtype = h5file[name].shape, h5file[name].dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __getitem__(self, key) -> np.ndarray:
+        with h5py.File(self.filename, "r") as h5file:
+            return h5file[self.name][key]
+
+    def __dask_tokenize__(self) -> Tuple:
+        return self.filename, self.name, Path(self.filename).stat().st_mtime_ns
+
+
+def _read_h5ad_x(filename: Union[str, Path]) -> da.Array:
+    """wrap X of an .h5ad file as a lazy dask array, dense or of CSR row blocks
+
+    The file is opened for each chunk read and closed again, so it must exist until the array
+    is computed.
+    """
+    with h5py.File(filename, "r") as h5file:
+        x = h5file["X"]
+        if isinstance(x, h5py.Dataset):
+            return da.from_array(_H5Dataset(filename, "X"), chunks=MATRIX_CHUNK_SIZE, lock=True)
+
+        encoding = x.attrs.get("encoding-type", x.attrs.get("h5sparse_format"))
+        if encoding not in ("csr_matrix", "csr"):
+            raise ValueError(f"X must be dense or CSR, not {encoding}")
+        indptr = x["indptr"][:]
+        shape = tuple(x.attrs.get("shape", x.attrs.get("h5sparse_shape")))
+
+    chunks = MATRIX_CHUNK_SIZE[0] * MATRIX_CHUNK_SIZE[1]
+    return _csr_arrays_to_dask(
+        da.from_array(_H5Dataset(filename, "X/data"), chunks=chunks, lock=True),
+        da.from_array(_H5Dataset(filename, "X/indices"), chunks=chunks, lock=True),
+        indptr,
+        shape=shape,
+    )
+
+
+class _SpatiallyIndexed:
+    """grid index and spatial queries over the points of Spots or the regions of a Matrix
+
+    Classes using it set _SPATIAL_VARIABLES, the names of their x, y and z coordinates,
+    _SPATIAL_NAME, the name the index is saved under, and _SPATIAL_DIM, the indexed dimension,
+    and reserve a _derived slot for the cached index.
+    """
+
+    __slots__ = ()
+
+    _SPATIAL_VARIABLES: Tuple[str, str, str]
+    _SPATIAL_NAME: str
+    _SPATIAL_DIM: str
+
+    def _spatial_variables(self, use_z: bool) -> List[str]:
+        return list(self._SPATIAL_VARIABLES if use_z else self._SPATIAL_VARIABLES[:2])
+
+    def _spatial_coordinates(self, use_z: bool) -> np.ndarray:
+        """(n, 2) or (n, 3) array of x, y and optionally z coordinates"""
+        # only the coordinate variables are read, which matters for lazily loaded spots
+        return np.stack(
+            [np.asarray(self[v], dtype=float) for v in self._spatial_variables(use_z)], axis=1
+        )
+
+    def _spatial_fingerprint(self, use_z: bool) -> str:
+        return _fingerprint(*(self[v].data for v in self._spatial_variables(use_z)))
+
+    def build_spatial_index(
+        self, tile_size: Optional[float] = None, use_z: bool = False
+    ) -> GridIndex:
+        """build and cache a grid index over the coordinates, used by the query_* methods"""
+        index = GridIndex.build(self._spatial_coordinates(use_z), tile_size=tile_size)
+        _derived_cache(self)[SPATIAL_INDEX_NAME] = (self._spatial_fingerprint(use_z), index)
+        return index
+
+    @property
+    def spatial_index(self) -> GridIndex:
+        """the cached spatial index, built with default parameters if there isn't one
+
+        An index built from coordinates that have changed since is rebuilt, with default
+        parameters over the same dimensions.
+        """
+        entry = _derived_cache(self).get(SPATIAL_INDEX_NAME)
+        if entry is None:
+            return self.build_spatial_index()
+        fingerprint, index = entry
+        use_z = index.ndim == 3
+        if fingerprint != self._spatial_fingerprint(use_z):
+            return self.build_spatial_index(use_z=use_z)
+        return index
+
+    def save_spatial_index(self, url: str, profile_name: str = "spacetx") -> None:
+        """save the spatial index next to data saved with save_zarr(url)"""
+        _save_zarr(
+            self.spatial_index.to_dataset(), url, profile_name,
+            suffix=f"{self._SPATIAL_NAME}.{SPATIAL_INDEX_NAME}", manifest=False
+        )
+
+    def load_spatial_index(self, url: str) -> GridIndex:
+        """load a spatial index saved with save_spatial_index and cache it"""
+        index = GridIndex.from_dataset(_load_zarr(url, eager=True))
+        if index.order.shape[0] != self.sizes[self._SPATIAL_DIM]:
+            raise ValueError(f"spatial index does not match the number of {self._SPATIAL_DIM}")
+        _derived_cache(self)[SPATIAL_INDEX_NAME] = (
+            self._spatial_fingerprint(index.ndim == 3), index
+        )
+        return index
+
+    def _select(self, positions: np.ndarray):
+        return self.isel({self._SPATIAL_DIM: positions})
+
+    def query_box(
+        self,
+        x: Tuple[float, float],
+        y: Tuple[float, float],
+        z: Optional[Tuple[float, float]] = None,
+    ):
+        """entries with coordinates inside the closed (lower, upper) ranges"""
+        bounds = [x, y] if z is None else [x, y, z]
+        lower, upper = zip(*bounds)
+        return self._select(self.spatial_index.query_box(lower, upper))
+
+    def query_polygon(self, vertices: Sequence[Tuple[float, float]]):
+        """entries whose x, y coordinates are inside a polygon given by its vertices"""
+        return self._select(self.spatial_index.query_polygon(vertices))
+
+    def query_radius(self, point: Sequence[float], radius: float):
+        """entries within radius of an (x, y) or (x, y, z) point"""
+        return self._select(self.spatial_index.query_radius(point, radius))
+
+    def query_knn(self, point: Sequence[float], k: int):
+        """the k entries nearest to an (x, y) or (x, y, z) point, nearest first"""
+        return self._select(self.spatial_index.query_knn(point, k))
 
-    __slots__ = []
+
+class Matrix(_SpatiallyIndexed, xr.DataArray):
+
+    __slots__ = ["_derived"]
+
+    _SPATIAL_VARIABLES = (
+        MATRIX_REQUIRED_REGIONS.X_REGION.value,
+        MATRIX_REQUIRED_REGIONS.Y_REGION.value,
+        MATRIX_OPTIONAL_REGIONS.Z_REGION.value,
+    )
+    _SPATIAL_NAME = MATRIX_NAME
+    _SPATIAL_DIM = MATRIX_AXES.REGIONS.value
 
     @classmethod
     def from_expression_data(cls, data, coords, dims, attrs, *args, **kwargs):
@@ -114,26 +483,211 @@ class Matrix(xr.DataArray):
             if v not in attrs:
                 raise ValueError(f"missing required attribute {v}")
 
-        # convert to dask
-        if not isinstance(data, da.core.Array):
+        # convert to dask, keeping sparse input sparse
+        if sp.issparse(data):
+            data = _sparse_to_dask(data)
+        elif not isinstance(data, da.core.Array):
             data = da.from_array(data, chunks=(1000, 1000))
 
         return cls(
             data=data, dims=corrected_dims, coords=corrected_coords, attrs=attrs, *args, **kwargs
         )
 
-    def save_zarr(self, url: str, profile_name: str = "spacetx") -> None:
-        if self.name is None:
+    @classmethod
+    def from_loom(
+        cls,
+        loom_file_name: Union[str, Path],
+        attrs: Optional[Dict] = None,
+        regions: Optional[Mapping[str, str]] = None,
+        features: Optional[Mapping[str, str]] = None,
+    ) -> "Matrix":
+        """lazily load a loom file with features as rows and regions as columns
+
+        regions and features map coordinates to the column and row attributes that hold them,
+        e.g. regions={MATRIX_REQUIRED_REGIONS.X_REGION: "X"}. The loom conventions CellID and
+        Gene are used for region_id and gene_name unless mapped. Other attributes are kept under
+        their own names. attrs are added to the global attributes of the file.
+
+        The main matrix is read chunk by chunk when computed, and each chunk is transposed as it
+        is read. The file is opened for each chunk read and closed again, so it must exist until
+        the matrix is computed.
+        """
+        with loompy.connect(str(loom_file_name), mode="r", validate=False) as connection:
+            row_attrs = {name: connection.ra[name] for name in connection.ra.keys()}
+            col_attrs = {name: connection.ca[name] for name in connection.ca.keys()}
+            file_attrs = {
+                name: connection.attrs[name] for name in connection.attrs.keys()
+                if name not in _LOOM_FILE_ATTRIBUTES
+            }
+
+        main_matrix = _H5Dataset(loom_file_name, "matrix")
+        data = da.from_array(main_matrix, chunks=MATRIX_CHUNK_SIZE[::-1], lock=True).T
+
+        coords = _map_coords(col_attrs, MATRIX_AXES.REGIONS.value, regions)
+        coords.update(_map_coords(row_attrs, MATRIX_AXES.FEATURES.value, features))
+        file_attrs.update(attrs or {})
+        return cls.from_expression_data(
+            data=data, coords=coords, dims=tuple(MATRIX_AXES), attrs=file_attrs, name=MATRIX_NAME
+        )
+
+    @classmethod
+    def from_anndata(
+        cls,
+        adata: Union[anndata.AnnData, str, Path],
+        attrs: Optional[Dict] = None,
+        regions: Optional[Mapping[str, str]] = None,
+        features: Optional[Mapping[str, str]] = None,
+    ) -> "Matrix":
+        """load AnnData, or an .h5ad file, as a matrix of obs (regions) by var (features)
+
+        Files and backed AnnData are read lazily: X is read from disk chunk by chunk when
+        computed, as CSR row blocks if it is sparse. regions and features map coordinates to obs
+        and var columns, as in from_loom. The obs names are used as region_id, the var names as
+        gene_name and the spatial layout in obsm as x and y region coordinates unless they are
+        mapped or present. attrs are added to uns.
+        """
+        opened = not isinstance(adata, anndata.AnnData)
+        if opened:
+            adata = anndata.read_h5ad(adata, backed="r")
+        try:
+            data = _read_h5ad_x(adata.filename) if adata.isbacked else adata.X
+
+            obs = {name: adata.obs[name].values for name in adata.obs.columns}
+            if SCANPY_CONSTANTS.SPATIAL_LAYOUT in adata.obsm:
+                layout = np.asarray(adata.obsm[SCANPY_CONSTANTS.SPATIAL_LAYOUT])
+                for axis, coordinate in enumerate((
+                    MATRIX_REQUIRED_REGIONS.X_REGION.value, MATRIX_REQUIRED_REGIONS.Y_REGION.value
+                )):
+                    if coordinate not in obs and coordinate not in (regions or {}):
+                        obs[coordinate] = layout[:, axis]
+            region_id = MATRIX_REQUIRED_REGIONS.REGION_ID.value
+            if region_id not in obs and region_id not in (regions or {}):
+                obs[region_id] = adata.obs_names.values
+            var = {name: adata.var[name].values for name in adata.var.columns}
+            gene_name = MATRIX_REQUIRED_FEATURES.GENE_NAME.value
+            if gene_name not in var and gene_name not in (features or {}):
+                var[gene_name] = adata.var_names.values
+
+            coords = _map_coords(obs, MATRIX_AXES.REGIONS.value, regions)
+            coords.update(_map_coords(var, MATRIX_AXES.FEATURES.value, features))
+            uns = dict(adata.uns)
+            uns.update(attrs or {})
+        finally:
+            # X is read through its own handles, so the file opened here is closed
+            if opened:
+                adata.file.close()
+
+        return cls.from_expression_data(
+            data=data, coords=coords, dims=tuple(MATRIX_AXES), attrs=uns, name=MATRIX_NAME
+        )
+
+    @property
+    def is_sparse(self) -> bool:
+        """True if the matrix is a dask array of scipy.sparse blocks"""
+        return sp.issparse(getattr(self.data, "_meta", None))
+
+    def to_csr(self) -> sp.csr_matrix:
+        """return the matrix as a scipy.sparse CSR matrix, without densifying sparse matrices"""
+        if self.is_sparse:
+            return sp.csr_matrix(self.data.compute())
+        return sp.csr_matrix(self.values)
+
+    def _to_sparse_dataset(self) -> xr.Dataset:
+        """lay the matrix out as the data, indices and indptr arrays of a CSR matrix"""
+        csr = self.to_csr()
+        dataset = xr.Dataset(
+            data_vars={
+                MATRIX_SPARSE_VARIABLES.DATA.value: (MATRIX_SPARSE_AXES.NNZ.value, csr.data),
+                MATRIX_SPARSE_VARIABLES.INDICES.value: (
+                    MATRIX_SPARSE_AXES.NNZ.value, csr.indices
+                ),
+                MATRIX_SPARSE_VARIABLES.INDPTR.value: (
+                    MATRIX_SPARSE_AXES.INDPTR.value, csr.indptr
+                ),
+            },
+            coords=self.coords,
+            attrs=self.attrs,
+        )
+        sparse_attrs = {"format": MATRIX_SPARSE_FORMAT, "shape": list(csr.shape)}
+        if self.name is not None:
+            sparse_attrs["name"] = self.name
+        dataset[MATRIX_SPARSE_VARIABLES.DATA.value].attrs = sparse_attrs
+        return dataset
+
+    @classmethod
+    def _from_sparse_dataset(cls, dataset: xr.Dataset) -> "Matrix":
+        data = dataset[MATRIX_SPARSE_VARIABLES.DATA.value]
+        if data.attrs.get("format") != MATRIX_SPARSE_FORMAT:
+            raise ValueError(f"unsupported sparse matrix format {data.attrs.get('format')}")
+
+        # indptr is one integer per region and is read up front to locate each row block
+        sparse_data = _csr_arrays_to_dask(
+            data.data,
+            dataset[MATRIX_SPARSE_VARIABLES.INDICES.value].data,
+            np.asarray(dataset[MATRIX_SPARSE_VARIABLES.INDPTR.value]),
+            shape=tuple(data.attrs["shape"]),
+        )
+        return cls(
+            data=sparse_data,
+            dims=tuple(axis.value for axis in MATRIX_AXES),
+            coords=dataset.coords,
+            attrs=dataset.attrs,
+            name=data.attrs.get("name"),
+        )
+
+    def save_zarr(
+        self,
+        url: str,
+        profile_name: str = "spacetx",
+        codecs: Union[str, CodecPolicy, None] = None,
+        bitmap_indexes: Sequence[str] = (),
+    ) -> None:
+        """save the matrix to {url}.matrix.zarr
+
+        codecs is a CodecPolicy, or the name of one in starspace.encoding.CODEC_POLICIES, that
+        sets the compression, filters and chunking of each variable.
+
+        bitmap_indexes names region coordinates whose bitmap indexes are saved in the store and
+        restored by load_zarr, see Matrix.filter.
+        """
+        if self.is_sparse:
+            dataset = self._to_sparse_dataset()
+        elif self.name is None:
             dataset = self.to_dataset(name=MATRIX_NAME)
         else:
             dataset = self.to_dataset()
 
-        _save_zarr(dataset, url, profile_name, suffix=MATRIX_NAME)
+        for coordinate in bitmap_indexes:
+            coordinate = getattr(coordinate, "value", coordinate)
+            dataset = dataset.merge(self.bitmap_index(coordinate).to_dataset(coordinate))
+
+        _save_zarr(
+            dataset, url, profile_name, suffix=MATRIX_NAME, codecs=codecs, source=self
+        )
 
     @classmethod
-    def load_zarr(cls, url) -> "Matrix":
+    def load_zarr(cls, url, eager: bool = False, legacy_names: bool = False) -> "Matrix":
+        """load a matrix lazily, or into memory if eager is True
+
+        legacy_names reads a store saved by a release whose enums indexed the schema at stale
+        positions, which stored region coordinates under the names of others, e.g. x under
+        y_region_microns; they are renamed as in constants.LEGACY_MATRIX_REGIONS.
+        """
+
+        dataset = _load_zarr(url, eager=eager)
+        if legacy_names:
+            dataset = _rename_legacy(dataset, LEGACY_MATRIX_REGIONS)
+
+        bitmaps = {}
+        for name in bitmap_variables(dataset):
+            bitmaps[dataset[name].attrs["coordinate"]] = BitmapIndex.from_dataset(dataset, name)
+            categories, _ = dataset[name].dims
+            dataset = dataset.drop_vars([name, categories])
 
-        dataset = _load_zarr(url)
+        if MATRIX_SPARSE_VARIABLES.DATA.value in dataset.data_vars:
+            matrix = cls._from_sparse_dataset(dataset)
+            matrix._cache_bitmap_indexes(bitmaps)
+            return matrix
 
         if len(dataset.data_vars) != 1:
             raise ValueError('Given file dataset contains more than one data '
@@ -149,17 +703,33 @@ class Matrix(xr.DataArray):
         if data_array.name == MATRIX_NAME:
             data_array.name = None
 
-        return cls(data_array)
-
-    def to_loom(self, loom_file_name) -> None:
-        row_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.REGIONS].coords.items()}
-        col_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.FEATURES].coords.items()}
-        file_attrs = self.attrs
-        loompy.create(
-            loom_file_name, self.values, row_attrs, col_attrs, file_attrs=file_attrs
+        matrix = _wrap_data_array(cls, data_array)
+        matrix._cache_bitmap_indexes(bitmaps)
+        return matrix
+
+    def to_loom(self, loom_file_name, parallel_blocks: int = 1) -> None:
+        """write the matrix to a loom file with features as rows and regions as columns
+
+        The file is written one block of regions at a time, computing parallel_blocks blocks at
+        once, so the matrix is never loaded into memory whole.
+        """
+        row_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.FEATURES].coords.items()}
+        col_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.REGIONS].coords.items()}
+        file_attrs = {getattr(k, "value", k): v for k, v in self.attrs.items()}
+        write_loom(
+            loom_file_name, _as_dask(self.data), row_attrs, col_attrs, file_attrs,
+            parallel_blocks=parallel_blocks,
         )
 
-    def to_anndata(self) -> anndata.AnnData:
+    def to_anndata(
+        self, filename: Union[str, Path, None] = None, parallel_blocks: int = 1
+    ) -> anndata.AnnData:
+        """convert the matrix to AnnData, in memory or streamed to an .h5ad file
+
+        With a filename, obs, var, obsm and uns are written once and X is then written one block
+        of regions at a time, as CSR if the matrix is sparse, so that only parallel_blocks
+        blocks are in memory at once. The file is returned opened in backed mode.
+        """
 
         # scanpy uses obsm to record layout information
         obsm = OrderedDict()
@@ -171,15 +741,208 @@ class Matrix(xr.DataArray):
 
         row_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.REGIONS].coords.items()}
         col_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.FEATURES].coords.items()}
-        file_attrs = self.attrs
+        file_attrs = {getattr(k, "value", k): v for k, v in self.attrs.items()}
+
+        if filename is None:
+            x = self.to_csr() if self.is_sparse else self.values
+            adata = anndata.AnnData(
+                X=x, obs=row_attrs, var=col_attrs, uns=file_attrs, obsm=obsm
+            )
+
+            # set gene names
+            adata.var_names = adata.var[MATRIX_REQUIRED_FEATURES.GENE_NAME]
+            return adata
 
+        n_regions, n_features = self.shape
         adata = anndata.AnnData(
-            X=self.values, obs=row_attrs, var=col_attrs, uns=file_attrs, obsm=obsm
+            obs=pd.DataFrame(row_attrs, index=np.arange(n_regions).astype(str)),
+            var=pd.DataFrame(col_attrs, index=np.arange(n_features).astype(str)),
+            uns=file_attrs,
+            obsm=obsm,
         )
-
-        # set gene names
         adata.var_names = adata.var[MATRIX_REQUIRED_FEATURES.GENE_NAME]
-        return adata
+        adata.write_h5ad(filename)
+        with h5py.File(filename, "a") as h5file:
+            write_h5ad_x(
+                h5file, _as_dask(self.data), self.is_sparse, parallel_blocks=parallel_blocks
+            )
+        return anndata.read_h5ad(filename, backed="r")
+
+    def neighbor_graph(
+        self,
+        method: str = "knn",
+        k: int = 6,
+        radius: Optional[float] = None,
+        by: Optional[str] = None,
+        use_z: bool = False,
+        workers: int = -1,
+        url: Union[str, Path, None] = None,
+        profile_name: str = "spacetx",
+    ) -> sp.csr_matrix:
+        """sparse regions x regions graph of neighboring region centroids
+
+        See starspace.graph.neighbor_graph for the methods and parameters. by names a region
+        coordinate, such as fov, whose groups are connected separately, for coordinates that are
+        local to each group. Graphs are cached on the matrix by their parameters, and rebuilt
+        when the region coordinates change.
+
+        If url is given, the graph is read from {url}.matrix.graph.{parameters}.zarr if it was
+        saved there before, and otherwise built and saved there. A saved graph of other region
+        coordinates raises a ValueError.
+        """
+        key = graph_key(method, k, radius, by, use_z)
+        coordinates = self._spatial_coordinates(use_z)
+        groups = None if by is None else np.asarray(self[getattr(by, "value", by)])
+        # graphs of coordinates that have changed since they were built are not reused
+        fingerprint = _fingerprint(coordinates, *([] if groups is None else [groups]))
+        entry = _derived_cache(self).get(f"{NEIGHBOR_GRAPH_NAME}.{key}")
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+
+        graph = None
+        store = None
+        if url is not None:
+            url = str(url).rstrip("/")
+            store = f"{url}.{MATRIX_NAME}.{NEIGHBOR_GRAPH_NAME}.{key}.zarr"
+            filesystem, path = get_filesystem(store, profile_name)
+            if filesystem.exists(path):
+                dataset = _load_zarr(store, eager=True, profile_name=profile_name)
+                graph = graph_from_dataset(dataset)
+                if graph.shape[0] != self.sizes[MATRIX_AXES.REGIONS.value]:
+                    raise ValueError(f"neighbor graph at {store} does not match the regions")
+                if dataset.attrs.get("fingerprint", fingerprint) != fingerprint:
+                    raise ValueError(
+                        f"neighbor graph at {store} was built from other region coordinates"
+                    )
+
+        if graph is None:
+            graph = build_neighbor_graph(
+                coordinates, method=method, k=k, radius=radius, groups=groups, workers=workers,
+            )
+            if store is not None:
+                _save_zarr(
+                    graph_to_dataset(graph, key, fingerprint), url, profile_name,
+                    suffix=f"{MATRIX_NAME}.{NEIGHBOR_GRAPH_NAME}.{key}", manifest=False,
+                )
+
+        _derived_cache(self)[f"{NEIGHBOR_GRAPH_NAME}.{key}"] = (fingerprint, graph)
+        return graph
+
+    def spatial_autocorrelation(
+        self,
+        graph: Optional[sp.spmatrix] = None,
+        transform: Optional[str] = "row",
+        n_permutations: int = 0,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Moran's I and Geary's C of every feature, with optional permutation p-values
+
+        graph defaults to neighbor_graph() and is turned into weights by spatial_weights with
+        transform. Other keyword arguments are passed to
+        starspace.autocorrelation.spatial_autocorrelation.
+        """
+        if graph is None:
+            graph = self.neighbor_graph()
+        return spatial_autocorrelation(
+            self.data,
+            spatial_weights(graph, transform=transform),
+            features=self[MATRIX_REQUIRED_FEATURES.GENE_NAME.value].values,
+            n_permutations=n_permutations,
+            **kwargs,
+        )
+
+    def label_index(self, coordinate: str) -> pd.Index:
+        """hash index over the labels of a 1d coordinate, cached until the coordinate changes
+
+        Any coordinate can be indexed, typically gene_name, region_id or categorical region
+        annotations. Labels need not be unique.
+        """
+        coordinate = getattr(coordinate, "value", coordinate)
+        if coordinate not in self.coords or self[coordinate].ndim != 1:
+            raise ValueError(f"{coordinate} is not a 1d coordinate of the matrix")
+        values = np.asarray(self[coordinate].values)
+        # reassigning the coordinate changes its fingerprint, which rebuilds the index
+        return _cached(
+            self, f"labels.{coordinate}", _fingerprint(values), lambda: pd.Index(values)
+        )
+
+    def label_positions(self, coordinate: str, labels) -> np.ndarray:
+        """positions along its dimension of the entries of coordinate that have the given labels
+
+        Positions follow the order of labels; a label held by several entries yields all of
+        them. Raises KeyError if any label is not found.
+        """
+        index = self.label_index(coordinate)
+        labels = np.atleast_1d(np.asarray(labels))
+        positions = index.get_indexer_for(labels)
+        if (positions < 0).any():
+            missing = labels[~np.isin(labels, index)]
+            raise KeyError(f"labels not found in {coordinate}: {missing.tolist()}")
+        return positions
+
+    def select(self, **labels) -> "Matrix":
+        """select entries by the labels of their coordinates with a single isel
+
+        e.g. matrix.select(gene_name=["Gad1", "Sst"]). Labels are translated to positions with
+        the cached label indexes, so only the chunks holding the selection are read. Selections
+        on several coordinates of one dimension are intersected.
+        """
+        positions = {}
+        for coordinate, values in labels.items():
+            dim, = self[coordinate].dims
+            found = self.label_positions(coordinate, values)
+            if dim in positions:
+                found = positions[dim][np.isin(positions[dim], found)]
+            positions[dim] = found
+        return self.isel(positions)
+
+    def bitmap_index(self, coordinate: str) -> BitmapIndex:
+        """bitmap index over the categories of a region coordinate, cached until it changes
+
+        Meant for low-cardinality coordinates such as fov, group_id or type_annotation.
+        """
+        coordinate = getattr(coordinate, "value", coordinate)
+        if coordinate not in self.coords or (
+            self[coordinate].dims != (MATRIX_AXES.REGIONS.value,)
+        ):
+            raise ValueError(f"{coordinate} is not a coordinate of the matrix regions")
+        values = self[coordinate].values
+        return _cached(
+            self, f"{MATRIX_BITMAP_FORMAT}.{coordinate}", _fingerprint(values),
+            lambda: BitmapIndex.build(values),
+        )
+
+    def _cache_bitmap_indexes(self, indexes: Dict[str, BitmapIndex]) -> None:
+        """cache bitmap indexes loaded with the matrix, as built from its current coordinates"""
+        for coordinate, index in indexes.items():
+            if index.size != self.sizes[MATRIX_AXES.REGIONS.value]:
+                raise ValueError(f"bitmap index of {coordinate} does not match the regions")
+            _derived_cache(self)[f"{MATRIX_BITMAP_FORMAT}.{coordinate}"] = (
+                _fingerprint(self[coordinate].values), index
+            )
+
+    def filter_positions(self, **conditions) -> np.ndarray:
+        """sorted positions of the regions that match every condition
+
+        Each keyword is a region coordinate and its value a label or a list of labels, any of
+        which matches, e.g. matrix.filter_positions(fov=[1, 2], sample_type="MRL-8").
+        """
+        mask = None
+        index = None
+        for coordinate, labels in conditions.items():
+            index = self.bitmap_index(coordinate)
+            mask = index.mask(labels) if mask is None else mask & index.mask(labels)
+        if index is None:
+            return np.arange(self.sizes[MATRIX_AXES.REGIONS.value])
+        return index.unpack(mask)
+
+    def filter(self, **conditions) -> "Matrix":
+        """the regions that match every condition, selected with their bitmap indexes
+
+        See filter_positions. Unlike where(), this builds no boolean arrays over the matrix and
+        selects the matching regions with a single isel.
+        """
+        return self.isel({MATRIX_AXES.REGIONS.value: self.filter_positions(**conditions)})
 
     def column_metadata(self) -> pd.DataFrame:
         return pd.DataFrame(
@@ -191,9 +954,17 @@ class Matrix(xr.DataArray):
             row_attrs = {k: v.values for (k, v) in self[MATRIX_AXES.REGIONS].coords.items()}
         )
 
-class Spots(xr.Dataset):
+class Spots(_SpatiallyIndexed, xr.Dataset):
 
-    __slots__ = []
+    __slots__ = ["_derived"]
+
+    _SPATIAL_VARIABLES = (
+        SPOTS_REQUIRED_VARIABLES.X_SPOT.value,
+        SPOTS_REQUIRED_VARIABLES.Y_SPOT.value,
+        SPOTS_OPTIONAL_VARIABLES.Z_SPOT.value,
+    )
+    _SPATIAL_NAME = SPOTS_NAME
+    _SPATIAL_DIM = SPOTS_AXES.SPOTS.value
 
     @classmethod
     def from_spot_data(cls, dataframe: pd.DataFrame, attrs: Dict):
@@ -222,12 +993,53 @@ class Spots(xr.Dataset):
         dataset.attrs = attrs
         return dataset
 
-    def save_zarr(self, url: str, profile_name: str = "spacetx"):
-        _save_zarr(self, url, profile_name, suffix=SPOTS_NAME)
+    def save_zarr(
+        self, url: str, profile_name: str = "spacetx", codecs: Union[str, CodecPolicy, None] = None
+    ):
+        """save spots to {url}.spots.zarr, with compression set by an optional codec policy"""
+        _save_zarr(self, url, profile_name, suffix=SPOTS_NAME, codecs=codecs)
 
     @classmethod
-    def load_zarr(cls, url: str) -> "Spots":
-        dataset = _load_zarr(url)
+    def load_zarr(
+        cls,
+        url: str,
+        eager: bool = False,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Sequence[Tuple[str, str, Any]]] = None,
+        legacy_names: bool = False,
+    ) -> "Spots":
+        """load spots lazily, or into memory if eager is True
+
+        columns restricts the variables that are read. filters is a sequence of
+        (column, op, value) predicates that are ANDed together, where op is one of ==, !=, <,
+        <=, >, >=, in or not in, e.g. [("gene_name", "in", {"ACTA", "ACTB"}),
+        ("quality", ">=", 0.5)]. Only the filter columns are read to evaluate the predicates,
+        one zarr chunk at a time, and only the matching spots of the remaining columns are read.
+
+        legacy_names reads a store saved by a release whose enums indexed the schema at stale
+        positions, which stored columns under the names of others, e.g. region_id under
+        y_spot_pixels; they are renamed as in constants.LEGACY_SPOTS_VARIABLES before columns
+        and filters are applied.
+        """
+        stored = _load_zarr(url)
+        if legacy_names:
+            stored = _rename_legacy(stored, LEGACY_SPOTS_VARIABLES)
+        dataset = stored
+
+        if columns is not None:
+            columns = [c.value if isinstance(c, Enum) else c for c in columns]
+            dataset = dataset[columns]
+
+        if filters:
+            filter_columns = [
+                column.value if isinstance(column, Enum) else column for column, _, _ in filters
+            ]
+            mask = _filter_mask(stored[filter_columns], filters)
+            dataset = dataset.isel({SPOTS_AXES.SPOTS.value: np.flatnonzero(mask)})
+
+        if eager:
+            dataset = dataset.load()
+
         spots = cls(dataset)
         spots.attrs = dataset.attrs
         return spots
@@ -235,8 +1047,41 @@ class Spots(xr.Dataset):
     def to_records(self) -> np.array:
         return self.to_dataframe().to_records()
 
-    def to_spatial_matrix(self) -> "Matrix":
-        """convert spots to a matrix, provided required optional annotations are present"""
+    def assign_regions(self, regions: "Regions", pixel_size: float = 1.0) -> "Spots":
+        """assign each spot to the region of the label image pixel it falls in
+
+        Spot coordinates are divided by pixel_size, the size of a label image pixel in microns,
+        and rounded to pixel indices. Labels are gathered one label image chunk at a time, so the
+        label image is never loaded in full. Spots on background pixels or outside of the image
+        are given a missing region_id. Region x and y coordinates are set to region centroids.
+        """
+        label_image = regions._label_image()
+
+        pixels = []
+        for variable in (SPOTS_REQUIRED_VARIABLES.Y_SPOT, SPOTS_REQUIRED_VARIABLES.X_SPOT):
+            pixel = np.round(np.asarray(self[variable.value], dtype=float) / pixel_size)
+            # spots with missing coordinates are placed outside the image
+            pixels.append(np.where(np.isnan(pixel), -1, pixel).astype(np.int64))
+
+        labels = sample_labels(label_image, *pixels)
+        assigned = labels != BACKGROUND
+        centroids = region_centroids(label_image).reindex(np.where(assigned, labels, np.nan))
+
+        dim = SPOTS_AXES.SPOTS.value
+        return self.assign({
+            SPOTS_OPTIONAL_VARIABLES.REGION_ID.value: (dim, np.where(assigned, labels, np.nan)),
+            SPOTS_OPTIONAL_VARIABLES.Y_REGION.value: (dim, centroids["row"].values * pixel_size),
+            SPOTS_OPTIONAL_VARIABLES.X_REGION.value: (dim, centroids["col"].values * pixel_size),
+        })
+
+    def to_spatial_matrix(self, sparse: bool = False) -> "Matrix":
+        """convert spots to a matrix, provided required optional annotations are present
+
+        Spots missing a region, region coordinate or gene are dropped, then region ids and gene
+        names are factorized into integer codes and counted with a single grouped aggregation.
+        The result is an integer region x gene count matrix, backed by CSR blocks if sparse is
+        True.
+        """
 
         for field in chain(MATRIX_REQUIRED_REGIONS, MATRIX_REQUIRED_FEATURES):
             if not hasattr(self, field):
@@ -244,55 +1089,116 @@ class Spots(xr.Dataset):
                     f"dataset must have a '{field}' field to be pivoted to a region x feature matrix"
                 )
 
-        data = self.to_dataframe()
+        region_ids = np.asarray(self[MATRIX_REQUIRED_REGIONS.REGION_ID.value])
+        x_region = np.asarray(self[MATRIX_REQUIRED_REGIONS.X_REGION.value])
+        y_region = np.asarray(self[MATRIX_REQUIRED_REGIONS.Y_REGION.value])
+        gene_names = np.asarray(self[MATRIX_REQUIRED_FEATURES.GENE_NAME.value])
+
+        # drop spots missing values in required variables before aggregating. string columns
+        # are stored as fixed-width unicode, so missing gene names are stored as "nan"
+        keep = ~(
+            pd.isnull(region_ids) | pd.isnull(x_region) | pd.isnull(y_region)
+            | pd.isnull(gene_names) | (gene_names == "nan")
+        )
+        region_ids, x_region, y_region, gene_names = (
+            region_ids[keep], x_region[keep], y_region[keep], gene_names[keep]
+        )
 
-        grouped = data.groupby([MATRIX_REQUIRED_REGIONS.REGION_ID.value, MATRIX_REQUIRED_FEATURES.GENE_NAME])
-        matrix = grouped.count().iloc[:, 0].unstack("gene_name")
+        region_codes, regions = pd.factorize(region_ids, sort=True)
+        gene_codes, genes = pd.factorize(gene_names, sort=True)
+        shape = (regions.shape[0], genes.shape[0])
 
-        group_columns = [
-            MATRIX_REQUIRED_REGIONS.REGION_ID,
-            MATRIX_REQUIRED_REGIONS.Y_REGION,
-            MATRIX_REQUIRED_REGIONS.X_REGION
-        ]
-        region_ids_map = data.groupby(group_columns).size().reset_index().drop(0, axis=1)
+        if sparse:
+            # duplicate (region, gene) entries are summed when converting to CSR
+            counts = _sparse_to_dask(sp.csr_matrix(
+                (np.ones(region_codes.shape[0], dtype=np.int64), (region_codes, gene_codes)),
+                shape=shape
+            ))
+        else:
+            counts = npg.aggregate(
+                np.vstack([region_codes, gene_codes]), 1, func="sum", size=shape, fill_value=0,
+                dtype=np.int64
+            )
+
+        # region coordinates are taken from the first spot assigned to each region
+        first_spot = npg.aggregate(
+            region_codes, np.arange(region_codes.shape[0]), func="first", size=shape[0]
+        )
 
         coords = {
-            MATRIX_REQUIRED_FEATURES.GENE_NAME: (MATRIX_AXES.FEATURES.value, matrix.columns),
-            MATRIX_REQUIRED_REGIONS.X_REGION: (
-                MATRIX_AXES.REGIONS.value,
-                region_ids_map.loc[matrix.index, MATRIX_REQUIRED_REGIONS.X_REGION]
-            ),
-            MATRIX_REQUIRED_REGIONS.Y_REGION: (
-                MATRIX_AXES.REGIONS.value,
-                region_ids_map.loc[matrix.index, MATRIX_REQUIRED_REGIONS.Y_REGION]
-            ),
-            MATRIX_REQUIRED_REGIONS.REGION_ID: (MATRIX_AXES.REGIONS.value, matrix.index),
+            MATRIX_REQUIRED_FEATURES.GENE_NAME: (MATRIX_AXES.FEATURES.value, genes),
+            MATRIX_REQUIRED_REGIONS.X_REGION: (MATRIX_AXES.REGIONS.value, x_region[first_spot]),
+            MATRIX_REQUIRED_REGIONS.Y_REGION: (MATRIX_AXES.REGIONS.value, y_region[first_spot]),
+            MATRIX_REQUIRED_REGIONS.REGION_ID: (MATRIX_AXES.REGIONS.value, regions),
         }
         coords = _correct_coords(coords)
         dims = (MATRIX_AXES.REGIONS.value, MATRIX_AXES.FEATURES.value)
 
-        data_array = xr.DataArray(
-            data=matrix.values, coords=coords, dims=dims, attrs=self.attrs, name="matrix"
+        return Matrix(data=counts, coords=coords, dims=dims, attrs=self.attrs, name="matrix")
+
+    def to_binned_matrix(
+        self, bin_size: float, shape: str = "square", split_every: int = 8
+    ) -> "Matrix":
+        """count spots per gene in square or hex bins of bin_size microns, as a sparse matrix
+
+        Bins are computed from spot coordinates and counted one chunk of spots at a time, then
+        partial counts are merged split_every at a time (see starspace.binning.bin_counts), so
+        lazily loaded spots are streamed from their zarr columns. Only bins holding spots are
+        included. Their centers are the region coordinates, and they are numbered by row, then
+        column.
+        """
+        x, y, genes = (
+            self[variable.value].data for variable in (
+                SPOTS_REQUIRED_VARIABLES.X_SPOT,
+                SPOTS_REQUIRED_VARIABLES.Y_SPOT,
+                SPOTS_REQUIRED_VARIABLES.GENE_NAME,
+            )
+        )
+        counts, bins, gene_names = bin_counts(
+            x, y, genes, bin_size, shape=shape, split_every=split_every
         )
 
-        # fill nan with zero
-        data_array = data_array.fillna(0)
+        coords = {
+            MATRIX_REQUIRED_FEATURES.GENE_NAME: (MATRIX_AXES.FEATURES.value, gene_names),
+            MATRIX_REQUIRED_REGIONS.X_REGION: (MATRIX_AXES.REGIONS.value, bins["x"].values),
+            MATRIX_REQUIRED_REGIONS.Y_REGION: (MATRIX_AXES.REGIONS.value, bins["y"].values),
+            MATRIX_REQUIRED_REGIONS.REGION_ID: (
+                MATRIX_AXES.REGIONS.value, np.arange(bins.shape[0])
+            ),
+        }
+        coords = _correct_coords(coords)
+        dims = (MATRIX_AXES.REGIONS.value, MATRIX_AXES.FEATURES.value)
 
-        # drop features or region missing values in required variables.
-        data_array = data_array.where(
-            data_array[MATRIX_REQUIRED_FEATURES.GENE_NAME.value] != "nan", drop=True
-        )
-        data_array = data_array.where(
-            data_array[MATRIX_REQUIRED_REGIONS.REGION_ID.value].notnull(), drop=True
-        )
-        data_array = data_array.where(
-            data_array[MATRIX_REQUIRED_REGIONS.X_REGION.value].notnull(), drop=True
-        )
-        data_array = data_array.where(
-            data_array[MATRIX_REQUIRED_REGIONS.Y_REGION.value].notnull(), drop=True
+        return Matrix(
+            data=_sparse_to_dask(counts), coords=coords, dims=dims, attrs=self.attrs,
+            name="matrix"
         )
 
-        return Matrix(data_array)
+    def colocalization(
+        self,
+        radii: Sequence[float],
+        tile_size: Optional[float] = None,
+        use_z: bool = False,
+        workers: int = -1,
+    ) -> xr.DataArray:
+        """count neighboring spots within each of radii, for every pair of genes
+
+        Returns a gene x neighbor gene x radius array of pair counts, see
+        starspace.colocalization.pair_counts; cross_k and cross_l turn it into cross-K and
+        cross-L functions. Tiles of spots gather their neighbors from the spatial index, which
+        is built and cached if there isn't one.
+        """
+        coordinates = self._spatial_coordinates(use_z)
+        # the index can't hold spots with missing coordinates, which are skipped anyway
+        index = self.spatial_index if np.isfinite(coordinates).all() else None
+        return colocalization(
+            coordinates,
+            np.asarray(self[SPOTS_REQUIRED_VARIABLES.GENE_NAME.value]),
+            radii,
+            tile_size=tile_size,
+            index=index,
+            workers=workers,
+        )
 
 
 class Regions(xr.DataArray):
@@ -318,17 +1224,133 @@ class Regions(xr.DataArray):
 
         return cls(label_image, dims=dims, attrs=attrs)
 
-    def save_zarr(self, url, profile_name: str = "spacetx"):
+    def _label_image(self):
+        """the label image data, with y as the first axis and x as the second"""
+        return self.transpose(REGIONS_AXES.Y_REGION.value, REGIONS_AXES.X_REGION.value).data
+
+    def properties(self, pixel_size: float = 1.0, intensity_image=None) -> pd.DataFrame:
+        """measure area, centroid and bounding box of each region, one row per region
+
+        Properties are computed in a single parallel pass over the label image chunks. The
+        region_id, x and y region (centroids, scaled by pixel_size) and area columns are named
+        after the matrix region coordinates they can fill. The pixel bounding box follows, with
+        exclusive maxima, and mean_intensity if a 2-d intensity image is given.
+        """
+        intensity_image = getattr(intensity_image, "data", intensity_image)
+        measured = region_properties(self._label_image(), intensity_image)
+
+        properties = pd.DataFrame({
+            MATRIX_REQUIRED_REGIONS.REGION_ID.value: measured.index.values,
+            MATRIX_REQUIRED_REGIONS.X_REGION.value: measured["col"].values * pixel_size,
+            MATRIX_REQUIRED_REGIONS.Y_REGION.value: measured["row"].values * pixel_size,
+            MATRIX_OPTIONAL_REGIONS.AREA_PIXELS.value: measured["area"].values,
+            MATRIX_OPTIONAL_REGIONS.AREA_UM2.value: measured["area"].values * pixel_size ** 2,
+        })
+        for column in measured.columns.drop(["area", "row", "col"]):
+            properties[column] = measured[column].values
+        return properties
+
+    def save_zarr(
+        self,
+        url,
+        profile_name: str = "spacetx",
+        pyramid_levels: int = 0,
+        pyramid_method: str = "mode",
+        layout: str = "dense",
+        codecs: Union[str, CodecPolicy, None] = None,
+    ):
+        """save the label image, optionally with a multiscale pyramid in the same store
+
+        Each of the pyramid_levels halves the resolution of the one below it, keeping the most
+        common label of each 2x2 window ("mode") or its top left pixel ("nearest"). Levels are
+        computed lazily and written in parallel with the full resolution image.
+
+        layout="rle" stores the runs of non-background labels in each row instead of the dense
+        image, which is much smaller for segmentations that cover a small part of the image.
+        load_zarr rasterizes it lazily, one chunk at a time.
+
+        codecs is an optional codec policy, see Matrix.save_zarr.
+        """
+        if layout == "rle":
+            if pyramid_levels:
+                raise ValueError("pyramid levels can only be saved with the dense layout")
+            _save_zarr(
+                self._to_rle_dataset(), url, profile_name, suffix=REGIONS_NAME, codecs=codecs,
+                source=self,
+            )
+            return
+        elif layout != "dense":
+            raise ValueError(f"layout must be 'dense' or 'rle', not {layout}")
+
         if self.name is None:
             dataset = self.to_dataset(name=REGIONS_NAME)
         else:
             dataset = self.to_dataset()
 
-        _save_zarr(dataset, url, profile_name, suffix=REGIONS_NAME)
+        name, = dataset.data_vars
+        dims = [str(getattr(dim, "value", dim)) for dim in self.dims]
+        pyramid = build_pyramid(self.data, pyramid_levels, method=pyramid_method)
+        for level, data in enumerate(pyramid[1:], start=1):
+            dataset[f"{name}_{level}"] = xr.DataArray(
+                data, dims=[f"{dim}_{level}" for dim in dims],
+                attrs={REGIONS_PYRAMID_LEVEL: level},
+            )
+
+        _save_zarr(
+            dataset, url, profile_name, suffix=REGIONS_NAME, codecs=codecs, source=self
+        )
+
+    def _to_rle_dataset(self) -> xr.Dataset:
+        dataset = runlength.encode(self._label_image())
+        dataset.attrs = self.attrs
+        labels = dataset[REGIONS_RLE_VARIABLES.LABELS.value]
+        labels.attrs["dims"] = [REGIONS_AXES.Y_REGION.value, REGIONS_AXES.X_REGION.value]
+        if self.name is not None:
+            labels.attrs["name"] = self.name
+        return dataset
 
     @classmethod
-    def load_zarr(cls, url):
-        dataset = _load_zarr(url)
+    def _from_rle_dataset(cls, dataset: xr.Dataset) -> "Regions":
+        labels = dataset[REGIONS_RLE_VARIABLES.LABELS.value]
+        return cls(
+            runlength.decode(dataset), dims=tuple(labels.attrs["dims"]), attrs=dataset.attrs,
+            name=labels.attrs.get("name"),
+        )
+
+    @classmethod
+    def load_pyramid(cls, url, eager: bool = False) -> List[Union[np.ndarray, da.Array]]:
+        """load the label image followed by its pyramid levels, highest resolution first
+
+        The list can be passed directly to napari as multiscale label data, e.g.
+        viewer.add_labels(Regions.load_pyramid(url), multiscale=True), which then only reads
+        the chunks of the level being displayed. Stores saved with layout="rle" have no pyramid
+        levels; their label image is rasterized and returned as the only level. Levels are lazy
+        dask arrays, or numpy arrays if eager is True.
+        """
+        dataset = _load_zarr(url, eager=eager)
+        if REGIONS_RLE_VARIABLES.LABELS.value in dataset.data_vars:
+            regions = cls._from_rle_dataset(dataset)
+            return [regions.load().data if eager else regions.data]
+
+        levels = sorted(
+            dataset.data_vars.values(), key=lambda v: v.attrs.get(REGIONS_PYRAMID_LEVEL, 0)
+        )
+        return [level.data for level in levels]
+
+    @classmethod
+    def load_zarr(cls, url, eager: bool = False) -> "Regions":
+        """load a label image lazily, or into memory if eager is True"""
+        dataset = _load_zarr(url, eager=eager)
+
+        if REGIONS_RLE_VARIABLES.LABELS.value in dataset.data_vars:
+            regions = cls._from_rle_dataset(dataset)
+            return regions.load() if eager else regions
+
+        # pyramid levels are stored next to the full resolution image
+        dataset = dataset[[
+            name for name, variable in dataset.data_vars.items()
+            if REGIONS_PYRAMID_LEVEL not in variable.attrs
+        ]]
 
         if len(dataset.data_vars) != 1:
             raise ValueError('Given file dataset contains more than one data '
@@ -344,4 +1366,4 @@ class Regions(xr.DataArray):
         if data_array.name == MATRIX_NAME:
             data_array.name = None
 
-        return cls(data_array)
+        return _wrap_data_array(cls, data_array)
@@ -0,0 +1,194 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+import xarray as xr
+from scipy.spatial import cKDTree
+
+from .constants import MATRIX_REQUIRED_FEATURES
+from .spatial import GridIndex, default_tile_size
+
+COLOCALIZATION_NAME = "colocalization"
+NEIGHBOR_GENE_NAME = f"neighbor_{MATRIX_REQUIRED_FEATURES.GENE_NAME.value}"
+RADIUS = "radius"
+N_SPOTS = "n_spots"
+
+# average number of points per tile when a tile size isn't specified
+_POINTS_PER_TILE = 250_000
+# expected number of neighbor pairs materialized at once when counting a tile
+_PAIRS_PER_BATCH = 2 ** 22
+
+
+def _tiles(coordinates: np.ndarray, keep: np.ndarray, tile_size: float) -> List[np.ndarray]:
+    """positions of the kept points in each non-empty square tile of tile_size"""
+    positions = np.flatnonzero(keep)
+    tiles = np.floor(
+        (coordinates[positions, :2] - coordinates[positions, :2].min(axis=0)) / tile_size
+    ).astype(np.int64)
+    tile_ids = tiles[:, 0] * (tiles[:, 1].max() + 1) + tiles[:, 1]
+    order = np.argsort(tile_ids, kind="stable")
+    bounds = np.flatnonzero(np.diff(tile_ids[order])) + 1
+    return np.split(positions[order], bounds)
+
+
+def _tile_counts(
+    coordinates: np.ndarray,
+    codes: np.ndarray,
+    n_genes: int,
+    radii: np.ndarray,
+    core: np.ndarray,
+    context: np.ndarray,
+) -> np.ndarray:
+    """(gene, neighbor gene, radius bin) pair counts of the core points of one tile
+
+    context holds the core points and the halo of points within the largest radius of the
+    tile, so every neighbor of a core point is found in the tree of context. Core points are
+    queried in batches sized from the density of context, so that about _PAIRS_PER_BATCH
+    pairs are held in memory at once.
+    """
+    disc = np.pi * radii[-1] ** 2
+    area = np.prod(np.ptp(coordinates[context, :2], axis=0))
+    neighbors_per_point = context.shape[0] * disc / area if area > disc else context.shape[0]
+    batch_size = max(int(_PAIRS_PER_BATCH / max(neighbors_per_point, 1.0)), 1)
+
+    context_tree = cKDTree(coordinates[context])
+    counts = np.zeros(n_genes * n_genes * radii.shape[0], dtype=np.int64)
+    for start in range(0, core.shape[0], batch_size):
+        batch = core[start:start + batch_size]
+        pairs = cKDTree(coordinates[batch]).sparse_distance_matrix(
+            context_tree, radii[-1], output_type="ndarray"
+        )
+        points, neighbors = batch[pairs["i"]], context[pairs["j"]]
+        # a point is not its own neighbor, but coincident points are neighbors at any radius
+        distinct = points != neighbors
+        bins = np.searchsorted(radii, pairs["v"][distinct], side="left")
+        flat = codes[points[distinct]] * n_genes + codes[neighbors[distinct]]
+        counts += np.bincount(flat * radii.shape[0] + bins, minlength=counts.shape[0])
+    return counts
+
+
+def pair_counts(
+    coordinates: np.ndarray,
+    codes: np.ndarray,
+    n_genes: int,
+    radii: Sequence[float],
+    tile_size: Optional[float] = None,
+    index: Optional[GridIndex] = None,
+    workers: int = -1,
+) -> np.ndarray:
+    """number of ordered pairs of points within each radius, for every pair of genes
+
+    coordinates is an (n, 2) or (n, 3) array and codes the gene of each point, from 0 to
+    n_genes - 1, or -1 for points to skip, whose coordinates may be missing. Entry [a, b, k]
+    counts pairs of a point of gene a and a different point of gene b at most radii[k] apart,
+    so the counts are symmetric.
+
+    Points are split into square tiles of tile_size over x and y, chosen by default so that
+    tiles hold about 250,000 points. Each tile gathers the halo of points within the largest
+    radius of it from index, a grid index over all coordinates that is built over the points
+    that aren't skipped if it isn't given, and counts the pairs of its points at all radii at
+    once, in batches of points with about 4 million pairs between them. Tiles are counted in parallel on workers threads, -1 for one per core.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    codes = np.asarray(codes, dtype=np.int64)
+    radii = np.asarray(radii, dtype=float)
+    if radii.ndim != 1 or not radii.shape[0]:
+        raise ValueError("radii must be a non-empty sequence")
+    if np.any(radii < 0) or np.any(np.diff(radii) <= 0):
+        raise ValueError("radii must be non-negative and increasing")
+
+    shape = (n_genes, n_genes, radii.shape[0])
+    keep = codes >= 0
+    if not keep.any():
+        return np.zeros(shape, dtype=np.int64)
+
+    if tile_size is None:
+        extent = np.ptp(coordinates[keep, :2], axis=0)
+        tile_size = default_tile_size(extent, np.count_nonzero(keep), _POINTS_PER_TILE)
+    if tile_size <= 0:
+        raise ValueError("tile_size must be positive")
+    # positions into coordinates of the points in the index
+    if index is None:
+        indexed = np.flatnonzero(keep)
+        index = GridIndex.build(coordinates[indexed])
+    else:
+        indexed = np.arange(coordinates.shape[0])
+
+    def count(core: np.ndarray) -> np.ndarray:
+        lower = coordinates[core, :2].min(axis=0) - radii[-1]
+        upper = coordinates[core, :2].max(axis=0) + radii[-1]
+        context = indexed[index.query_box(lower, upper)]
+        context = context[keep[context]]
+        return _tile_counts(coordinates, codes, n_genes, radii, core, context)
+
+    tiles = _tiles(coordinates, keep, tile_size)
+    n_threads = os.cpu_count() if workers == -1 else max(workers, 1)
+    counts = np.zeros(int(np.prod(shape)), dtype=np.int64)
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(tiles))) as executor:
+        for tile_counts in executor.map(count, tiles):
+            counts += tile_counts
+
+    # pairs were counted in the smallest radius holding them; larger radii hold them too
+    return np.cumsum(counts.reshape(shape), axis=2)
+
+
+def colocalization(
+    coordinates: np.ndarray,
+    genes: np.ndarray,
+    radii: Sequence[float],
+    tile_size: Optional[float] = None,
+    index: Optional[GridIndex] = None,
+    workers: int = -1,
+) -> xr.DataArray:
+    """gene x neighbor gene x radius counts of neighboring points, see pair_counts
+
+    Points with a missing gene name or coordinate are skipped. The number of points of each
+    gene is kept as the n_spots coordinate and the area of the bounding box of the points as
+    the area attribute, which cross_k and cross_l use to normalize the counts.
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    genes = np.asarray(genes)
+    # string columns are stored as fixed-width unicode, so missing gene names are "nan"
+    missing = (genes == "nan") | (genes == "") | ~np.isfinite(coordinates).all(axis=1)
+    names, codes = np.unique(genes[~missing], return_inverse=True)
+    gene_codes = np.full(genes.shape[0], -1, dtype=np.int64)
+    gene_codes[~missing] = codes
+
+    counts = pair_counts(
+        coordinates, gene_codes, names.shape[0], radii, tile_size=tile_size, index=index,
+        workers=workers,
+    )
+    kept = coordinates[~missing, :2]
+    area = float(np.prod(np.ptp(kept, axis=0))) if kept.shape[0] else 0.0
+
+    gene_name = MATRIX_REQUIRED_FEATURES.GENE_NAME.value
+    return xr.DataArray(
+        counts,
+        dims=(gene_name, NEIGHBOR_GENE_NAME, RADIUS),
+        coords={
+            gene_name: names,
+            NEIGHBOR_GENE_NAME: names,
+            RADIUS: np.asarray(radii, dtype=float),
+            N_SPOTS: (gene_name, np.bincount(codes, minlength=names.shape[0])),
+        },
+        attrs={"area": area},
+        name=COLOCALIZATION_NAME,
+    )
+
+
+def cross_k(counts: xr.DataArray) -> xr.DataArray:
+    """Ripley's cross-K function of every pair of genes, without edge correction
+
+    K[a, b](r) is the area times the number of pairs within r, divided by the number of points
+    of a and of b. Under complete spatial randomness it is close to pi * r ** 2.
+    """
+    n_spots = counts[N_SPOTS].values.astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalization = counts.attrs["area"] / (n_spots[:, None] * n_spots[None, :])
+    return (counts * normalization[:, :, None]).rename("cross_k")
+
+
+def cross_l(counts: xr.DataArray) -> xr.DataArray:
+    """Besag's cross-L function, sqrt(K / pi), which is close to r under randomness"""
+    return np.sqrt(cross_k(counts) / np.pi).rename("cross_l")
@@ -0,0 +1,174 @@
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import xarray as xr
+
+from .classes import Matrix
+from .constants import MATRIX_AXES, MATRIX_DATASET, MATRIX_NAME, MATRIX_REQUIRED_FEATURES
+
+GENE_CASES = ("preserve", "lower", "upper")
+JOINS = ("outer", "inner")
+
+
+def normalize_genes(
+    genes: Sequence[str], case: str = "preserve", aliases: Optional[Mapping[str, str]] = None
+) -> np.ndarray:
+    """fold gene names to one case, then replace aliases with their canonical names
+
+    Alias keys and values are case-folded too, so aliases={"Gad67": "Gad1"} also applies to
+    lowercased gene names.
+    """
+    if case not in GENE_CASES:
+        raise ValueError(f"case must be one of {GENE_CASES}, not {case}")
+
+    def fold(name: str) -> str:
+        return name if case == "preserve" else getattr(name, case)()
+
+    folded = [fold(str(gene)) for gene in genes]
+    if aliases:
+        folded_aliases = {fold(alias): fold(name) for alias, name in aliases.items()}
+        folded = [folded_aliases.get(gene, gene) for gene in folded]
+    return np.array(folded, dtype="U")
+
+
+def feature_index(gene_lists: Sequence[np.ndarray], join: str = "outer") -> pd.Index:
+    """genes of the combined matrix, in order of first appearance
+
+    join="outer" keeps every gene measured in any dataset, "inner" only genes measured in all.
+    """
+    if join not in JOINS:
+        raise ValueError(f"join must be one of {JOINS}, not {join}")
+    index = pd.Index(pd.unique(np.concatenate(gene_lists)))
+    if join == "inner":
+        for genes in gene_lists:
+            index = index[index.isin(genes)]
+    return index
+
+
+def _reindex_block(
+    block, positions: np.ndarray, n_features: int, sparse: bool, fill_value, out_dtype: np.dtype
+):
+    """scatter the columns of one row block into the columns of the combined feature index"""
+    keep = positions >= 0
+    if sp.issparse(block) and sparse:
+        if not keep.all():
+            block = sp.csr_matrix(block)[:, keep]
+        block = sp.csr_matrix(block)
+        reindexed = sp.csr_matrix(
+            (block.data.astype(out_dtype), positions[keep][block.indices], block.indptr),
+            shape=(block.shape[0], n_features),
+        )
+        reindexed.sort_indices()
+        return reindexed
+
+    if sp.issparse(block):
+        block = block.toarray()
+    reindexed = np.full((block.shape[0], n_features), fill_value, dtype=out_dtype)
+    reindexed[:, positions[keep]] = block[:, keep]
+    return reindexed
+
+
+def _common_attrs(matrices: Sequence[Matrix]) -> Dict[str, Any]:
+    """attributes shared by all matrices; those that differ become a list with one per dataset"""
+    attrs = {}
+    keys = list(dict.fromkeys(key for matrix in matrices for key in matrix.attrs))
+    for key in keys:
+        values = [matrix.attrs.get(key) for matrix in matrices]
+        if all(value == values[0] for value in values[1:]):
+            attrs[key] = values[0]
+        else:
+            attrs[key] = values
+    return attrs
+
+
+def concat_matrices(
+    matrices: Sequence[Matrix],
+    names: Optional[Sequence[str]] = None,
+    case: str = "preserve",
+    aliases: Optional[Mapping[str, str]] = None,
+    join: str = "outer",
+    fill_value=0,
+) -> Matrix:
+    """stack the regions of several matrices into one lazy matrix over a shared feature index
+
+    Gene names are normalized with normalize_genes and merged into a single feature index with
+    feature_index. Each input is reindexed one row block at a time by scattering its columns to
+    precomputed positions in that index, so nothing is computed until the result is. Genes a
+    dataset did not measure are filled with fill_value, which has to be 0 when all inputs are
+    sparse; the result is then sparse too.
+
+    Regions coordinates present in every input are kept, and a dataset coordinate records which
+    of names (by default the position of each input) every region came from. Attributes that
+    differ between inputs are kept as a list with one value per dataset.
+    """
+    if not matrices:
+        raise ValueError("at least one matrix is required")
+    if names is None:
+        names = [str(i) for i in range(len(matrices))]
+    if len(names) != len(matrices):
+        raise ValueError("names must have one entry per matrix")
+
+    gene_name = MATRIX_REQUIRED_FEATURES.GENE_NAME.value
+    gene_lists = []
+    for name, matrix in zip(names, matrices):
+        genes = normalize_genes(matrix[gene_name].values, case=case, aliases=aliases)
+        duplicated = pd.unique(genes[pd.Index(genes).duplicated()])
+        if len(duplicated):
+            raise ValueError(
+                f"gene names of dataset {name} collide after normalization: {list(duplicated)}"
+            )
+        gene_lists.append(genes)
+    index = feature_index(gene_lists, join=join)
+    n_features = len(index)
+
+    sparse = all(matrix.is_sparse for matrix in matrices)
+    if sparse and fill_value != 0:
+        raise ValueError("sparse matrices can only be combined with fill_value=0")
+    dtype = np.result_type(*(matrix.dtype for matrix in matrices))
+    if not sparse:
+        dtype = np.result_type(dtype, np.min_scalar_type(fill_value))
+    meta = sp.csr_matrix((0, 0), dtype=dtype) if sparse else np.empty((0, 0), dtype=dtype)
+
+    blocks = []
+    for genes, matrix in zip(gene_lists, matrices):
+        positions = index.get_indexer(genes)
+        # every block has to hold all features of its regions to be scattered in one step
+        data = da.asarray(matrix.data).rechunk({1: -1})
+        blocks.append(data.map_blocks(
+            _reindex_block,
+            positions=positions,
+            n_features=n_features,
+            sparse=sparse,
+            fill_value=fill_value,
+            out_dtype=dtype,
+            chunks=(data.chunks[0], (n_features,)),
+            dtype=dtype,
+            meta=meta,
+        ))
+    data = da.concatenate(blocks, axis=0)
+
+    regions, features = MATRIX_AXES.REGIONS.value, MATRIX_AXES.FEATURES.value
+    shared = set.intersection(*(
+        {name for name, coord in matrix.coords.items() if coord.dims == (regions,)}
+        for matrix in matrices
+    ))
+    coords = {
+        name: xr.Variable.concat([matrix[name].variable for matrix in matrices], dim=regions)
+        for name in matrices[0].coords if name in shared
+    }
+    coords[MATRIX_DATASET] = (
+        regions,
+        np.repeat(np.array(names, dtype="U"), [matrix.sizes[regions] for matrix in matrices]),
+    )
+    coords[gene_name] = (features, index.values.astype("U"))
+
+    return Matrix(
+        data=data,
+        dims=(regions, features),
+        coords=coords,
+        attrs=_common_attrs(matrices),
+        name=matrices[0].name or MATRIX_NAME,
+    )
@@ -67,16 +67,29 @@ class SPOTS_REQUIRED_VARIABLES(str, Enum):
 
 class SPOTS_OPTIONAL_VARIABLES(str, Enum):
     Z_SPOT = _spots_columns[3]["name"]
-    REGION_ID = _spots_columns[4]["name"]
-    Z_REGION = _spots_columns[5]["name"]
-    Y_REGION = _spots_columns[6]["name"]
-    X_REGION = _spots_columns[7]["name"]
-    QUALITY = _spots_columns[8]["name"]
-    RADIUS = _spots_columns[9]["name"]
-    FIELD_OF_VIEW = _spots_columns[10]["name"]
+    REGION_ID = _spots_columns[7]["name"]
+    Z_REGION = _spots_columns[10]["name"]
+    Y_REGION = _spots_columns[8]["name"]
+    X_REGION = _spots_columns[9]["name"]
+    QUALITY = _spots_columns[14]["name"]
+    RADIUS = _spots_columns[15]["name"]
+    FIELD_OF_VIEW = _spots_columns[16]["name"]
     ROUND = _ROUND
 
 
+# stored name -> current name of the variables that releases whose enums indexed the schema at
+# stale positions saved under the name of another column, see Spots.load_zarr(legacy_names=True)
+LEGACY_SPOTS_VARIABLES = {
+    _spots_columns[4]["name"]: SPOTS_OPTIONAL_VARIABLES.REGION_ID.value,
+    _spots_columns[5]["name"]: SPOTS_OPTIONAL_VARIABLES.Z_REGION.value,
+    _spots_columns[6]["name"]: SPOTS_OPTIONAL_VARIABLES.Y_REGION.value,
+    _spots_columns[7]["name"]: SPOTS_OPTIONAL_VARIABLES.X_REGION.value,
+    _spots_columns[8]["name"]: SPOTS_OPTIONAL_VARIABLES.QUALITY.value,
+    _spots_columns[9]["name"]: SPOTS_OPTIONAL_VARIABLES.RADIUS.value,
+    _spots_columns[10]["name"]: SPOTS_OPTIONAL_VARIABLES.FIELD_OF_VIEW.value,
+}
+
+
 ###################################################################################################
 # Matrix
 
@@ -96,18 +109,33 @@ MATRIX_NAME = "matrix"
 
 class MATRIX_REQUIRED_REGIONS(str, Enum):
     REGION_ID = _matrix_regions[0]["name"]
-    X_REGION = _matrix_regions[1]["name"]
-    Y_REGION = _matrix_regions[2]["name"]
+    X_REGION = _matrix_regions[2]["name"]
+    Y_REGION = _matrix_regions[1]["name"]
 
 
 class MATRIX_OPTIONAL_REGIONS(str, Enum):
     Z_REGION = _matrix_regions[3]["name"]
-    PHYS_ANNOTATION = _matrix_regions[4]["name"]
-    TYPE_ANNOTATION = _matrix_regions[5]["name"]
-    GROUP_ID = _matrix_regions[6]["name"]
-    FIELD_OF_VIEW = _matrix_regions[7]["name"]
-    AREA_PIXELS = _matrix_regions[8]["name"]
-    AREA_UM2 = _matrix_regions[9]["name"]
+    PHYS_ANNOTATION = _matrix_regions[7]["name"]
+    TYPE_ANNOTATION = _matrix_regions[8]["name"]
+    GROUP_ID = _matrix_regions[9]["name"]
+    FIELD_OF_VIEW = _matrix_regions[10]["name"]
+    AREA_PIXELS = _matrix_regions[11]["name"]
+    AREA_UM2 = _matrix_regions[12]["name"]
+
+
+# stored name -> current name of the region coordinates that releases whose enums indexed the
+# schema at stale positions saved under the name of another one, see
+# Matrix.load_zarr(legacy_names=True)
+LEGACY_MATRIX_REGIONS = {
+    _matrix_regions[1]["name"]: MATRIX_REQUIRED_REGIONS.X_REGION.value,
+    _matrix_regions[2]["name"]: MATRIX_REQUIRED_REGIONS.Y_REGION.value,
+    _matrix_regions[4]["name"]: MATRIX_OPTIONAL_REGIONS.PHYS_ANNOTATION.value,
+    _matrix_regions[5]["name"]: MATRIX_OPTIONAL_REGIONS.TYPE_ANNOTATION.value,
+    _matrix_regions[6]["name"]: MATRIX_OPTIONAL_REGIONS.GROUP_ID.value,
+    _matrix_regions[7]["name"]: MATRIX_OPTIONAL_REGIONS.FIELD_OF_VIEW.value,
+    _matrix_regions[8]["name"]: MATRIX_OPTIONAL_REGIONS.AREA_PIXELS.value,
+    _matrix_regions[9]["name"]: MATRIX_OPTIONAL_REGIONS.AREA_UM2.value,
+}
 
 
 class MATRIX_AXES(str, Enum):
@@ -123,6 +151,28 @@ class MATRIX_OPTIONAL_FEATURES(str, Enum):
     ROUND = _ROUND
     CHANNEL = _CHANNEL
 
+class MATRIX_SPARSE_VARIABLES(str, Enum):
+    DATA = f"{MATRIX_NAME}_data"
+    INDICES = f"{MATRIX_NAME}_indices"
+    INDPTR = f"{MATRIX_NAME}_indptr"
+
+
+class MATRIX_SPARSE_AXES(str, Enum):
+    NNZ = "nnz"
+    INDPTR = "indptr"
+
+
+MATRIX_SPARSE_FORMAT = "csr"
+
+# regions coordinate naming the source dataset of each region in a combined matrix
+MATRIX_DATASET = "dataset"
+
+# bitmap indexes saved in a matrix store are the variables {coordinate}_bitmap, with one
+# packed bitmap per category along {coordinate}_bitmap_categories
+MATRIX_BITMAP_FORMAT = "bitmap"
+MATRIX_BITMAP_BYTES = "bitmap_bytes"
+
+
 class SCANPY_CONSTANTS:
     SPATIAL_LAYOUT = "X_spatial"
 
@@ -134,7 +184,51 @@ with open(directory / "schema/regions/regions_axes.json", "rb") as f:
 
 REGIONS_NAME = "regions"
 
+REGIONS_PYRAMID_LEVEL = "pyramid_level"
+
+REGIONS_RLE_FORMAT = "rle"
+
+
+class REGIONS_RLE_VARIABLES(str, Enum):
+    STARTS = "run_starts"
+    LENGTHS = "run_lengths"
+    LABELS = "run_labels"
+    ROW_OFFSETS = "row_offsets"
+
+
+class REGIONS_RLE_AXES(str, Enum):
+    RUNS = "runs"
+    ROWS = "rows"
+
 
 class REGIONS_AXES(str, Enum):
     Y_REGION = _regions_axes[0]["name"]
     X_REGION = _regions_axes[1]["name"]
+
+###################################################################################################
+# Spatial index
+
+SPATIAL_INDEX_NAME = "index"
+
+
+class SPATIAL_INDEX_VARIABLES(str, Enum):
+    ORDER = "order"
+    OFFSETS = "offsets"
+    COORDINATES = "coordinates"
+
+
+class SPATIAL_INDEX_AXES(str, Enum):
+    POINTS = "points"
+    OFFSETS = "tiles"
+    DIMENSIONS = "dimensions"
+
+
+# neighbor graphs of matrix regions are saved as CSR arrays to
+# {url}.matrix.graph.{parameters}.zarr, with the MATRIX_SPARSE_AXES dimensions
+NEIGHBOR_GRAPH_NAME = "graph"
+
+
+class NEIGHBOR_GRAPH_VARIABLES(str, Enum):
+    DATA = f"{NEIGHBOR_GRAPH_NAME}_data"
+    INDICES = f"{NEIGHBOR_GRAPH_NAME}_indices"
+    INDPTR = f"{NEIGHBOR_GRAPH_NAME}_indptr"
@@ -1,23 +1,82 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Sequence
+
 from .classes import Matrix, Spots, Regions
+from .constants import MATRIX_NAME, SPOTS_NAME, REGIONS_NAME
+
+_LOADERS = {
+    MATRIX_NAME: Matrix.load_zarr,
+    SPOTS_NAME: Spots.load_zarr,
+    REGIONS_NAME: Regions.load_zarr,
+}
+
+
+class Experiment:
+    """the matrix, spots and regions of one dataset, opened concurrently
+
+    Each member is opened in the background as soon as the experiment is created; accessing it
+    waits only for that member to open. Members are lazily loaded, so opening reads metadata
+    alone. Members that weren't requested are None.
+    """
+
+    def __init__(self, futures: Dict[str, Future]):
+        self._futures = futures
+
+    def _result(self, name: str):
+        future = self._futures.get(name)
+        return None if future is None else future.result()
+
+    @property
+    def matrix(self) -> Optional[Matrix]:
+        return self._result(MATRIX_NAME)
+
+    @property
+    def spots(self) -> Optional[Spots]:
+        return self._result(SPOTS_NAME)
+
+    @property
+    def regions(self) -> Optional[Regions]:
+        return self._result(REGIONS_NAME)
+
+
+def open_experiment(
+    url: str, members: Sequence[str] = (MATRIX_NAME, SPOTS_NAME, REGIONS_NAME)
+) -> Experiment:
+    """open the {url}.matrix.zarr, {url}.spots.zarr and {url}.regions.zarr stores concurrently
+
+    url is the same prefix the stores were saved with. All members share the process-wide S3
+    filesystem, so credentials and connections are set up once.
+    """
+    url = str(url).rstrip("/")
+    executor = ThreadPoolExecutor(max_workers=len(members))
+    try:
+        futures = {
+            name: executor.submit(_LOADERS[name], f"{url}.{name}.zarr") for name in members
+        }
+    finally:
+        # lets the submitted opens finish, then frees the threads
+        executor.shutdown(wait=False)
+    return Experiment(futures)
 
 
 # TODO add more data to s3, add to this module.
 class osmFISH:
 
+    url = ("s3://starspace.data/formatted/osmfish_codeluppi_2018_nat-methods_somatosensory-cortex/"
+           "osmfish-codeluppi-2018-nat-methods-somatosensory-cortex")
+
+    @staticmethod
+    def experiment() -> Experiment:
+        return open_experiment(osmFISH.url)
+
     @staticmethod
     def matrix():
-        url = ("s3://starspace.data/formatted/osmfish_codeluppi_2018_nat-methods_somatosensory-cortex/" 
-               "osmfish-codeluppi-2018-nat-methods-somatosensory-cortex.matrix.zarr/")
-        return Matrix.load_zarr(url)
+        return Matrix.load_zarr(f"{osmFISH.url}.{MATRIX_NAME}.zarr/")
 
     @staticmethod
     def spots():
-        url = ("s3://starspace.data/formatted/osmfish_codeluppi_2018_nat-methods_somatosensory-cortex/"
-               "osmfish-codeluppi-2018-nat-methods-somatosensory-cortex.spots.zarr/")
-        return Spots.load_zarr(url)
+        return Spots.load_zarr(f"{osmFISH.url}.{SPOTS_NAME}.zarr/")
 
     @staticmethod
     def regions():
-        url = ("s3://starspace.data/formatted/osmfish_codeluppi_2018_nat-methods_somatosensory-cortex/"
-               "osmfish-codeluppi-2018-nat-methods-somatosensory-cortex.regions.zarr/")
-        return Regions.load_zarr(url)
+        return Regions.load_zarr(f"{osmFISH.url}.{REGIONS_NAME}.zarr/")
@@ -0,0 +1,175 @@
+import time
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import zarr
+from numcodecs import Blosc, Delta
+from numcodecs.abc import Codec
+
+_SHUFFLES = {
+    "noshuffle": Blosc.NOSHUFFLE,
+    "shuffle": Blosc.SHUFFLE,
+    "bitshuffle": Blosc.BITSHUFFLE,
+}
+
+
+def blosc(cname: str = "zstd", clevel: int = 5, shuffle: str = "shuffle") -> Blosc:
+    """a Blosc compressor, e.g. blosc("lz4", shuffle="bitshuffle")"""
+    if shuffle not in _SHUFFLES:
+        raise ValueError(f"shuffle must be one of {list(_SHUFFLES)}")
+    return Blosc(cname=cname, clevel=clevel, shuffle=_SHUFFLES[shuffle])
+
+
+# compressors by numpy dtype kind. small integers such as label images compress best
+# bit-shuffled, floats byte-shuffled, and strings have no fixed element size to shuffle on
+DEFAULT_COMPRESSORS = {
+    "f": blosc("zstd", shuffle="shuffle"),
+    "i": blosc("zstd", shuffle="bitshuffle"),
+    "u": blosc("zstd", shuffle="bitshuffle"),
+    "b": blosc("zstd", shuffle="bitshuffle"),
+    "U": blosc("zstd", shuffle="noshuffle"),
+    "O": blosc("zstd", shuffle="noshuffle"),
+}
+
+
+class CodecPolicy:
+    """how each variable of a dataset is compressed, filtered and chunked when saved to zarr
+
+    Parameters
+    ----------
+    compressors : Mapping[str, Codec]
+        compressors by numpy dtype kind ("f", "i", "u", "b", "U", "O"), falling back to
+        DEFAULT_COMPRESSORS for kinds that are not given
+    variables : Mapping[str, Codec]
+        compressors for individual variables, overriding the dtype defaults
+    delta : Sequence[str]
+        variables to delta-encode before compression, which shrinks sorted coordinates to small
+        steps. Sorted integer dimension coordinates are always delta-encoded.
+    chunks : Mapping[str, Tuple[int, ...]]
+        zarr chunk shapes of individual variables. Otherwise variables keep the chunking of
+        their dask arrays.
+    """
+
+    def __init__(
+        self,
+        compressors: Optional[Mapping[str, Codec]] = None,
+        variables: Optional[Mapping[str, Codec]] = None,
+        delta: Sequence[str] = (),
+        chunks: Optional[Mapping[str, Tuple[int, ...]]] = None,
+    ):
+        self.compressors = dict(DEFAULT_COMPRESSORS, **(compressors or {}))
+        self.variables = dict(variables or {})
+        self.delta = set(delta)
+        self.chunks = dict(chunks or {})
+
+    def _uses_delta(self, dataset: xr.Dataset, name: str) -> bool:
+        if name in self.delta:
+            return True
+        # checking monotonicity of a dimension coordinate is free, its pandas index caches it
+        variable = dataset[name]
+        return (
+            name in dataset.indexes
+            and variable.dtype.kind in "iu"
+            and dataset.indexes[name].is_monotonic_increasing
+        )
+
+    def apply(self, dataset: xr.Dataset) -> Tuple[xr.Dataset, Dict[str, Dict]]:
+        """rechunk dataset to the requested chunk shapes and build its zarr encoding"""
+        dataset = dataset.copy()
+        encoding = {}
+        for name, variable in list(dataset.variables.items()):
+            variable_encoding = {
+                "compressor": self.variables.get(
+                    name, self.compressors.get(variable.dtype.kind, self.compressors["f"])
+                )
+            }
+            if self._uses_delta(dataset, name):
+                variable_encoding["filters"] = [Delta(dtype=variable.dtype)]
+            if name in self.chunks:
+                chunks = tuple(self.chunks[name])
+                variable_encoding["chunks"] = chunks
+                # dask chunks have to line up with zarr chunks for parallel writes
+                if name in dataset.data_vars:
+                    dataset[name] = dataset[name].chunk(dict(zip(variable.dims, chunks)))
+                elif name not in dataset.indexes:
+                    chunked = dataset[name].variable.chunk(dict(zip(variable.dims, chunks)))
+                    dataset = dataset.assign_coords({name: chunked})
+            encoding[name] = variable_encoding
+        return dataset, encoding
+
+
+CODEC_POLICIES = {
+    "zstd": CodecPolicy(),
+    "lz4": CodecPolicy(compressors={
+        kind: Blosc(cname="lz4", clevel=5, shuffle=codec.shuffle)
+        for kind, codec in DEFAULT_COMPRESSORS.items()
+    }),
+    "zstd-max": CodecPolicy(compressors={
+        kind: Blosc(cname="zstd", clevel=9, shuffle=codec.shuffle)
+        for kind, codec in DEFAULT_COMPRESSORS.items()
+    }),
+}
+
+
+def get_policy(codecs: Union[str, CodecPolicy, None]) -> Optional[CodecPolicy]:
+    """resolve a codec policy given by name"""
+    if codecs is None or isinstance(codecs, CodecPolicy):
+        return codecs
+    if codecs not in CODEC_POLICIES:
+        raise ValueError(f"unknown codec policy {codecs}, must be one of {list(CODEC_POLICIES)}")
+    return CODEC_POLICIES[codecs]
+
+
+def _stored_bytes(store: Mapping) -> int:
+    """bytes of chunk data in a zarr store, excluding json metadata"""
+    metadata = (".zattrs", ".zarray", ".zgroup", ".zmetadata")
+    return sum(len(value) for key, value in store.items() if not key.endswith(metadata))
+
+
+def benchmark_policies(
+    data: Union[xr.Dataset, xr.DataArray],
+    policies: Optional[Mapping[str, Union[str, CodecPolicy]]] = None,
+    sample_size: int = 1_000_000,
+) -> pd.DataFrame:
+    """compare codec policies by writing a sample of data to an in-memory zarr store
+
+    The sample is the leading slice of each dimension, scaled so that the sample holds about
+    sample_size elements. Returns one row per policy with the uncompressed and stored size, the
+    compression ratio, and the write and read time of the sample in seconds.
+    """
+    if isinstance(data, xr.DataArray):
+        data = data.to_dataset(name=data.name or "data")
+    if policies is None:
+        policies = {name: name for name in CODEC_POLICIES}
+
+    n_elements = max(int(np.prod(list(data.sizes.values()))), 1)
+    fraction = min(1.0, sample_size / n_elements) ** (1 / max(len(data.sizes), 1))
+    sample = data.isel({
+        dim: slice(0, max(1, int(np.ceil(size * fraction)))) for dim, size in data.sizes.items()
+    }).load()
+    nbytes = sample.nbytes
+
+    results = []
+    for name, policy in policies.items():
+        store = zarr.MemoryStore()
+        start = time.perf_counter()
+        policy_dataset, encoding = get_policy(policy).apply(sample)
+        policy_dataset.to_zarr(store=store, encoding=encoding)
+        write_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        xr.open_zarr(store=store, chunks=None).load()
+        read_seconds = time.perf_counter() - start
+
+        stored_bytes = _stored_bytes(store)
+        results.append({
+            "policy": name,
+            "nbytes": nbytes,
+            "stored_bytes": stored_bytes,
+            "ratio": nbytes / max(stored_bytes, 1),
+            "write_seconds": write_seconds,
+            "read_seconds": read_seconds,
+        })
+    return pd.DataFrame(results).set_index("policy")
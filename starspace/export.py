@@ -0,0 +1,89 @@
+from typing import Any, Dict, Iterator, Tuple
+
+import dask
+import dask.array as da
+import h5py
+import loompy
+import numpy as np
+import scipy.sparse as sp
+
+# anndata's on-disk encodings of dense and CSR matrices
+_H5AD_DENSE_ENCODING = {"encoding-type": "array", "encoding-version": "0.2.0"}
+_H5AD_CSR_ENCODING = {"encoding-type": "csr_matrix", "encoding-version": "0.1.0"}
+
+
+def iter_row_blocks(
+    data: da.Array, parallel_blocks: int = 1
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """compute the row blocks of a 2d dask array in order, yielding (start, stop, block)
+
+    parallel_blocks blocks are computed at once; only those are held in memory. Blocks of
+    sparse arrays are scipy.sparse matrices.
+    """
+    bounds = np.concatenate([[0], np.cumsum(data.chunks[0])]).astype(int)
+    spans = list(zip(bounds[:-1], bounds[1:]))
+    for batch in range(0, len(spans), max(parallel_blocks, 1)):
+        batch_spans = spans[batch:batch + max(parallel_blocks, 1)]
+        blocks = dask.compute(*(data[start:stop] for start, stop in batch_spans))
+        for (start, stop), block in zip(batch_spans, blocks):
+            yield start, stop, block
+
+
+def write_h5ad_x(
+    h5file: h5py.File, data: da.Array, sparse: bool, parallel_blocks: int = 1, name: str = "X"
+) -> None:
+    """write a dask array to an open .h5ad file one row block at a time, as dense or CSR"""
+    n_rows, n_cols = data.shape
+    if not sparse:
+        dataset = h5file.create_dataset(
+            name, shape=(n_rows, n_cols), dtype=data.dtype,
+            chunks=(max(1, min(data.chunks[0][0], n_rows)), max(1, n_cols)) if n_rows else None,
+        )
+        dataset.attrs.update(_H5AD_DENSE_ENCODING)
+        for start, stop, block in iter_row_blocks(data, parallel_blocks):
+            dataset[start:stop] = block.toarray() if sp.issparse(block) else block
+        return
+
+    group = h5file.create_group(name)
+    group.attrs.update(_H5AD_CSR_ENCODING)
+    group.attrs["shape"] = (n_rows, n_cols)
+    values = group.create_dataset("data", shape=(0,), maxshape=(None,), dtype=data.dtype)
+    indices = group.create_dataset("indices", shape=(0,), maxshape=(None,), dtype=np.int64)
+    indptr = group.create_dataset("indptr", shape=(n_rows + 1,), dtype=np.int64)
+    indptr[0] = 0
+    nnz = 0
+    for start, stop, block in iter_row_blocks(data, parallel_blocks):
+        block = sp.csr_matrix(block)
+        values.resize((nnz + block.nnz,))
+        values[nnz:] = block.data
+        indices.resize((nnz + block.nnz,))
+        indices[nnz:] = block.indices
+        indptr[start + 1:stop + 1] = block.indptr[1:] + nnz
+        nnz += block.nnz
+
+
+def write_loom(
+    filename: str,
+    data: da.Array,
+    row_attrs: Dict[str, np.ndarray],
+    col_attrs: Dict[str, np.ndarray],
+    file_attrs: Dict[str, Any],
+    parallel_blocks: int = 1,
+) -> None:
+    """write the transpose of a 2d dask array as the main matrix of a new loom file
+
+    The file is created with its attributes and an empty matrix, then the row blocks of data are
+    written as column batches, so only parallel_blocks blocks are in memory at once. Sparse
+    blocks are densified one at a time, as loom stores the main matrix dense.
+    """
+    with loompy.new(str(filename), file_attrs=file_attrs) as connection:
+        connection.shape = data.shape[::-1]
+        # a dtype instead of values creates an empty, chunked and compressed matrix
+        connection.layers[""] = str(data.dtype)
+        for name, values in row_attrs.items():
+            connection.ra[name] = values
+        for name, values in col_attrs.items():
+            connection.ca[name] = values
+        for start, stop, block in iter_row_blocks(data, parallel_blocks):
+            block = block.toarray() if sp.issparse(block) else np.asarray(block)
+            connection[:, start:stop] = block.T
@@ -0,0 +1,177 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import xarray as xr
+from scipy.spatial import Delaunay, QhullError, cKDTree
+
+from .constants import MATRIX_SPARSE_AXES, NEIGHBOR_GRAPH_VARIABLES
+
+GRAPH_METHODS = ("knn", "radius", "delaunay")
+
+_Edges = Tuple[np.ndarray, np.ndarray]
+
+
+def _knn_edges(coordinates: np.ndarray, k: int, workers: int) -> _Edges:
+    n_points = coordinates.shape[0]
+    k = min(k, n_points - 1)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    _, neighbors = cKDTree(coordinates).query(coordinates, k=k + 1, workers=workers)
+    neighbors = neighbors.reshape(n_points, k + 1)
+    # each point is usually its own nearest neighbor, but not always when points coincide
+    keep = neighbors != np.arange(n_points)[:, None]
+    keep &= np.cumsum(keep, axis=1) <= k
+    rows = np.broadcast_to(np.arange(n_points)[:, None], neighbors.shape)
+    return rows[keep], neighbors[keep]
+
+
+def _radius_edges(coordinates: np.ndarray, radius: float, workers: int) -> _Edges:
+    neighbors = cKDTree(coordinates).query_ball_point(
+        coordinates, r=radius, workers=workers, return_sorted=True
+    )
+    counts = np.fromiter((len(n) for n in neighbors), dtype=np.int64, count=len(neighbors))
+    rows = np.repeat(np.arange(len(neighbors)), counts)
+    cols = np.concatenate(neighbors).astype(np.int64) if counts.sum() else rows
+    keep = rows != cols
+    return rows[keep], cols[keep]
+
+
+def _delaunay_edges(coordinates: np.ndarray) -> _Edges:
+    try:
+        simplices = Delaunay(coordinates).simplices
+    except (QhullError, ValueError):  # too few points, or all of them on a line
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    n_vertices = simplices.shape[1]
+    pairs = [(a, b) for a in range(n_vertices) for b in range(n_vertices) if a != b]
+    rows = np.concatenate([simplices[:, a] for a, _ in pairs])
+    cols = np.concatenate([simplices[:, b] for _, b in pairs])
+    edges = np.unique(np.stack([rows, cols], axis=1), axis=0)
+    return edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+
+
+def _edges(
+    coordinates: np.ndarray, method: str, k: int, radius: Optional[float], workers: int
+) -> _Edges:
+    if method == "knn":
+        return _knn_edges(coordinates, k, workers)
+    if method == "radius":
+        return _radius_edges(coordinates, radius, workers)
+    return _delaunay_edges(coordinates)
+
+
+def _batches(groups: Optional[np.ndarray], n_points: int) -> List[np.ndarray]:
+    if groups is None:
+        return [np.arange(n_points)]
+    codes, _ = pd.factorize(np.asarray(groups))
+    order = np.argsort(codes, kind="stable")
+    bounds = np.cumsum(np.bincount(codes[codes >= 0]))
+    # points without a group are left unconnected
+    return np.split(order[codes[order] >= 0], bounds[:-1])
+
+
+def neighbor_graph(
+    coordinates: np.ndarray,
+    method: str = "knn",
+    k: int = 6,
+    radius: Optional[float] = None,
+    groups: Optional[np.ndarray] = None,
+    workers: int = -1,
+) -> sp.csr_matrix:
+    """sparse graph connecting each of an (n, d) array of points to its neighbors
+
+    method is "knn", connecting each point to its k nearest neighbors, "radius", connecting
+    points at most radius apart, or "delaunay", connecting the vertices of a Delaunay
+    triangulation, optionally only those at most radius apart. Entries are the distances
+    between neighbors. kNN graphs are directed; row i holds the neighbors of point i.
+
+    If groups is given, only points of the same group are connected, e.g. points of the same
+    field of view when their coordinates are local to it. Groups are built in parallel. Tree
+    queries use workers threads, -1 for one per core.
+    """
+    if method not in GRAPH_METHODS:
+        raise ValueError(f"method must be one of {GRAPH_METHODS}, not {method}")
+    if method == "radius" and radius is None:
+        raise ValueError("radius graphs need a radius")
+
+    coordinates = np.asarray(coordinates, dtype=float)
+    n_points = coordinates.shape[0]
+    batches = _batches(groups, n_points)
+
+    def build(batch: np.ndarray) -> _Edges:
+        # parallelism comes from the batches when there are several
+        batch_workers = workers if len(batches) == 1 else 1
+        rows, cols = _edges(coordinates[batch], method, k, radius, batch_workers)
+        return batch[rows], batch[cols]
+
+    n_threads = os.cpu_count() if workers == -1 else max(workers, 1)
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(batches)) or 1) as executor:
+        edges = list(executor.map(build, batches))
+
+    rows = np.concatenate([r for r, _ in edges]) if edges else np.empty(0, dtype=np.int64)
+    cols = np.concatenate([c for _, c in edges]) if edges else np.empty(0, dtype=np.int64)
+    distances = np.sqrt(np.sum((coordinates[rows] - coordinates[cols]) ** 2, axis=1))
+    if method == "delaunay" and radius is not None:
+        keep = distances <= radius
+        rows, cols, distances = rows[keep], cols[keep], distances[keep]
+
+    graph = sp.csr_matrix((distances, (rows, cols)), shape=(n_points, n_points))
+    graph.sort_indices()
+    return graph
+
+
+def graph_key(
+    method: str, k: int, radius: Optional[float], by: Optional[str], use_z: bool
+) -> str:
+    """name of a neighbor graph that identifies the parameters it was built with"""
+    key = method
+    if method == "knn":
+        key += f"-k{k}"
+    elif radius is not None:
+        key += f"-r{radius:g}"
+    if by is not None:
+        key += f"-by-{by}"
+    if use_z:
+        key += "-z"
+    return key
+
+
+def graph_to_dataset(
+    graph: sp.csr_matrix, key: str, fingerprint: Optional[str] = None
+) -> xr.Dataset:
+    """lay a graph out as CSR arrays that can be saved next to the matrix it connects
+
+    fingerprint identifies the coordinates the graph was built from, so that a graph of
+    coordinates that have changed since can be told apart when it is loaded.
+    """
+    attrs = {"key": key, "shape": list(graph.shape)}
+    if fingerprint is not None:
+        attrs["fingerprint"] = fingerprint
+    return xr.Dataset(
+        data_vars={
+            NEIGHBOR_GRAPH_VARIABLES.DATA.value: (MATRIX_SPARSE_AXES.NNZ.value, graph.data),
+            NEIGHBOR_GRAPH_VARIABLES.INDICES.value: (
+                MATRIX_SPARSE_AXES.NNZ.value, graph.indices
+            ),
+            NEIGHBOR_GRAPH_VARIABLES.INDPTR.value: (
+                MATRIX_SPARSE_AXES.INDPTR.value, graph.indptr
+            ),
+        },
+        attrs=attrs,
+    )
+
+
+def graph_from_dataset(dataset: xr.Dataset) -> sp.csr_matrix:
+    return sp.csr_matrix(
+        (
+            np.asarray(dataset[NEIGHBOR_GRAPH_VARIABLES.DATA.value]),
+            np.asarray(dataset[NEIGHBOR_GRAPH_VARIABLES.INDICES.value]),
+            np.asarray(dataset[NEIGHBOR_GRAPH_VARIABLES.INDPTR.value]),
+        ),
+        shape=tuple(dataset.attrs["shape"]),
+    )
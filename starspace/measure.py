@@ -0,0 +1,144 @@
+from typing import Optional, Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import numpy_groupies as npg
+import pandas as pd
+
+# label value of pixels that do not belong to any region
+BACKGROUND = 0
+
+
+def _chunk_bounds(chunks: Tuple[int, ...]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(chunks)])
+
+
+def _gather(block: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    return block[rows, cols]
+
+
+def sample_labels(label_image, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """look up the label at each (row, col) pixel of a 2-d label image
+
+    Pixels are grouped by the chunk of the label image they fall in and gathered with one task
+    per chunk, so only chunks that contain at least one pixel are read. Pixels outside the image
+    are given the background label.
+    """
+    label_image = da.asarray(label_image)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    labels = np.full(rows.shape[0], BACKGROUND, dtype=label_image.dtype)
+    inside = np.flatnonzero(
+        (rows >= 0) & (rows < label_image.shape[0]) & (cols >= 0) & (cols < label_image.shape[1])
+    )
+    if not inside.shape[0]:
+        return labels
+
+    row_bounds = _chunk_bounds(label_image.chunks[0])
+    col_bounds = _chunk_bounds(label_image.chunks[1])
+    block_rows = np.searchsorted(row_bounds, rows[inside], side="right") - 1
+    block_cols = np.searchsorted(col_bounds, cols[inside], side="right") - 1
+    block_ids = block_rows * len(label_image.chunks[1]) + block_cols
+
+    order = np.argsort(block_ids, kind="stable")
+    block_ids, split_at = np.unique(block_ids[order], return_index=True)
+    groups = np.split(inside[order], split_at[1:])
+
+    blocks = label_image.to_delayed()
+    tasks = []
+    for block_id, positions in zip(block_ids, groups):
+        block_row, block_col = divmod(block_id, len(label_image.chunks[1]))
+        tasks.append(dask.delayed(_gather)(
+            blocks[block_row, block_col],
+            rows[positions] - row_bounds[block_row],
+            cols[positions] - col_bounds[block_col],
+        ))
+
+    for positions, values in zip(groups, dask.compute(*tasks)):
+        labels[positions] = values
+    return labels
+
+
+# how per-chunk partial aggregates are merged across chunks
+_MERGE = {
+    "area": "sum",
+    "row_sum": "sum",
+    "col_sum": "sum",
+    "min_row": "min",
+    "min_col": "min",
+    "max_row": "max",
+    "max_col": "max",
+    "intensity_sum": "sum",
+}
+
+
+def _block_properties(
+    block: np.ndarray, row_offset: int, col_offset: int, intensity: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    labels, inverse = np.unique(block.ravel(), return_inverse=True)
+    rows, cols = np.indices(block.shape)
+    rows = rows.ravel() + row_offset
+    cols = cols.ravel() + col_offset
+
+    partials = {
+        "area": np.bincount(inverse),
+        "row_sum": np.bincount(inverse, weights=rows),
+        "col_sum": np.bincount(inverse, weights=cols),
+        "min_row": npg.aggregate(inverse, rows, func="min"),
+        "min_col": npg.aggregate(inverse, cols, func="min"),
+        "max_row": npg.aggregate(inverse, rows, func="max") + 1,
+        "max_col": npg.aggregate(inverse, cols, func="max") + 1,
+    }
+    if intensity is not None:
+        partials["intensity_sum"] = np.bincount(inverse, weights=intensity.ravel())
+
+    return pd.DataFrame(partials, index=labels).drop(BACKGROUND, errors="ignore")
+
+
+def region_properties(label_image, intensity_image=None) -> pd.DataFrame:
+    """per-label properties of a 2-d label image, indexed by label
+
+    Columns are the pixel area, the centroid (row, col), the bounding box (min_row, min_col,
+    max_row, max_col) with exclusive maxima, and mean_intensity if an intensity image of the
+    same shape is given. Each chunk is reduced to per-label partial aggregates in parallel,
+    which are then merged across chunks, so labels that span chunk borders are measured
+    correctly and the image is never held in memory.
+    """
+    label_image = da.asarray(label_image)
+    row_bounds = _chunk_bounds(label_image.chunks[0])
+    col_bounds = _chunk_bounds(label_image.chunks[1])
+
+    blocks = label_image.to_delayed()
+    if intensity_image is not None:
+        intensity_blocks = da.asarray(intensity_image).rechunk(label_image.chunks).to_delayed()
+
+    tasks = []
+    for i in range(blocks.shape[0]):
+        for j in range(blocks.shape[1]):
+            intensity = intensity_blocks[i, j] if intensity_image is not None else None
+            tasks.append(dask.delayed(_block_properties)(
+                blocks[i, j], row_bounds[i], col_bounds[j], intensity
+            ))
+    partials = pd.concat(dask.compute(*tasks))
+    merged = partials.groupby(level=0).agg({c: _MERGE[c] for c in partials.columns})
+
+    properties = pd.DataFrame({
+        "area": merged["area"],
+        "row": merged["row_sum"] / merged["area"],
+        "col": merged["col_sum"] / merged["area"],
+        "min_row": merged["min_row"],
+        "min_col": merged["min_col"],
+        "max_row": merged["max_row"],
+        "max_col": merged["max_col"],
+    })
+    if intensity_image is not None:
+        properties["mean_intensity"] = merged["intensity_sum"] / merged["area"]
+    properties.index.name = "label"
+    return properties
+
+
+def region_centroids(label_image) -> pd.DataFrame:
+    """pixel centroid (row, col) of each non-background label of a 2-d label image"""
+    return region_properties(label_image)[["row", "col"]]
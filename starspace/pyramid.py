@@ -0,0 +1,60 @@
+from typing import List
+
+import dask.array as da
+import numpy as np
+
+# each pyramid level halves the resolution of the level below it
+DOWNSAMPLE_FACTOR = 2
+
+PYRAMID_METHODS = ("mode", "nearest")
+
+
+def _mode_block(block: np.ndarray) -> np.ndarray:
+    """most common label of each 2x2 window, breaking ties in favor of the top left pixel"""
+    rows, cols = (s // DOWNSAMPLE_FACTOR for s in block.shape)
+    windows = block.reshape(rows, DOWNSAMPLE_FACTOR, cols, DOWNSAMPLE_FACTOR)
+    windows = windows.transpose(0, 2, 1, 3).reshape(rows, cols, -1)
+    counts = (windows[..., :, None] == windows[..., None, :]).sum(axis=-1)
+    choice = np.argmax(counts, axis=-1)
+    return np.take_along_axis(windows, choice[..., None], axis=-1)[..., 0]
+
+
+def downsample_labels(label_image: da.Array, method: str = "mode") -> da.Array:
+    """halve the resolution of a 2-d label image without mixing label values
+
+    "mode" keeps the most common label of each 2x2 window, "nearest" keeps its top left pixel.
+    Odd trailing rows and columns are padded by repeating the edge, so the downsampled image
+    has ceil(shape / 2) pixels and covers the full extent of the image.
+    """
+    if method not in PYRAMID_METHODS:
+        raise ValueError(f"method must be one of {PYRAMID_METHODS}")
+
+    if method == "nearest":
+        return label_image[::DOWNSAMPLE_FACTOR, ::DOWNSAMPLE_FACTOR]
+
+    padded = da.pad(
+        label_image, [(0, s % DOWNSAMPLE_FACTOR) for s in label_image.shape], mode="edge"
+    )
+    # windows must not straddle chunks, so make every chunk even before downsampling
+    chunks = tuple(
+        max(DOWNSAMPLE_FACTOR, c - c % DOWNSAMPLE_FACTOR) for c in padded.chunksize
+    )
+    padded = padded.rechunk(chunks)
+    chunks = tuple(tuple(c // DOWNSAMPLE_FACTOR for c in axis) for axis in padded.chunks)
+    return padded.map_blocks(_mode_block, chunks=chunks, dtype=padded.dtype)
+
+
+def build_pyramid(label_image: da.Array, levels: int, method: str = "mode") -> List[da.Array]:
+    """full resolution label image followed by levels successively halved images
+
+    Each level is computed lazily from the one below it and rechunked to the chunk shape of the
+    full resolution image, so all levels can be written in parallel.
+    """
+    label_image = da.asarray(label_image)
+    pyramid = [label_image]
+    for _ in range(levels):
+        if min(pyramid[-1].shape) < DOWNSAMPLE_FACTOR:
+            break
+        level = downsample_labels(pyramid[-1], method=method)
+        pyramid.append(level.rechunk(label_image.chunksize))
+    return pyramid
@@ -0,0 +1,112 @@
+from typing import Tuple
+
+import dask
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from .constants import REGIONS_RLE_VARIABLES, REGIONS_RLE_AXES, REGIONS_RLE_FORMAT
+from .measure import BACKGROUND
+
+
+def _encode_band(band: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """row-wise runs of non-background labels in a band of rows, in row-major order"""
+    change = np.ones(band.shape, dtype=bool)
+    change[:, 1:] = band[:, 1:] != band[:, :-1]
+    rows, starts = np.nonzero(change)
+
+    # every row starts a run, so a run always ends where the next one starts
+    flat_starts = rows * band.shape[1] + starts
+    lengths = np.diff(np.append(flat_starts, band.size))
+    labels = band[rows, starts]
+
+    keep = labels != BACKGROUND
+    return rows[keep], starts[keep], lengths[keep], labels[keep]
+
+
+def encode(label_image) -> xr.Dataset:
+    """run-length encode each row of a 2-d label image, dropping background runs
+
+    Bands of rows, one row of chunks high, are encoded in parallel. Runs are stored in row-major
+    order, and row_offsets records where the runs of each row start, so the runs overlapping any
+    window of rows are a single contiguous slice.
+    """
+    label_image = da.asarray(label_image)
+    bands = label_image.rechunk({1: -1}).to_delayed()[:, 0]
+    encoded = dask.compute(*[dask.delayed(_encode_band)(band) for band in bands])
+
+    row_bounds = np.concatenate([[0], np.cumsum(label_image.chunks[0])])
+    rows = np.concatenate([e[0] + offset for e, offset in zip(encoded, row_bounds)])
+    starts, lengths, labels = (np.concatenate([e[i] for e in encoded]) for i in (1, 2, 3))
+    row_offsets = np.searchsorted(rows, np.arange(label_image.shape[0] + 1))
+
+    dataset = xr.Dataset({
+        REGIONS_RLE_VARIABLES.STARTS.value: (REGIONS_RLE_AXES.RUNS.value, starts),
+        REGIONS_RLE_VARIABLES.LENGTHS.value: (REGIONS_RLE_AXES.RUNS.value, lengths),
+        REGIONS_RLE_VARIABLES.LABELS.value: (REGIONS_RLE_AXES.RUNS.value, labels),
+        REGIONS_RLE_VARIABLES.ROW_OFFSETS.value: (REGIONS_RLE_AXES.ROWS.value, row_offsets),
+    })
+    dataset[REGIONS_RLE_VARIABLES.LABELS.value].attrs = {
+        "format": REGIONS_RLE_FORMAT,
+        "shape": list(label_image.shape),
+        "chunks": list(label_image.chunksize),
+    }
+    return dataset
+
+
+def _rasterize(
+    starts: np.ndarray,
+    lengths: np.ndarray,
+    labels: np.ndarray,
+    row_offsets: np.ndarray,
+    col_start: int,
+    col_stop: int,
+) -> np.ndarray:
+    """paint the runs of a window of rows into a dense tile spanning [col_start, col_stop)"""
+    n_rows = row_offsets.shape[0] - 1
+    tile = np.full((n_rows, col_stop - col_start), BACKGROUND, dtype=labels.dtype)
+
+    rows = np.repeat(np.arange(n_rows), np.diff(row_offsets))
+    lo = np.maximum(starts, col_start)
+    hi = np.minimum(starts + lengths, col_stop)
+    keep = hi > lo
+    rows, lo, hi, labels = rows[keep], lo[keep], hi[keep], labels[keep]
+
+    # expand each clipped run into its pixels
+    run_lengths = hi - lo
+    first_pixel = np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+    cols = np.repeat(lo - col_start, run_lengths) + np.arange(run_lengths.sum()) - first_pixel
+    tile[np.repeat(rows, run_lengths), cols] = np.repeat(labels, run_lengths)
+    return tile
+
+
+def decode(dataset: xr.Dataset) -> da.Array:
+    """lazily rasterize run-length encoded labels into a dask array
+
+    Each chunk only reads the runs of its own rows, so indexing a window of the label image only
+    reads and paints the runs that overlap it.
+    """
+    labels = dataset[REGIONS_RLE_VARIABLES.LABELS.value]
+    if labels.attrs.get("format") != REGIONS_RLE_FORMAT:
+        raise ValueError(f"unsupported label image format {labels.attrs.get('format')}")
+
+    shape = tuple(labels.attrs["shape"])
+    chunks = da.core.normalize_chunks(tuple(labels.attrs["chunks"]), shape)
+    starts = dataset[REGIONS_RLE_VARIABLES.STARTS.value].data
+    lengths = dataset[REGIONS_RLE_VARIABLES.LENGTHS.value].data
+    row_offsets = np.asarray(dataset[REGIONS_RLE_VARIABLES.ROW_OFFSETS.value])
+
+    row_bounds = np.concatenate([[0], np.cumsum(chunks[0])])
+    col_bounds = np.concatenate([[0], np.cumsum(chunks[1])])
+    blocks = []
+    for r0, r1 in zip(row_bounds[:-1], row_bounds[1:]):
+        lo, hi = row_offsets[r0], row_offsets[r1]
+        row = []
+        for c0, c1 in zip(col_bounds[:-1], col_bounds[1:]):
+            tile = dask.delayed(_rasterize)(
+                starts[lo:hi], lengths[lo:hi], labels.data[lo:hi], row_offsets[r0:r1 + 1] - lo,
+                c0, c1
+            )
+            row.append(da.from_delayed(tile, shape=(r1 - r0, c1 - c0), dtype=labels.dtype))
+        blocks.append(row)
+    return da.block(blocks)
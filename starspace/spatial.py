@@ -0,0 +1,216 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+
+from .constants import SPATIAL_INDEX_VARIABLES, SPATIAL_INDEX_AXES
+
+# average number of points per tile when a tile size isn't specified
+_POINTS_PER_TILE = 64
+
+
+def points_in_polygon(points: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    """boolean mask of the (n, 2) points inside a polygon, by the even-odd rule"""
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(points.shape[0], dtype=bool)
+    x0, y0 = vertices[-1]
+    for x1, y1 in vertices:
+        # a ray cast from each point in the +x direction crosses the edge (x0, y0) - (x1, y1)
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_crossing = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < x_crossing)
+        x0, y0 = x1, y1
+    return inside
+
+
+def default_tile_size(extent: np.ndarray, n_points: int, points_per_tile: float) -> float:
+    """side of square tiles holding about points_per_tile of n_points spread over extent
+
+    The tile is at least extent.max() / sqrt(n_points), so points along a line or in a thin
+    strip, whose bounding box has almost no area, span at most n_points tiles.
+    """
+    n_points = max(n_points, 1)
+    area = max(np.prod(extent), 1.0)
+    tile_size = np.sqrt(area * points_per_tile / n_points)
+    return float(max(tile_size, np.max(extent) / np.sqrt(n_points)))
+
+
+class GridIndex:
+    """uniform grid index over 2- or 3-d points, tiled over the first two dimensions
+
+    Points are sorted by the flattened id of the tile they fall in, and offsets records where
+    each tile's run of points starts, so the points of any tile are a single contiguous slice.
+    Queries visit only the tiles that overlap the query and return sorted positions into the
+    original point array.
+    """
+
+    def __init__(
+        self,
+        order: np.ndarray,
+        offsets: np.ndarray,
+        coordinates: np.ndarray,
+        origin: Sequence[float],
+        tile_size: float,
+        n_tiles: Tuple[int, int],
+    ):
+        self.order = order
+        self.offsets = offsets
+        self.coordinates = coordinates
+        self.origin = np.asarray(origin, dtype=float)
+        self.tile_size = float(tile_size)
+        self.n_tiles = tuple(int(n) for n in n_tiles)
+
+    @classmethod
+    def build(cls, coordinates: np.ndarray, tile_size: Optional[float] = None) -> "GridIndex":
+        """index an (n, d) array of point coordinates; d is 2 or 3
+
+        If tile_size is None, it is chosen so that tiles hold about 64 points on average.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        if coordinates.ndim != 2 or coordinates.shape[1] not in (2, 3):
+            raise ValueError("coordinates must be an (n, 2) or (n, 3) array")
+        if np.isnan(coordinates).any():
+            raise ValueError("coordinates must not contain missing values")
+
+        if coordinates.shape[0]:
+            origin = coordinates[:, :2].min(axis=0)
+            extent = coordinates[:, :2].max(axis=0) - origin
+        else:
+            origin = extent = np.zeros(2)
+
+        if tile_size is None:
+            tile_size = default_tile_size(extent, coordinates.shape[0], _POINTS_PER_TILE)
+        if tile_size <= 0:
+            raise ValueError("tile_size must be positive")
+
+        n_tiles = tuple(np.floor(extent / tile_size).astype(int) + 1)
+        tile_ids = cls._tile_ids(coordinates, origin, tile_size, n_tiles)
+        order = np.argsort(tile_ids, kind="stable")
+        offsets = np.zeros(n_tiles[0] * n_tiles[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tile_ids, minlength=offsets.shape[0] - 1), out=offsets[1:])
+
+        return cls(order, offsets, coordinates[order], origin, tile_size, n_tiles)
+
+    @staticmethod
+    def _tile_ids(coordinates, origin, tile_size, n_tiles) -> np.ndarray:
+        tiles = np.floor((coordinates[:, :2] - origin) / tile_size).astype(np.int64)
+        tiles = np.clip(tiles, 0, np.asarray(n_tiles) - 1)
+        return tiles[:, 0] * n_tiles[1] + tiles[:, 1]
+
+    @property
+    def ndim(self) -> int:
+        return self.coordinates.shape[1]
+
+    def _tile_range(self, lower: np.ndarray, upper: np.ndarray) -> Tuple[range, range]:
+        lo = np.floor((lower[:2] - self.origin) / self.tile_size).astype(int)
+        hi = np.floor((upper[:2] - self.origin) / self.tile_size).astype(int)
+        lo = np.clip(lo, 0, np.asarray(self.n_tiles) - 1)
+        hi = np.clip(hi, -1, np.asarray(self.n_tiles) - 1)
+        return range(lo[0], hi[0] + 1), range(lo[1], hi[1] + 1)
+
+    def _candidates(self, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+        """sorted-order slots of all points in tiles overlapping the box [lower, upper]"""
+        rows, cols = self._tile_range(lower, upper)
+        if not len(rows) or not len(cols):
+            return np.empty(0, dtype=np.int64)
+        # tiles in a row of the grid are contiguous, so each row is a single slice
+        slices = [
+            np.arange(self.offsets[r * self.n_tiles[1] + cols.start],
+                      self.offsets[r * self.n_tiles[1] + cols.stop])
+            for r in rows
+        ]
+        return np.concatenate(slices)
+
+    def query_box(self, lower: Sequence[float], upper: Sequence[float]) -> np.ndarray:
+        """positions of points p with lower <= p <= upper in every dimension"""
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        if lower.shape[0] != upper.shape[0] or lower.shape[0] > self.ndim:
+            raise ValueError(f"box bounds must have at most {self.ndim} dimensions")
+
+        slots = self._candidates(lower, upper)
+        coordinates = self.coordinates[slots, :lower.shape[0]]
+        inside = np.all((coordinates >= lower) & (coordinates <= upper), axis=1)
+        return np.sort(self.order[slots[inside]])
+
+    def query_polygon(self, vertices: Sequence[Tuple[float, float]]) -> np.ndarray:
+        """positions of points whose first two coordinates are inside a polygon
+
+        vertices are the (x, y) corners of the polygon in order; it is closed automatically.
+        """
+        vertices = np.asarray(vertices, dtype=float)
+        if vertices.ndim != 2 or vertices.shape[1] != 2 or vertices.shape[0] < 3:
+            raise ValueError("a polygon needs at least three (x, y) vertices")
+
+        slots = self._candidates(vertices.min(axis=0), vertices.max(axis=0))
+        inside = points_in_polygon(self.coordinates[slots, :2], vertices)
+        return np.sort(self.order[slots[inside]])
+
+    def query_radius(self, point: Sequence[float], radius: float) -> np.ndarray:
+        """positions of points within radius of point"""
+        point = np.asarray(point, dtype=float)
+        slots = self._candidates(point - radius, point + radius)
+        distances = self._distances(slots, point)
+        return np.sort(self.order[slots[distances <= radius]])
+
+    def query_knn(self, point: Sequence[float], k: int) -> np.ndarray:
+        """positions of the k points nearest to point, nearest first"""
+        point = np.asarray(point, dtype=float)
+        k = min(k, self.order.shape[0])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        # grow a square around the point until it holds k points that are closer than any point
+        # outside of it can be, starting from the nearest edge of the grid
+        grid_upper = self.origin + np.asarray(self.n_tiles) * self.tile_size
+        outside = np.maximum(np.maximum(self.origin - point[:2], point[:2] - grid_upper), 0)
+        covering_width = np.max(np.maximum(point[:2] - self.origin, grid_upper - point[:2]))
+        half_width = np.sqrt(np.sum(outside ** 2)) + self.tile_size
+        while True:
+            slots = self._candidates(point - half_width, point + half_width)
+            covers_grid = half_width >= covering_width
+            if slots.shape[0] >= k:
+                distances = self._distances(slots, point)
+                nearest = np.argpartition(distances, k - 1)[:k]
+                if distances[nearest].max() <= half_width or covers_grid:
+                    nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+                    return self.order[slots[nearest]]
+            elif covers_grid:
+                raise ValueError("index holds fewer than k points")
+            half_width *= 2
+
+    def _distances(self, slots: np.ndarray, point: np.ndarray) -> np.ndarray:
+        difference = self.coordinates[slots, :point.shape[0]] - point
+        return np.sqrt(np.sum(difference ** 2, axis=1))
+
+    def to_dataset(self) -> xr.Dataset:
+        """lay the index out as an xarray Dataset so that it can be saved next to its data"""
+        return xr.Dataset(
+            data_vars={
+                SPATIAL_INDEX_VARIABLES.ORDER.value: (SPATIAL_INDEX_AXES.POINTS.value, self.order),
+                SPATIAL_INDEX_VARIABLES.OFFSETS.value: (
+                    SPATIAL_INDEX_AXES.OFFSETS.value, self.offsets
+                ),
+                SPATIAL_INDEX_VARIABLES.COORDINATES.value: (
+                    (SPATIAL_INDEX_AXES.POINTS.value, SPATIAL_INDEX_AXES.DIMENSIONS.value),
+                    self.coordinates
+                ),
+            },
+            attrs={
+                "origin": self.origin.tolist(),
+                "tile_size": self.tile_size,
+                "n_tiles": list(self.n_tiles),
+            },
+        )
+
+    @classmethod
+    def from_dataset(cls, dataset: xr.Dataset) -> "GridIndex":
+        return cls(
+            order=np.asarray(dataset[SPATIAL_INDEX_VARIABLES.ORDER.value]),
+            offsets=np.asarray(dataset[SPATIAL_INDEX_VARIABLES.OFFSETS.value]),
+            coordinates=np.asarray(dataset[SPATIAL_INDEX_VARIABLES.COORDINATES.value]),
+            origin=dataset.attrs["origin"],
+            tile_size=dataset.attrs["tile_size"],
+            n_tiles=dataset.attrs["n_tiles"],
+        )
@@ -0,0 +1,62 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import fsspec
+import s3fs
+
+# connections kept open per filesystem. dask reads chunks from many threads at once, so this
+# should be at least the number of threads reading from a store
+DEFAULT_MAX_POOL_CONNECTIONS = 64
+
+_settings: Dict[str, Any] = {"max_pool_connections": DEFAULT_MAX_POOL_CONNECTIONS}
+_filesystems: Dict[Tuple[Optional[str], Tuple], s3fs.S3FileSystem] = {}
+_lock = threading.Lock()
+
+
+def configure_s3(max_pool_connections: Optional[int] = None, **s3_kwargs) -> None:
+    """set options for S3 filesystems opened from now on and drop pooled filesystems
+
+    max_pool_connections sets the size of the connection pool of each filesystem. Any other
+    keyword arguments, such as endpoint_url, key or secret, are passed to s3fs.S3FileSystem.
+    Options that are not given are reset to their defaults.
+    """
+    with _lock:
+        _settings.clear()
+        _settings["max_pool_connections"] = max_pool_connections or DEFAULT_MAX_POOL_CONNECTIONS
+        _settings.update(s3_kwargs)
+        _filesystems.clear()
+
+
+def get_s3_filesystem(profile_name: Optional[str] = None) -> s3fs.S3FileSystem:
+    """return the process-wide S3 filesystem for an AWS profile, creating it on first use
+
+    Filesystems are shared by every load and save in the process, so credentials are resolved
+    and connections are opened once per profile rather than once per call.
+    """
+    key = (profile_name, tuple(sorted((k, repr(v)) for k, v in _settings.items())))
+    with _lock:
+        filesystem = _filesystems.get(key)
+        if filesystem is None:
+            s3_kwargs = dict(_settings)
+            max_pool_connections = s3_kwargs.pop("max_pool_connections")
+            config_kwargs = dict(s3_kwargs.pop("config_kwargs", {}))
+            config_kwargs["max_pool_connections"] = max_pool_connections
+            if profile_name is not None:
+                s3_kwargs["profile"] = profile_name
+            filesystem = s3fs.S3FileSystem(config_kwargs=config_kwargs, **s3_kwargs)
+            _filesystems[key] = filesystem
+    return filesystem
+
+
+def s3_store(url: str, profile_name: Optional[str] = None) -> s3fs.S3Map:
+    """key-value store for the zarr store at an s3://bucket/path url"""
+    root = url.replace("s3://", "", 1)
+    return s3fs.S3Map(root=root, s3=get_s3_filesystem(profile_name), check=False)
+
+
+def get_filesystem(url: str, profile_name: Optional[str] = None) -> Tuple[Any, str]:
+    """filesystem and path for a local path or s3:// url, for reading and writing plain files"""
+    url = str(url)
+    if url.startswith("s3://"):
+        return get_s3_filesystem(profile_name), url.replace("s3://", "", 1)
+    return fsspec.filesystem("file"), url
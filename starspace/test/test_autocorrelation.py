@@ -0,0 +1,44 @@
+import dask.array as da
+import numpy as np
+import scipy.sparse as sp
+
+from starspace.autocorrelation import spatial_autocorrelation, spatial_weights
+from starspace.graph import neighbor_graph
+
+
+def brute_force(values: np.ndarray, weights: np.ndarray):
+    n = values.shape[0]
+    z = values - values.mean()
+    s0 = weights.sum()
+    moran = n / s0 * (z @ weights @ z) / (z @ z)
+    differences = (values[:, None] - values[None]) ** 2
+    geary = (n - 1) / (2 * s0) * np.sum(weights * differences) / (z @ z)
+    return moran, geary
+
+
+def test_spatial_autocorrelation() -> None:
+    rng = np.random.RandomState(0)
+    points = rng.uniform(0, 10, size=(200, 2))
+    weights = spatial_weights(neighbor_graph(points, k=5))
+
+    # a smooth gradient, random noise, and a constant
+    values = np.stack([points[:, 0], rng.normal(size=200), np.ones(200)], axis=1)
+    data = da.from_array(values, chunks=(50, 1))
+
+    result = spatial_autocorrelation(
+        data, weights, features=["gradient", "noise", "constant"], n_permutations=99,
+        permutation_batch=10, features_per_block=2,
+    )
+    for feature in ("gradient", "noise"):
+        moran, geary = brute_force(values[:, result.index.get_loc(feature)], weights.toarray())
+        assert np.isclose(result.loc[feature, "moran_i"], moran)
+        assert np.isclose(result.loc[feature, "geary_c"], geary)
+
+    assert result.loc["gradient", "moran_i"] > 0.8
+    assert result.loc["gradient", "moran_i_p_value"] == 0.01
+    assert result.loc["noise", "moran_i_p_value"] > 0.01
+    assert result.loc["constant"].isna().all()
+
+    sparse = da.from_array(sp.csr_matrix(values), chunks=(50, 3), asarray=False)
+    sparse_result = spatial_autocorrelation(sparse, weights)
+    assert np.allclose(sparse_result.values[:2], result.values[:2, :2])
@@ -0,0 +1,38 @@
+import dask.array as da
+import numpy as np
+import pytest
+
+from starspace.binning import bin_centers, bin_codes, bin_counts
+
+
+def test_hex_bins_are_nearest_centers() -> None:
+    points = np.random.RandomState(0).uniform(-50, 50, size=(5000, 2))
+    column, row = bin_codes(points[:, 0], points[:, 1], bin_size=7, shape="hex")
+    x, y = bin_centers(column, row, bin_size=7, shape="hex")
+    distance = np.hypot(points[:, 0] - x, points[:, 1] - y)
+
+    # no neighboring hex center is closer than the assigned one
+    for d_column, d_row in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]:
+        x_neighbor, y_neighbor = bin_centers(column + d_column, row + d_row, 7, shape="hex")
+        assert np.all(distance <= np.hypot(points[:, 0] - x_neighbor, points[:, 1] - y_neighbor))
+
+    with pytest.raises(ValueError):
+        bin_codes(points[:, 0], points[:, 1], bin_size=7, shape="triangle")
+
+
+def test_bin_counts_streams_chunks() -> None:
+    rng = np.random.RandomState(1)
+    x, y = rng.uniform(0, 100, size=(2, 10000))
+    genes = rng.choice(np.array(["A", "B", "C", "nan"]), size=10000)
+
+    counts, bins, gene_names = bin_counts(
+        da.from_array(x, chunks=700), da.from_array(y, chunks=700),
+        da.from_array(genes, chunks=700), bin_size=10, split_every=3,
+    )
+    expected, expected_bins, _ = bin_counts(x, y, genes, bin_size=10)
+
+    assert gene_names.tolist() == ["A", "B", "C"]
+    assert counts.sum() == np.count_nonzero(genes != "nan")
+    assert bins.shape == (100, 4)
+    assert (counts != expected).nnz == 0
+    assert bins.equals(expected_bins)
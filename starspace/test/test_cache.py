@@ -0,0 +1,110 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import pytest
+import xarray as xr
+
+from starspace.cache import CacheMissError, ChunkCache
+from starspace.test.util import make_spots
+
+
+class CountingStore(dict):
+    """in-memory stand-in for a remote store that counts reads"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = 0
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return super().__getitem__(key)
+
+
+def test_read_through_and_offline() -> None:
+    spots = make_spots()
+    remote = CountingStore()
+    spots.to_zarr(store=remote, consolidated=True)
+
+    with TemporaryDirectory() as cache_directory:
+        cold = xr.open_zarr(ChunkCache(remote, cache_directory, namespace="spots"),
+                            consolidated=True).load()
+        reads = remote.reads
+        assert cold.identical(spots)
+
+        warm = xr.open_zarr(ChunkCache(remote, cache_directory, namespace="spots"),
+                            consolidated=True).load()
+        assert warm.identical(spots)
+        assert remote.reads == reads
+
+        offline = ChunkCache({}, cache_directory, namespace="spots", offline=True)
+        assert xr.open_zarr(offline, consolidated=True).load().identical(spots)
+        with pytest.raises(CacheMissError):
+            offline["never-fetched"]
+
+
+def test_integrity_and_eviction() -> None:
+    remote = CountingStore({"a": b"a" * 100, "b": b"b" * 100})
+
+    with TemporaryDirectory() as cache_directory:
+        cache = ChunkCache(remote, cache_directory, max_bytes=200)
+        assert cache["a"] == remote["a"]
+
+        # corrupt entries are discarded and fetched again
+        path = cache._path("a")
+        path.write_bytes(path.read_bytes()[:-1] + b"x")
+        assert cache["a"] == remote["a"]
+        assert cache._usage.size == path.stat().st_size
+
+        # reading b pushes the cache over its limit, evicting a
+        cache["b"]
+        assert not cache._path("a").exists()
+        assert cache._path("b").exists()
+
+        # caches opened later on the same directory share its size instead of rescanning it
+        reopened = ChunkCache(remote, cache_directory, max_bytes=200)
+        assert reopened._usage is cache._usage
+        assert reopened._usage.size == cache._path("b").stat().st_size
+
+
+def test_eviction_down_to_low_water_mark() -> None:
+    remote = CountingStore({key: key.encode() * 100 for key in "abc"})
+
+    with TemporaryDirectory() as cache_directory:
+        # each entry is 132 bytes with its digest, so a and b fit but c doesn't
+        cache = ChunkCache(remote, cache_directory, max_bytes=280)
+        now = time.time()
+        for age, key in enumerate("ab"):
+            cache[key]
+            os.utime(cache._path(key), (now - 10 + age, now - 10 + age))
+        cache["c"]
+
+        # evicting a alone would be enough for the limit, but not for 90% of it
+        assert not cache._path("a").exists()
+        assert not cache._path("b").exists()
+        assert cache._path("c").exists()
+        assert cache._usage.size == cache._path("c").stat().st_size
+
+
+def test_missing_keys_expire() -> None:
+    remote = CountingStore()
+
+    with TemporaryDirectory() as cache_directory:
+        cache = ChunkCache(remote, cache_directory, missing_ttl=60)
+        with pytest.raises(KeyError):
+            cache["a"]
+
+        # a key added by another writer is only seen once its marker expires
+        remote["a"] = b"a"
+        with pytest.raises(KeyError):
+            cache["a"]
+        marker = cache._path("a", ".missing")
+        os.utime(marker, (time.time() - 120, time.time() - 120))
+        assert cache["a"] == b"a"
+        assert not marker.exists()
+
+        # writes through the cache drop the marker at once
+        with pytest.raises(KeyError):
+            cache["b"]
+        cache["b"] = b"b"
+        assert cache["b"] == b"b"
@@ -0,0 +1,64 @@
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+from starspace.catalog import Catalog, build_manifest
+from starspace.classes import Spots
+from starspace.constants import ASSAYS, MATRIX_NAME, REGIONS_NAME, SPOTS_NAME, \
+    SPOTS_REQUIRED_VARIABLES
+from starspace.test.util import make_matrix, make_regions, make_spots
+
+
+def test_catalog() -> None:
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "experiment"
+        make_matrix().save_zarr(url)
+        make_spots().save_zarr(url)
+        make_regions().save_zarr(url, layout="rle")
+
+        other = make_matrix(sparse=True)
+        other.attrs["organism"] = "mouse"
+        other.save_zarr(Path(dirpath) / "other")
+        # only the manifests in the directory itself are listed, not those in subdirectories
+        make_spots().save_zarr(Path(dirpath) / "nested" / "experiment")
+
+        catalog = Catalog.load(dirpath)
+        assert len(catalog) == 4
+        assert {m["kind"] for m in catalog.query()} == {MATRIX_NAME, SPOTS_NAME, REGIONS_NAME}
+
+        matrix, = catalog.query(kind=MATRIX_NAME, organism="Human")
+        assert matrix["url"] == f"{url}.{MATRIX_NAME}.zarr"
+        assert matrix["shape"] == {"regions": 2, "features": 2}
+        assert matrix["genes"] == ["ACTA", "ACTB"]
+        assert matrix["extent"]["x"] == [10, 300]
+
+        assert len(catalog.query(kind=MATRIX_NAME, gene="acta", assay=ASSAYS.MERFISH.value)) == 2
+        assert len(catalog.query(authors="hannibal lector")) == 4
+        assert catalog.query(gene="GAD2") == []
+
+        regions, = catalog.query(kind=REGIONS_NAME)
+        assert regions["shape"] == {"y_region": 3, "x_region": 3}
+
+        compacted = Path(dirpath) / "catalog.json"
+        catalog.save(compacted)
+        reloaded = Catalog.load(compacted)
+        assert reloaded.manifests == catalog.manifests
+        assert reloaded.to_dataframe().shape[0] == 4
+
+
+def test_manifest_of_lazy_spots() -> None:
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "experiment"
+        make_spots().save_zarr(url)
+        spots = Spots.load_zarr(f"{url}.{SPOTS_NAME}.zarr")
+
+        manifest = build_manifest(spots, url, SPOTS_NAME)
+        assert manifest["genes"] == ["ACTA", "ACTB"]
+        x = spots[SPOTS_REQUIRED_VARIABLES.X_SPOT.value]
+        y = spots[SPOTS_REQUIRED_VARIABLES.Y_SPOT.value]
+        assert manifest["extent"] == {
+            "x": [float(x.min()), float(x.max())], "y": [float(y.min()), float(y.max())]
+        }
+        assert manifest["extent"] == {"x": [2, 16], "y": [0, 1e5]}
+
+        # the manifest written with the spots is reduced in the same pass as the write
+        assert Catalog.load(dirpath).manifests[0]["extent"] == manifest["extent"]
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from starspace import colocalization as colocalization_module
+from starspace.colocalization import colocalization, cross_l, pair_counts
+
+
+def brute_force(coordinates: np.ndarray, codes: np.ndarray, n_genes: int, radii) -> np.ndarray:
+    distances = cdist(coordinates, coordinates)
+    np.fill_diagonal(distances, np.inf)
+    counts = np.zeros((n_genes, n_genes, len(radii)), dtype=np.int64)
+    for a in range(n_genes):
+        for b in range(n_genes):
+            pairs = distances[np.ix_(codes == a, codes == b)]
+            counts[a, b] = [np.count_nonzero(pairs <= r) for r in radii]
+    return counts
+
+
+def test_pair_counts_match_brute_force() -> None:
+    rng = np.random.RandomState(0)
+    coordinates = rng.uniform(0, 100, size=(1500, 2))
+    coordinates[1] = coordinates[0]  # coincident points are neighbors
+    codes = rng.randint(0, 4, size=1500)
+    radii = [0, 2, 5, 10]
+
+    # small tiles, so most neighbors are found in the halo of other tiles
+    counts = pair_counts(coordinates, codes, 4, radii, tile_size=7, workers=4)
+    assert np.array_equal(counts, brute_force(coordinates, codes, 4, radii))
+    assert np.array_equal(counts, counts.transpose(1, 0, 2))
+
+    with pytest.raises(ValueError):
+        pair_counts(coordinates, codes, 4, [5, 2])
+
+
+def test_pair_counts_in_batches(monkeypatch) -> None:
+    rng = np.random.RandomState(0)
+    coordinates = rng.uniform(0, 100, size=(1500, 2))
+    codes = rng.randint(0, 4, size=1500)
+    radii = [2, 5, 10]
+
+    # a tile's points are queried a few at a time when they have many neighbors
+    monkeypatch.setattr(colocalization_module, "_PAIRS_PER_BATCH", 500)
+    counts = pair_counts(coordinates, codes, 4, radii, workers=1)
+    assert np.array_equal(counts, brute_force(coordinates, codes, 4, radii))
+
+
+def test_colocalization() -> None:
+    rng = np.random.RandomState(1)
+    coordinates = rng.uniform(0, 200, size=(4000, 2))
+    genes = rng.choice(np.array(["A", "B", "nan"]), size=4000)
+    coordinates[genes == "B"] = coordinates[genes == "A"][:np.count_nonzero(genes == "B")] + 0.1
+    coordinates[0] = np.nan
+
+    result = colocalization(coordinates, genes, radii=[1, 10])
+    assert result.dims == ("gene_name", "neighbor_gene_name", "radius")
+    assert result["gene_name"].values.tolist() == ["A", "B"]
+
+    l_function = cross_l(result)
+    # B spots sit on top of A spots, so they are far more colocalized than random
+    assert l_function.sel(gene_name="A", neighbor_gene_name="B", radius=1) > 3
+    random_l = l_function.sel(gene_name="A", neighbor_gene_name="A", radius=10)
+    assert np.isclose(random_l, 10, rtol=0.2)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from starspace.classes import Matrix
+from starspace.combine import concat_matrices, normalize_genes
+from starspace.constants import MATRIX_AXES, MATRIX_DATASET, MATRIX_REQUIRED_FEATURES
+from starspace.test.util import make_attributes, make_matrix, make_matrix_coords
+
+
+def make_lowercase_matrix(sparse: bool = False) -> Matrix:
+    """a matrix measuring ACTB and GAD1, under the alias gad67, with lowercased gene names"""
+    data = np.array([[5, 6], [7, 8], [9, 10]])
+    if sparse:
+        data = sp.csr_matrix(data)
+    coords = make_matrix_coords()
+    coords = {
+        name: (dim, list(values) + [values[0]]) for name, (dim, values) in coords.items()
+        if dim == MATRIX_AXES.REGIONS
+    }
+    coords[MATRIX_REQUIRED_FEATURES.GENE_NAME] = (MATRIX_AXES.FEATURES, ["gad67", "actb"])
+    return Matrix.from_expression_data(
+        data=data, coords=coords, dims=tuple(MATRIX_AXES), attrs=make_attributes()
+    )
+
+
+def test_normalize_genes() -> None:
+    genes = normalize_genes(["Gad67", "ACTB"], case="upper", aliases={"gad67": "Gad1"})
+    assert genes.tolist() == ["GAD1", "ACTB"]
+    with pytest.raises(ValueError):
+        normalize_genes(["ACTB"], case="title")
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_concat_matrices(sparse: bool) -> None:
+    first, second = make_matrix(sparse=sparse), make_lowercase_matrix(sparse=sparse)
+    combined = concat_matrices(
+        [first, second], names=["a", "b"], case="upper", aliases={"GAD67": "GAD1"}
+    )
+    assert combined.is_sparse == sparse
+    assert combined[MATRIX_REQUIRED_FEATURES.GENE_NAME.value].values.tolist() == [
+        "ACTA", "ACTB", "GAD1"
+    ]
+    assert combined[MATRIX_DATASET].values.tolist() == ["a", "a", "b", "b", "b"]
+
+    expected = np.array([[0, 1, 0], [1, 0, 0], [0, 6, 5], [0, 8, 7], [0, 10, 9]])
+    values = combined.to_csr().toarray() if sparse else combined.values
+    assert np.array_equal(values, expected)
+
+    inner = concat_matrices([first, second], case="upper", join="inner")
+    assert inner[MATRIX_REQUIRED_FEATURES.GENE_NAME.value].values.tolist() == ["ACTB"]
+
+    with pytest.raises(ValueError):
+        concat_matrices([first, first.assign_coords(
+            {MATRIX_REQUIRED_FEATURES.GENE_NAME.value: (MATRIX_AXES.FEATURES.value, ["a", "A"])}
+        )], case="lower")
+
+
+def test_concat_sparse_feature_chunks() -> None:
+    first, second = make_matrix(sparse=True), make_lowercase_matrix(sparse=True)
+    # sparse blocks split over features have to be joined before columns are scattered
+    second = second.copy(data=second.data.rechunk((2, 1)))
+    assert len(second.data.chunks[1]) == 2
+
+    combined = concat_matrices([first, second], case="upper", aliases={"GAD67": "GAD1"})
+    expected = np.array([[0, 1, 0], [1, 0, 0], [0, 6, 5], [0, 8, 7], [0, 10, 9]])
+    assert np.array_equal(combined.to_csr().toarray(), expected)
@@ -0,0 +1,24 @@
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+from starspace.constants import MATRIX_NAME, SPOTS_NAME
+from starspace.data import open_experiment
+from starspace.test.util import make_matrix, make_regions, make_spots
+
+
+def test_open_experiment() -> None:
+    matrix, spots, regions = make_matrix(), make_spots(), make_regions()
+
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "experiment"
+        matrix.save_zarr(url)
+        spots.save_zarr(url)
+        regions.save_zarr(url)
+
+        experiment = open_experiment(url)
+        assert experiment.matrix.identical(matrix)
+        assert experiment.spots.identical(spots)
+        assert experiment.regions.identical(regions)
+
+        partial = open_experiment(url, members=(MATRIX_NAME, SPOTS_NAME))
+        assert partial.regions is None
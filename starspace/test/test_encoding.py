@@ -0,0 +1,36 @@
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+import zarr
+
+from starspace.classes import Spots
+from starspace.constants import SPOTS_NAME, SPOTS_REQUIRED_VARIABLES, SPOTS_AXES
+from starspace.encoding import CodecPolicy, benchmark_policies, blosc
+from starspace.test.util import make_spots
+
+
+def test_codec_policy_round_trip() -> None:
+    spots = make_spots()
+    x = SPOTS_REQUIRED_VARIABLES.X_SPOT.value
+    policy = CodecPolicy(variables={x: blosc("lz4", shuffle="bitshuffle")}, chunks={x: (2,)})
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath) / "archive.zarr"
+        spots.save_zarr(url=zarr_directory, codecs=policy)
+        url = f"{zarr_directory}.{SPOTS_NAME}.zarr"
+
+        assert Spots.load_zarr(url).identical(spots)
+
+        group = zarr.open_group(url, mode="r")
+        assert group[x].compressor.cname == "lz4"
+        assert group[x].chunks == (2,)
+        assert group[SPOTS_REQUIRED_VARIABLES.Y_SPOT.value].compressor.cname == "zstd"
+        # the sorted integer spot index is delta-encoded
+        assert group[SPOTS_AXES.SPOTS.value].filters[0].codec_id == "delta"
+
+
+def test_benchmark_policies() -> None:
+    results = benchmark_policies(make_spots(), sample_size=2)
+
+    assert list(results.index) == ["zstd", "lz4", "zstd-max"]
+    assert (results["stored_bytes"] > 0).all()
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from starspace.graph import neighbor_graph
+
+
+def test_knn_and_radius_graphs_match_brute_force() -> None:
+    rng = np.random.RandomState(0)
+    points = rng.uniform(0, 100, size=(300, 2))
+    distances = np.sqrt(np.sum((points[:, None] - points[None]) ** 2, axis=2))
+    np.fill_diagonal(distances, np.inf)
+
+    knn = neighbor_graph(points, method="knn", k=4, workers=2)
+    assert np.array_equal(np.diff(knn.indptr), np.full(300, 4))
+    for i in (0, 17, 299):
+        assert set(knn[i].indices) == set(np.argsort(distances[i])[:4])
+        assert np.allclose(knn[i].data, distances[i, knn[i].indices])
+
+    radius = neighbor_graph(points, method="radius", radius=10)
+    assert np.array_equal(radius.toarray() > 0, distances <= 10)
+
+
+def test_delaunay_graph_and_groups() -> None:
+    points = np.array([[0, 0], [1, 0], [0, 1], [1, 1], [0, 0], [1, 0], [0, 1], [1, 1.]])
+    groups = np.array(["a"] * 4 + ["b"] * 4)
+
+    graph = neighbor_graph(points, method="delaunay", groups=groups)
+    assert (graph != graph.T).nnz == 0
+    # no edges between groups, although their points coincide
+    assert graph[:4, 4:].nnz == 0 and graph[4:, :4].nnz == 0
+    # each square is split into two triangles: 4 sides and a diagonal
+    assert graph[:4, :4].nnz == 10
+
+    short = neighbor_graph(points, method="delaunay", radius=1, groups=groups)
+    assert short[:4, :4].nnz == 8
+
+    with pytest.raises(ValueError):
+        neighbor_graph(points, method="radius")
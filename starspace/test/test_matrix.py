@@ -1,9 +1,17 @@
 from tempfile import TemporaryDirectory
 from pathlib import Path
 
+import dask.array as da
+import h5py
+import loompy
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import xarray as xr
+
 from starspace.test.util import make_matrix
 from starspace.classes import Matrix
-from starspace.constants import MATRIX_NAME
+from starspace.constants import LEGACY_MATRIX_REGIONS, MATRIX_NAME
 
 
 def test_read_write() -> None:
@@ -17,3 +25,264 @@ def test_read_write() -> None:
 
         # assert the matrix isn't mutated upon reading
         assert the_matrix_reloaded.identical(matrix)
+
+
+def test_read_legacy_names() -> None:
+    matrix = make_matrix()
+
+    with TemporaryDirectory() as dirpath:
+        matrix.save_zarr(url=f"{dirpath}/current")
+        current = Matrix.load_zarr(f"{dirpath}/current.{MATRIX_NAME}.zarr")
+
+        # stores saved before the enums matched the schema hold x under y_region_microns
+        stored = xr.open_zarr(f"{dirpath}/current.{MATRIX_NAME}.zarr")
+        legacy = stored.rename(
+            {new: old for old, new in LEGACY_MATRIX_REGIONS.items() if new in stored.variables}
+        )
+        for variable in legacy.variables.values():
+            variable.encoding = {}
+        legacy.to_zarr(f"{dirpath}/legacy.{MATRIX_NAME}.zarr", consolidated=True)
+        assert legacy["y_region_microns"].values.tolist() == [10, 300]
+
+        reloaded = Matrix.load_zarr(f"{dirpath}/legacy.{MATRIX_NAME}.zarr", legacy_names=True)
+        assert reloaded.coords.to_dataset().identical(current.coords.to_dataset())
+        assert np.array_equal(reloaded.values, matrix.values)
+
+
+def test_read_write_sparse() -> None:
+    matrix = make_matrix(sparse=True)
+    assert matrix.is_sparse
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath) / "archive.zarr"
+        matrix.save_zarr(url=zarr_directory)
+
+        the_matrix_reloaded = Matrix.load_zarr(url=f"{zarr_directory}.{MATRIX_NAME}.zarr")
+
+        assert the_matrix_reloaded.is_sparse
+        assert (the_matrix_reloaded.to_csr() != matrix.to_csr()).nnz == 0
+        assert the_matrix_reloaded.coords.to_dataset().identical(matrix.coords.to_dataset())
+        assert the_matrix_reloaded.attrs == matrix.attrs
+
+        adata = the_matrix_reloaded.to_anndata()
+        assert sp.issparse(adata.X)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_to_anndata_streaming(sparse: bool) -> None:
+    matrix = make_matrix(sparse=sparse)
+    matrix = matrix.copy(data=matrix.data.rechunk((1, -1)))
+    expected = matrix.to_anndata()
+
+    with TemporaryDirectory() as dirpath:
+        adata = matrix.to_anndata(Path(dirpath) / "matrix.h5ad", parallel_blocks=2)
+        assert adata.isbacked
+        x = adata.X[:, :]
+        assert sp.issparse(x) == sparse
+        assert np.array_equal(x.toarray() if sparse else x, matrix.to_csr().toarray())
+        assert adata.var_names.tolist() == expected.var_names.tolist()
+        assert np.array_equal(adata.obsm["X_spatial"], expected.obsm["X_spatial"])
+        assert adata.uns["assay"] == "MERFISH"
+        adata.file.close()
+
+
+def test_to_anndata_in_memory() -> None:
+    matrix = make_matrix().load()
+    assert isinstance(matrix.data, np.ndarray)
+
+    with TemporaryDirectory() as dirpath:
+        filename = Path(dirpath) / "matrix.h5ad"
+        matrix.to_anndata(filename).file.close()
+        roundtrip = Matrix.from_anndata(str(filename))
+        assert np.array_equal(roundtrip.values, matrix.values)
+        assert roundtrip.coords.to_dataset().identical(matrix.coords.to_dataset())
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_to_loom(sparse: bool) -> None:
+    matrix = make_matrix(sparse=sparse)
+    matrix = matrix.copy(data=matrix.data.rechunk((1, -1)))
+
+    with TemporaryDirectory() as dirpath:
+        filename = str(Path(dirpath) / "matrix.loom")
+        matrix.to_loom(filename, parallel_blocks=2)
+        with loompy.connect(filename, mode="r") as connection:
+            assert np.array_equal(connection[:, :], matrix.to_csr().toarray().T)
+            assert connection.ra["gene_name"].tolist() == ["ACTA", "ACTB"]
+            assert connection.ca["region_id"].tolist() == [4, 99]
+            assert connection.attrs["assay"] == "MERFISH"
+
+
+def test_to_loom_in_memory() -> None:
+    matrix = make_matrix().load()
+    assert isinstance(matrix.data, np.ndarray)
+
+    with TemporaryDirectory() as dirpath:
+        filename = str(Path(dirpath) / "matrix.loom")
+        matrix.to_loom(filename)
+        with loompy.connect(filename, mode="r") as connection:
+            assert np.array_equal(connection[:, :], matrix.values.T)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_from_loom_and_anndata(sparse: bool) -> None:
+    matrix = make_matrix(sparse=sparse)
+    expected = matrix.to_csr().toarray()
+
+    with TemporaryDirectory() as dirpath:
+        loom_file_name = str(Path(dirpath) / "matrix.loom")
+        matrix.to_loom(loom_file_name)
+        from_loom = Matrix.from_loom(loom_file_name)
+        assert isinstance(from_loom.data, da.Array)
+        assert np.array_equal(from_loom.values, expected)
+        assert from_loom.coords.to_dataset().identical(matrix.coords.to_dataset())
+        assert from_loom.attrs["assay"] == "MERFISH"
+        # no handle is left open, so the file can be reopened for writing
+        h5py.File(loom_file_name, "a").close()
+
+        h5ad_file_name = Path(dirpath) / "matrix.h5ad"
+        matrix.to_anndata(h5ad_file_name).file.close()
+        from_h5ad = Matrix.from_anndata(h5ad_file_name)
+        assert from_h5ad.is_sparse == sparse
+        assert np.array_equal(from_h5ad.to_csr().toarray(), expected)
+        assert from_h5ad.coords.to_dataset().identical(matrix.coords.to_dataset())
+        h5py.File(h5ad_file_name, "a").close()
+
+        in_memory = Matrix.from_anndata(matrix.to_anndata(), attrs={"year": 2020})
+        assert np.array_equal(in_memory.to_csr().toarray(), expected)
+        assert in_memory.attrs["year"] == 2020
+
+        # without a region_id column, the obs names identify regions
+        adata = matrix.to_anndata()
+        adata.obs = adata.obs.drop(columns="region_id")
+        adata.obs_names = ["cell-a", "cell-b"]
+        unlabeled = Matrix.from_anndata(adata)
+        assert unlabeled["region_id"].values.tolist() == ["cell-a", "cell-b"]
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_select(sparse: bool) -> None:
+    matrix = make_matrix(sparse=sparse)
+
+    selected = matrix.select(gene_name=["ACTB"], region_id=[99, 4])
+    assert isinstance(selected, Matrix)
+    assert selected.region_id.values.tolist() == [99, 4]
+    assert np.array_equal(selected.to_csr().toarray(), [[0], [1]])
+    assert matrix.label_index("gene_name") is matrix.label_index("gene_name")
+
+    assert matrix.select(region_id=[4, 99], group_id=43).region_id.values.tolist() == [99]
+
+    with pytest.raises(KeyError):
+        matrix.select(gene_name="GAD1")
+
+    # reassigning a coordinate replaces its cached index
+    matrix.coords["gene_name"] = ("features", ["ACTB", "ACTA"])
+    assert matrix.select(gene_name="ACTB").gene_name.values.tolist() == ["ACTB"]
+    assert np.array_equal(matrix.select(gene_name="ACTB").to_csr().toarray(), [[0], [1]])
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_bitmap_filter(sparse: bool) -> None:
+    matrix = make_matrix(sparse=sparse)
+    matrix = matrix.assign_coords(type_annotation=("regions", ["neuron", "glia"]))
+
+    assert matrix.filter_positions(group_id=[2, 43]).tolist() == [0, 1]
+    assert matrix.filter_positions(group_id=43, type_annotation="glia").tolist() == [1]
+    assert matrix.filter_positions(group_id=43, type_annotation="neuron").tolist() == []
+    assert matrix.filter(type_annotation=["neuron", "astrocyte"]).region_id.values.tolist() == [4]
+
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "archive"
+        matrix.save_zarr(url, bitmap_indexes=["group_id", "type_annotation"])
+
+        reloaded = Matrix.load_zarr(f"{url}.{MATRIX_NAME}.zarr")
+        assert reloaded.is_sparse == sparse
+        assert np.array_equal(reloaded.to_csr().toarray(), matrix.to_csr().toarray())
+        assert reloaded.coords.to_dataset().identical(matrix.coords.to_dataset())
+        assert "type_annotation_bitmap_categories" not in reloaded.coords
+        assert reloaded.filter(type_annotation="glia").region_id.values.tolist() == [99]
+
+    # reassigning a coordinate replaces its cached bitmaps
+    matrix.coords["type_annotation"] = ("regions", ["glia", "neuron"])
+    assert matrix.filter(type_annotation="glia").region_id.values.tolist() == [4]
+
+
+def test_spatial_queries() -> None:
+    rng = np.random.RandomState(0)
+    n_regions = 500
+    x, y = rng.uniform(0, 100, size=(2, n_regions))
+    matrix = Matrix.from_expression_data(
+        data=np.arange(n_regions * 2).reshape(n_regions, 2),
+        coords={
+            "gene_name": ("features", ["ACTA", "ACTB"]),
+            "region_id": ("regions", np.arange(n_regions)),
+            "x_region_microns": ("regions", x),
+            "y_region_microns": ("regions", y),
+        },
+        dims=("regions", "features"),
+        attrs=make_matrix().attrs,
+    )
+
+    in_box = matrix.query_box(x=(10, 30), y=(20, 25))
+    expected = np.flatnonzero((x >= 10) & (x <= 30) & (y >= 20) & (y <= 25))
+    assert isinstance(in_box, Matrix)
+    assert in_box.region_id.values.tolist() == expected.tolist()
+
+    square = [(10, 10), (40, 10), (40, 40), (10, 40)]
+    expected = np.flatnonzero((x > 10) & (x < 40) & (y > 10) & (y < 40))
+    assert matrix.query_polygon(square).region_id.values.tolist() == expected.tolist()
+
+    near = matrix.query_radius((50, 50), 10)
+    expected = np.flatnonzero(np.hypot(x - 50, y - 50) <= 10)
+    assert near.region_id.values.tolist() == expected.tolist()
+
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "archive"
+        matrix.build_spatial_index(tile_size=5)
+        matrix.save_spatial_index(url)
+
+        reloaded = matrix.copy()
+        index = reloaded.load_spatial_index(f"{url}.{MATRIX_NAME}.index.zarr")
+        assert index.tile_size == 5
+        assert reloaded.query_radius((50, 50), 10).region_id.values.tolist() == expected.tolist()
+
+    # moving the regions replaces the cached index
+    matrix.coords["x_region_microns"] = ("regions", x + 100)
+    near = matrix.query_radius((150, 50), 10)
+    assert near.region_id.values.tolist() == expected.tolist()
+
+
+def test_neighbor_graph() -> None:
+    matrix = make_matrix()
+    graph = matrix.neighbor_graph(k=1)
+    assert graph.shape == (2, 2)
+    assert matrix.neighbor_graph(k=1) is graph
+
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "archive"
+        saved = matrix.copy().neighbor_graph(method="radius", radius=1e12, url=url)
+        assert (Path(dirpath) / f"archive.{MATRIX_NAME}.graph.radius-r1e+12.zarr").exists()
+
+        reloaded = matrix.copy().neighbor_graph(method="radius", radius=1e12, url=url)
+        assert (reloaded != saved).nnz == 0
+        assert reloaded.nnz == 2
+
+        # a saved graph of other coordinates is not silently reused
+        moved = matrix.assign_coords(x_region_microns=("regions", [0.0, 5.0]))
+        with pytest.raises(ValueError):
+            moved.neighbor_graph(method="radius", radius=1e12, url=url)
+
+    # nor is a cached one
+    matrix.coords["x_region_microns"] = ("regions", [0.0, 5.0])
+    moved_graph = matrix.neighbor_graph(k=1)
+    assert moved_graph is not graph
+    assert moved_graph[0, 1] == np.hypot(5, matrix.y_region_microns[1] - matrix.y_region_microns[0])
+
+
+def test_spatial_autocorrelation() -> None:
+    result = make_matrix(sparse=True).spatial_autocorrelation(
+        graph=sp.csr_matrix([[0, 1], [1, 0]]), n_permutations=9
+    )
+    assert result.index.tolist() == ["ACTA", "ACTB"]
+    assert np.allclose(result["moran_i"], -1)
+    assert result.columns.tolist() == ["moran_i", "geary_c", "moran_i_p_value", "geary_c_p_value"]
@@ -1,9 +1,13 @@
 from tempfile import TemporaryDirectory
 from pathlib import Path
 
+import dask.array as da
+import numpy as np
+import pytest
+
 from starspace.test.util import make_regions
 from starspace.classes import Regions
-from starspace.constants import REGIONS_NAME
+from starspace.constants import REGIONS_NAME, MATRIX_REQUIRED_REGIONS, MATRIX_OPTIONAL_REGIONS
 
 
 def test_read_write() -> None:
@@ -17,3 +21,70 @@ def test_read_write() -> None:
 
         # assert the matrix isn't mutated upon reading
         assert canada.identical(regions)
+
+
+def test_lazy_and_eager_load() -> None:
+    regions = make_regions()
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath)
+        regions.save_zarr(url=zarr_directory)
+        url = f"{zarr_directory}.{REGIONS_NAME}.zarr"
+
+        lazy = Regions.load_zarr(url=url)
+        assert isinstance(lazy.data, da.Array)
+        assert lazy.data.chunks == regions.data.chunks
+
+        eager = Regions.load_zarr(url=url, eager=True)
+        assert isinstance(eager.data, np.ndarray)
+        assert eager.identical(regions)
+
+
+@pytest.mark.parametrize("chunks", [None, (2, 2), (1, 1)])
+def test_properties(chunks) -> None:
+    regions = make_regions()
+    if chunks is not None:
+        # regions span several chunks, so their partial aggregates have to be merged
+        regions = regions.chunk(chunks)
+
+    properties = regions.properties(pixel_size=2)
+
+    assert list(properties[MATRIX_REQUIRED_REGIONS.REGION_ID.value]) == [1, 2]
+    assert list(properties[MATRIX_OPTIONAL_REGIONS.AREA_PIXELS.value]) == [3, 2]
+    assert np.allclose(properties[MATRIX_REQUIRED_REGIONS.X_REGION.value], [4 / 3, 3])
+    assert np.allclose(properties[MATRIX_REQUIRED_REGIONS.Y_REGION.value], [4 / 3, 4])
+    assert list(properties["max_col"]) == [2, 3]
+
+
+def test_read_write_pyramid() -> None:
+    regions = make_regions()
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath)
+        regions.save_zarr(url=zarr_directory, pyramid_levels=1)
+        url = f"{zarr_directory}.{REGIONS_NAME}.zarr"
+
+        pyramid = Regions.load_pyramid(url)
+        # odd edges are padded, so the coarse level covers the whole image and keeps label 2
+        assert [level.shape for level in pyramid] == [(3, 3), (2, 2)]
+        assert np.array_equal(pyramid[1].compute(), [[1, 0], [0, 2]])
+
+        # the full resolution image still loads on its own
+        assert Regions.load_zarr(url).identical(regions)
+
+
+def test_read_write_rle() -> None:
+    regions = make_regions()
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath)
+        regions.save_zarr(url=zarr_directory, layout="rle")
+
+        reloaded = Regions.load_zarr(url=f"{zarr_directory}.{REGIONS_NAME}.zarr")
+        assert isinstance(reloaded.data, da.Array)
+        assert np.array_equal(reloaded.values, regions.values)
+
+        pyramid = Regions.load_pyramid(f"{zarr_directory}.{REGIONS_NAME}.zarr")
+        assert len(pyramid) == 1
+        assert np.array_equal(pyramid[0].compute(), regions.values)
+        assert reloaded.attrs == regions.attrs
@@ -0,0 +1,43 @@
+import numpy as np
+
+from starspace.spatial import GridIndex
+
+
+def test_grid_index_matches_brute_force() -> None:
+    rng = np.random.RandomState(0)
+    points = rng.uniform(0, 100, size=(2000, 2))
+    index = GridIndex.build(points, tile_size=7)
+
+    inside = np.all((points >= [10, 20]) & (points <= [30, 25]), axis=1)
+    assert np.array_equal(index.query_box([10, 20], [30, 25]), np.flatnonzero(inside))
+
+    distances = np.sqrt(np.sum((points - [50, 50]) ** 2, axis=1))
+    assert np.array_equal(index.query_radius([50, 50], 5), np.flatnonzero(distances <= 5))
+    assert np.array_equal(index.query_knn([50, 50], 10), np.argsort(distances)[:10])
+
+    # points far outside the grid still find their neighbors
+    distances = np.sqrt(np.sum((points - [-500, 50]) ** 2, axis=1))
+    assert np.array_equal(index.query_knn([-500, 50], 3), np.argsort(distances)[:3])
+
+    reloaded = GridIndex.from_dataset(index.to_dataset())
+    assert np.array_equal(reloaded.query_box([10, 20], [30, 25]), np.flatnonzero(inside))
+
+
+def test_query_polygon() -> None:
+    rng = np.random.RandomState(0)
+    points = rng.uniform(0, 100, size=(2000, 2))
+    index = GridIndex.build(points, tile_size=7)
+
+    # a right triangle below the diagonal of the square [20, 60] x [20, 60]
+    triangle = [(20, 20), (60, 20), (60, 60)]
+    x, y = points[:, 0], points[:, 1]
+    inside = (x > 20) & (x < 60) & (y > 20) & (y < x)
+    assert np.array_equal(index.query_polygon(triangle), np.flatnonzero(inside))
+
+
+def test_default_tile_size_of_points_on_a_line() -> None:
+    # the bounding box of points along a line has no area, which mustn't make tiles tiny
+    points = np.stack([np.linspace(0, 1e6, 10_000), np.zeros(10_000)], axis=1)
+    index = GridIndex.build(points)
+    assert index.n_tiles[0] * index.n_tiles[1] <= 101
+    assert np.array_equal(index.query_box([0, -1], [1e3, 1]), np.arange(10))
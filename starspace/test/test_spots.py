@@ -1,8 +1,15 @@
 from tempfile import TemporaryDirectory
 from pathlib import Path
 
-from starspace.test.util import make_spots
-from starspace.constants import SPOTS_NAME
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from starspace.test.util import make_attributes, make_regions, make_spots
+from starspace.classes import Spots
+from starspace.constants import SPOTS_NAME, SPOTS_OPTIONAL_VARIABLES, SPOTS_REQUIRED_VARIABLES, \
+    MATRIX_REQUIRED_FEATURES, SPATIAL_INDEX_NAME, LEGACY_SPOTS_VARIABLES
 
 
 def test_read_write() -> None:
@@ -16,3 +23,135 @@ def test_read_write() -> None:
 
         # assert that data aren't mutated upon reading
         assert see_spot_run.identical(spots)
+
+
+def test_to_spatial_matrix() -> None:
+    spots = make_spots()
+
+    # spots without a region should not be counted
+    region_id = spots[SPOTS_OPTIONAL_VARIABLES.REGION_ID.value].values.astype(float)
+    region_id[3] = np.nan
+    spots[SPOTS_OPTIONAL_VARIABLES.REGION_ID.value] = ("spots", region_id)
+
+    matrix = spots.to_spatial_matrix()
+
+    assert np.issubdtype(matrix.dtype, np.integer)
+    assert np.array_equal(matrix.values, [[1, 0], [0, 1], [1, 0]])
+    assert list(matrix[MATRIX_REQUIRED_FEATURES.GENE_NAME.value].values) == ["ACTA", "ACTB"]
+    assert np.array_equal(matrix[SPOTS_OPTIONAL_VARIABLES.X_REGION.value].values, [2, 3, 8])
+
+
+def test_to_binned_matrix() -> None:
+    spots = make_spots()
+
+    with TemporaryDirectory() as dirpath:
+        url = Path(dirpath) / "archive"
+        spots.save_zarr(url=url)
+        lazy = Spots.load_zarr(f"{url}.{SPOTS_NAME}.zarr")
+        matrix = lazy.to_binned_matrix(bin_size=5)
+
+    assert matrix.is_sparse
+    assert np.array_equal(matrix.to_csr().toarray(), [[1, 1], [1, 0], [0, 1]])
+    assert list(matrix[MATRIX_REQUIRED_FEATURES.GENE_NAME.value].values) == ["ACTA", "ACTB"]
+    assert np.array_equal(matrix[SPOTS_OPTIONAL_VARIABLES.X_REGION.value].values, [2.5, 7.5, 17.5])
+
+    hexes = spots.to_binned_matrix(bin_size=5, shape="hex")
+    assert hexes.to_csr().sum() == 4
+
+
+def test_load_zarr_columns_and_filters() -> None:
+    spots = make_spots()
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath) / "archive.zarr"
+        spots.save_zarr(url=zarr_directory)
+
+        subset = Spots.load_zarr(
+            f"{zarr_directory}.{SPOTS_NAME}.zarr",
+            columns=[SPOTS_REQUIRED_VARIABLES.GENE_NAME, SPOTS_REQUIRED_VARIABLES.X_SPOT],
+            filters=[
+                (SPOTS_REQUIRED_VARIABLES.GENE_NAME, "in", {"ACTA"}),
+                (SPOTS_REQUIRED_VARIABLES.X_SPOT, ">", 4),
+            ],
+        )
+
+        assert set(subset.data_vars) == {
+            SPOTS_REQUIRED_VARIABLES.GENE_NAME.value, SPOTS_REQUIRED_VARIABLES.X_SPOT.value
+        }
+        assert np.array_equal(subset[SPOTS_REQUIRED_VARIABLES.X_SPOT.value].values, [8])
+
+
+def test_load_zarr_legacy_names() -> None:
+    spots = make_spots()
+    region_id = SPOTS_OPTIONAL_VARIABLES.REGION_ID.value
+
+    with TemporaryDirectory() as dirpath:
+        spots.save_zarr(url=f"{dirpath}/current")
+        current = Spots.load_zarr(
+            f"{dirpath}/current.{SPOTS_NAME}.zarr", filters=[(region_id, ">=", 2)]
+        )
+
+        # stores saved before the enums matched the schema hold region_id under y_spot_pixels
+        stored = xr.open_zarr(f"{dirpath}/current.{SPOTS_NAME}.zarr")
+        legacy = stored.rename({
+            new: old for old, new in LEGACY_SPOTS_VARIABLES.items() if new in stored.variables
+        })
+        for variable in legacy.variables.values():
+            variable.encoding = {}
+        legacy.to_zarr(f"{dirpath}/legacy.{SPOTS_NAME}.zarr", consolidated=True)
+
+        reloaded = Spots.load_zarr(
+            f"{dirpath}/legacy.{SPOTS_NAME}.zarr", filters=[(region_id, ">=", 2)],
+            legacy_names=True,
+        )
+        assert np.array_equal(reloaded[region_id].values, [2, 3])
+        assert reloaded.identical(current)
+
+
+def test_spatial_queries() -> None:
+    spots = make_spots()
+
+    with TemporaryDirectory() as dirpath:
+        zarr_directory = Path(dirpath) / "archive.zarr"
+        spots.save_zarr(url=zarr_directory)
+        spots.build_spatial_index(tile_size=2)
+        spots.save_spatial_index(url=zarr_directory)
+
+        lazy_spots = Spots.load_zarr(f"{zarr_directory}.{SPOTS_NAME}.zarr")
+        lazy_spots.load_spatial_index(f"{zarr_directory}.{SPOTS_NAME}.{SPATIAL_INDEX_NAME}.zarr")
+
+        x = SPOTS_REQUIRED_VARIABLES.X_SPOT.value
+        assert np.array_equal(lazy_spots.query_box(x=(3, 10), y=(0, 10))[x].values, [4, 8])
+        assert np.array_equal(lazy_spots.query_radius((2, 0), radius=2.5)[x].values, [2, 4])
+        assert np.array_equal(lazy_spots.query_knn((9, 0), k=2)[x].values, [8, 4])
+
+
+@pytest.mark.parametrize("chunks", [None, (1, 1)])
+def test_assign_regions(chunks) -> None:
+    data = pd.DataFrame({
+        SPOTS_REQUIRED_VARIABLES.GENE_NAME: ["ACTA", "ACTB", "ACTA", "ACTB"],
+        SPOTS_REQUIRED_VARIABLES.Y_SPOT: [0, 2, 0, 1.2],
+        SPOTS_REQUIRED_VARIABLES.X_SPOT: [1, 2, 0, 0.8],
+    })
+    spots = Spots.from_spot_data(data, make_attributes())
+
+    regions = make_regions()
+    if chunks is not None:
+        # labels and centroids are then gathered from several label image chunks
+        regions = regions.chunk(chunks)
+    assigned = spots.assign_regions(regions)
+
+    region_id = assigned[SPOTS_OPTIONAL_VARIABLES.REGION_ID.value].values
+    assert np.array_equal(region_id, [1, 2, np.nan, 1], equal_nan=True)
+    x_region = assigned[SPOTS_OPTIONAL_VARIABLES.X_REGION.value].values
+    assert np.allclose(x_region, [2 / 3, 1.5, np.nan, 2 / 3], equal_nan=True)
+    y_region = assigned[SPOTS_OPTIONAL_VARIABLES.Y_REGION.value].values
+    assert np.allclose(y_region, [2 / 3, 2, np.nan, 2 / 3], equal_nan=True)
+
+
+def test_colocalization() -> None:
+    counts = make_spots().colocalization(radii=[1, 10])
+    assert counts.shape == (2, 2, 2)
+    # the ACTB spot at (4, 1) is within 10 of both ACTA spots, which are 6 apart
+    assert counts.sel(gene_name="ACTA", neighbor_gene_name="ACTB").values.tolist() == [0, 2]
+    assert counts.sel(gene_name="ACTA", neighbor_gene_name="ACTA").values.tolist() == [0, 2]
@@ -0,0 +1,40 @@
+import socket
+
+import pytest
+
+from starspace.classes import Spots
+from starspace.constants import SPOTS_NAME
+from starspace.storage import configure_s3, get_s3_filesystem
+from starspace.test.util import make_spots
+
+moto_server = pytest.importorskip("moto.server")
+
+
+@pytest.fixture
+def s3_endpoint():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    configure_s3(endpoint_url=f"http://127.0.0.1:{port}", key="testing", secret="testing")
+    try:
+        yield
+    finally:
+        configure_s3()
+        server.stop()
+
+
+def test_s3_read_write(s3_endpoint) -> None:
+    filesystem = get_s3_filesystem()
+    filesystem.mkdir("starspace-test")
+    spots = make_spots()
+
+    spots.save_zarr("s3://starspace-test/archive", profile_name=None)
+    url = f"s3://starspace-test/archive.{SPOTS_NAME}.zarr"
+
+    assert filesystem.exists(f"{url}/.zmetadata")
+    assert Spots.load_zarr(url).identical(spots)
+
+    # every call shares one pooled filesystem
+    assert get_s3_filesystem() is filesystem
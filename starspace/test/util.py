@@ -3,6 +3,7 @@ from typing import Dict, Tuple, List
 import xarray as xr
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
 from starspace.constants import *
 from starspace.classes import Matrix, Spots, Regions
@@ -30,9 +31,11 @@ def make_matrix_coords() -> Dict[Enum, Tuple[Enum, List]]:
     return coords
 
 
-def make_matrix() -> Matrix:
+def make_matrix(sparse: bool = False) -> Matrix:
 
     data = np.array([[0, 1], [1, 0]])
+    if sparse:
+        data = sp.csr_matrix(data)
     coords = make_matrix_coords()
     dims = tuple(MATRIX_AXES)
     attrs = make_attributes()